@@ -0,0 +1,336 @@
+# ИИ-ассистент комментариев: категории ключевых слов и шаблоны ответов загружаются из данных,
+# реестр собирается один раз при запуске, ответы кэшируются по id комментария и его ревизии.
+# Источник ответов (бэкенд) - любой объект с методами respond(comment_text, post_title) и respond_many(items)
+# для пакета (текст, заголовок): шаблоны Assistant или внешняя модель HttpModelBackend.
+# Медленные бэкенды работают в пуле JobQueue
+import hashlib
+import itertools
+import json
+import os
+import random
+import secrets
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import InProcessBackend
+
+DEFAULT_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'ai_assistant.json')
+
+
+class Category:
+    def __init__(self, name, keywords, responses):
+        self.name = name
+        self.keywords = list(keywords)
+        self.responses = list(responses)
+
+
+class BackendError(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Assistant:
+    """Реестр категорий: побеждает первая категория (в порядке регистрации), чьё ключевое слово
+    встречается в комментарии как подстрока; без совпадений - ответы fallback"""
+    name = 'template'
+
+    def __init__(self, categories=(), fallback=(), suffix=''):
+        self.categories = []
+        self.fallback = list(fallback)
+        self.suffix = suffix
+        self._matchers = []
+        for category in categories:
+            self.register(category)
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_DATA_PATH):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(categories=[Category(**category) for category in data['categories']],
+                   fallback=data.get('fallback', ()),
+                   suffix=data.get('suffix', ''))
+
+    def register(self, category):
+        self.categories.append(category)
+        self._matchers = [(category, tuple(category.keywords)) for category in self.categories]
+
+    def classify(self, text):
+        """Категория комментария или None; text должен быть в нижнем регистре"""
+        # Поиск подстроки `in` в CPython быстрее общего регулярного выражения по всем словам
+        # (альтернатива с группами в 5 раз медленнее на русском тексте, см. benchmarks/ai_assistant.py)
+        for category, keywords in self._matchers:
+            for word in keywords:
+                if word in text:
+                    return category
+        return None
+
+    def respond(self, comment_text, post_title):
+        category = self.classify(comment_text.lower())
+        responses = category.responses if category else self.fallback
+        return random.choice(responses).format(post_title=post_title) + self.suffix
+
+    def respond_many(self, items):
+        """Ответы для пакета (текст комментария, заголовок поста) за один проход, в порядке items"""
+        return [self.respond(comment_text, post_title) for comment_text, post_title in items]
+
+
+# Модель за HTTP (например, локальный сервер инференса): POST {"comment", "post_title"} -> {"response"},
+# пакет - POST {"items": [{"comment", "post_title"}, ...]} -> {"responses": [...]} одним запросом
+class HttpModelBackend:
+    name = 'http'
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    def respond(self, comment_text, post_title):
+        data = self.post({'comment': comment_text, 'post_title': post_title})
+        if not isinstance(data, dict) or not isinstance(data.get('response'), str):
+            raise BackendError('В ответе модели нет поля response')
+        return data['response']
+
+    def respond_many(self, items):
+        data = self.post({'items': [{'comment': comment_text, 'post_title': post_title}
+                                    for comment_text, post_title in items]})
+        responses = data.get('responses') if isinstance(data, dict) else None
+        if (not isinstance(responses, list) or len(responses) != len(items)
+                or not all(isinstance(response, str) for response in responses)):
+            raise BackendError('В ответе модели нет списка responses по числу комментариев')
+        return responses
+
+    def post(self, payload):
+        body = json.dumps(payload).encode()
+        request = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = json.load(response)
+        except (urllib.error.URLError, socket.timeout, TimeoutError, ConnectionError) as error:
+            raise BackendError(f'Модель недоступна: {error}') from error
+        except ValueError as error:
+            raise BackendError('Модель вернула некорректный JSON') from error
+        return data
+
+
+# Ревизия ответа: время последней правки комментария и заголовок поста. Правка комментария или заголовка
+# даёт новую ревизию, а её вычисление не зависит от длины комментария - текст на каждом запросе не хэшируется.
+# Устойчива между процессами: хранится в БД вместе с заранее подготовленным ответом
+def revision(edited_at, post_title):
+    return hashlib.sha1(f'{edited_at}\x00{post_title}'.encode()).hexdigest()
+
+
+# Кэш ответов: ключ - id комментария и ревизия, так что правка комментария или заголовка даёт новый ответ
+class ResponseCache:
+    def __init__(self, source, max_entries=10000, backend=None):
+        # backend - общее для воркеров хранилище из cache.py; по умолчанию - память процесса
+        self.source = source
+        self.backend = backend or InProcessBackend(max_entries=max_entries)
+
+    @staticmethod
+    def key(comment_id, revision):
+        return f'ai:{comment_id}:{revision}'
+
+    def respond(self, comment_id, revision, comment_text, post_title):
+        key = self.key(comment_id, revision)
+        response = self.backend.get(key)
+        if response is None:
+            response = self.source.respond(comment_text, post_title)
+            self.backend.set(key, response)
+        return response
+
+    def cached_many(self, items):
+        """Только уже готовые ответы для пакета (id комментария, ревизия, ...) -> {id: ответ}; источник не вызывается"""
+        responses = {}
+        for comment_id, revision, *_ in items:
+            response = self.backend.get(self.key(comment_id, revision))
+            if response is not None:
+                responses[comment_id] = response
+        return responses
+
+    def respond_many(self, items):
+        """Ответы для пакета (id комментария, ревизия, текст, заголовок поста) -> {id: ответ}.
+        Промахи кэша уходят в источник одним вызовом respond_many"""
+        responses = self.cached_many(items)
+        misses = [item for item in items if item[0] not in responses]
+        if misses:
+            generated = self.source.respond_many([(comment_text, post_title)
+                                                  for _, _, comment_text, post_title in misses])
+            for (comment_id, revision, _, _), response in zip(misses, generated):
+                self.backend.set(self.key(comment_id, revision), response)
+                responses[comment_id] = response
+        return responses
+
+
+class Job:
+    def __init__(self, job_id, key):
+        self.id = job_id
+        self.key = key
+        self.status = 'pending'
+        self.response = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def finish(self, response=None, error=None):
+        with self._lock:
+            self.response = response
+            self.error = error
+            self.status = 'failed' if error else 'done'
+            self.finished_at = time.time()
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        """callback(job) вызывается в потоке воркера по завершении; для завершённого задания - сразу"""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait(self, timeout):
+        return self._done.wait(timeout)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Снимок задания другого процесса по to_dict() из общего хранилища"""
+        job = cls(data['job_id'], None)
+        job.status, job.response, job.error = data['status'], data['response'], data['error']
+        if job.status in ('done', 'failed'):
+            job._done.set()
+        return job
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'response': self.response,
+            'error': self.error,
+        }
+
+
+# Очередь заданий на ответ ИИ: пул из max_workers потоков и не больше max_pending незавершённых заданий.
+# Повторный вопрос о том же комментарии (тот же ключ кэша) присоединяется к уже идущему заданию
+class JobQueue:
+    def __init__(self, responses, max_workers=4, max_pending=100, keep_finished=1000):
+        self.responses = responses
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.keep_finished = keep_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-worker')
+        self._jobs = OrderedDict()
+        self._in_flight = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def submit(self, comment_id, revision, comment_text, post_title):
+        key = self.responses.key(comment_id, revision)
+        cached = self.responses.backend.get(key)
+        with self._lock:
+            if cached is not None:
+                job = self._add(key)
+                job.finish(cached)
+                return job
+            job = self._in_flight.get(key)
+            if job is not None:
+                self.coalesced += 1
+                return job
+            if len(self._in_flight) >= self.max_pending:
+                raise QueueFull('Слишком много запросов к ИИ, попробуйте позже')
+            job = self._add(key)
+            self._in_flight[key] = job
+        self._executor.submit(self._run, job, comment_id, revision, comment_text, post_title)
+        return job
+
+    def submit_many(self, items, limit=None):
+        """Задания для пакета (id комментария, ревизия, текст, заголовок поста). Новые задания выполняются
+        одним вызовом respond_many в одном потоке пула; их не больше limit, чтобы один пакет не занял
+        всю очередь. Возвращает ({id: задание}, [id, которые очередь не приняла])"""
+        cached = self.responses.cached_many(items)
+        jobs = {}
+        new = []
+        rejected = []
+        with self._lock:
+            for comment_id, revision, comment_text, post_title in items:
+                key = self.responses.key(comment_id, revision)
+                if comment_id in cached:
+                    jobs[comment_id] = self._add(key)
+                    jobs[comment_id].finish(cached[comment_id])
+                elif key in self._in_flight:
+                    self.coalesced += 1
+                    jobs[comment_id] = self._in_flight[key]
+                elif len(self._in_flight) >= self.max_pending or (limit is not None and len(new) >= limit):
+                    rejected.append(comment_id)
+                else:
+                    job = jobs[comment_id] = self._in_flight[key] = self._add(key)
+                    new.append((job, (comment_id, revision, comment_text, post_title)))
+        if new:
+            self._executor.submit(self._run_many, new)
+        return jobs, rejected
+
+    def _add(self, key):
+        # Случайная часть - из os.urandom: у воркеров, созданных fork, одинаковое состояние random
+        job = Job(f'{next(self._ids):x}-{secrets.token_hex(4)}', key)
+        self._jobs[job.id] = job
+        # Завершённые задания хранятся ограниченно - для опроса статуса страницей
+        while len(self._jobs) > self.keep_finished + len(self._in_flight):
+            oldest = next(iter(self._jobs.values()))
+            if oldest.status not in ('done', 'failed'):
+                break
+            self._jobs.popitem(last=False)
+        return job
+
+    def _run(self, job, comment_id, revision, comment_text, post_title):
+        job.status = 'running'
+        try:
+            response = self.responses.respond(comment_id, revision, comment_text, post_title)
+        except Exception as error:
+            job.finish(error=str(error))
+        else:
+            job.finish(response)
+        finally:
+            with self._lock:
+                self._in_flight.pop(job.key, None)
+
+    def _run_many(self, new):
+        for job, _ in new:
+            job.status = 'running'
+        try:
+            responses = self.responses.respond_many([item for _, item in new])
+        except Exception as error:
+            for job, _ in new:
+                job.finish(error=str(error))
+        else:
+            for job, item in new:
+                job.finish(responses[item[0]])
+        finally:
+            with self._lock:
+                for job, _ in new:
+                    self._in_flight.pop(job.key, None)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.responses.source.name,
+                'workers': self.max_workers,
+                'in_flight': len(self._in_flight),
+                'jobs': len(self._jobs),
+                'coalesced': self.coalesced,
+            }
@@ -0,0 +1,71 @@
+# Разбор параметров JSON API (/api/v1) и сериализация строк Core (Row) в JSON без создания ORM-объектов:
+# ?fields= - нужные поля ресурса, ?include= - связанные данные, ?ids= - пакетная выборка по id
+from datetime import datetime
+
+
+class ApiError(Exception):
+    """Ошибка запроса к API: текст уходит клиенту в {"error": ...} со статусом status"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_list(value):
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+def parse_fields(value, available, default):
+    """Поля из ?fields=id,title в порядке available; без параметра - default"""
+    names = parse_list(value)
+    if not names:
+        return list(default)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiError(f'Неизвестные поля: {", ".join(unknown)}')
+    return [name for name in available if name in names]
+
+
+def parse_include(value, available):
+    names = parse_list(value)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiError(f'Неизвестные связанные данные: {", ".join(unknown)}')
+    return [name for name in available if name in names]
+
+
+def parse_ids(value, limit):
+    """id из ?ids=3,1,2 без повторов, в порядке запроса"""
+    try:
+        ids = list(dict.fromkeys(int(item) for item in parse_list(value)))
+    except ValueError:
+        raise ApiError('ids - целые числа через запятую')
+    if not ids:
+        raise ApiError('Пустой список ids')
+    if len(ids) > limit:
+        raise ApiError(f'Не больше {limit} id за запрос')
+    return ids
+
+
+def to_json(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def serialize(row, names):
+    """Строка запроса -> dict из колонок names. Колонки 'author__username' собираются во вложенный объект
+    author; если все его колонки NULL (нет связанной строки в LEFT JOIN), вместо объекта - None"""
+    mapping = row._mapping
+    item = {}
+    groups = set()
+    for name in names:
+        value = to_json(mapping[name])
+        group, _, key = name.partition('__')
+        if key:
+            item.setdefault(group, {})[key] = value
+            groups.add(group)
+        else:
+            item[name] = value
+    for group in groups:
+        if all(value is None for value in item[group].values()):
+            item[group] = None
+    return item
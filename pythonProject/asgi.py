@@ -0,0 +1,260 @@
+# Запуск форума под ASGI-сервером: uvicorn asgi:application --host 0.0.0.0 --port 5000
+# (нужны пакеты uvicorn и aiosqlite). Горячие страницы для чтения - лента, пост, ответ ИИ и опрос задания ИИ -
+# выполняются в цикле событий через асинхронный движок SQLAlchemy (aiosqlite): медленный клиент или длинный
+# опрос задания не занимает поток. Остальные маршруты и запись (POST) идут в то же WSGI-приложение Flask
+# в пуле из ASGI_THREADS потоков. Хуки Flask (сессия, роли, метрики, бюджеты SQL, кэш страниц) работают
+# одинаково в обоих режимах; SQL-запросы асинхронного движка попадают в те же метрики и проверки
+import asyncio
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import abort, g, jsonify, request, request_started, session
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.exceptions import HTTPException
+
+import main
+from main import app, db
+from sqlite_profile import install_pragmas, production_pragmas
+
+
+def make_async_engine():
+    # Та же БД, что у синхронного движка (путь уже разрешён Flask-SQLAlchemy относительно instance/)
+    with app.app_context():
+        url = db.engine.url.set(drivername='sqlite+aiosqlite')
+    options = {}
+    if app.config['DB_PROFILE'] == 'production':
+        options = {'pool_size': app.config['DB_POOL_SIZE'], 'max_overflow': app.config['DB_MAX_OVERFLOW']}
+    engine = create_async_engine(url, **options)
+    if app.config['DB_PROFILE'] == 'production':
+        install_pragmas(engine.sync_engine, production_pragmas(busy_timeout=app.config['DB_BUSY_TIMEOUT'],
+                                                               mmap_size=app.config['DB_MMAP_SIZE'],
+                                                               cache_size=app.config['DB_CACHE_SIZE']))
+    event.listen(engine.sync_engine, 'after_cursor_execute', main.check_query_plan)
+    event.listen(engine.sync_engine, 'before_cursor_execute', main.sql_started)
+    event.listen(engine.sync_engine, 'after_cursor_execute', main.sql_finished)
+    event.listen(engine.sync_engine, 'handle_error', main.sql_failed)
+    return engine
+
+
+async_engine = make_async_engine()
+async_sessions = async_sessionmaker(async_engine, expire_on_commit=False)
+wsgi_threads = ThreadPoolExecutor(max_workers=app.config['ASGI_THREADS'], thread_name_prefix='wsgi')
+
+
+# Асинхронные версии маршрутов: те же запросы (main.*_statement), проверки и шаблоны, что у синхронных
+@main.cached_page('feed')
+async def index():
+    cursor = request.args.get('cursor')
+    stamps = (await g.async_session.execute(main.feed_stamp_statement(cursor))).all()
+    unchanged = main.not_modified(*main.feed_validators(stamps, cursor))
+    if unchanged:
+        return unchanged
+
+    viewer_id = session.get('user_id')
+    posts, next_cursor = main.split_page((await g.async_session.scalars(main.feed_statement(cursor))).all(),
+                                         app.config['POSTS_PER_PAGE'], main.created_at_key)
+    liked_post_ids = set()
+    if viewer_id and posts:
+        liked_statement = main.liked_statement(viewer_id, [post.id for post in posts])
+        liked_post_ids = set(await g.async_session.scalars(liked_statement))
+    return main.render_feed(cursor, posts, next_cursor, *main.buffered_likes(posts, viewer_id, liked_post_ids))
+
+
+@main.cached_page('post:{post_id}')
+async def view_post(post_id):
+    cursor = request.args.get('cursor')
+    stamp = (await g.async_session.execute(main.post_stamp_statement(post_id))).first()
+    unchanged = main.not_modified(*main.post_validators(stamp, post_id, cursor))
+    if unchanged:
+        return unchanged
+
+    post = (await g.async_session.scalars(main.post_statement(post_id))).first()
+    if post is None:
+        abort(404)
+    comments = (await g.async_session.scalars(main.comments_statement(post_id, cursor))).all()
+    comments, next_cursor = main.split_page(comments, app.config['COMMENTS_PER_PAGE'], main.created_at_key)
+    return main.render_post(post, cursor, comments, next_cursor)
+
+
+async def ai_assistant(comment_id):
+    comment = (await g.async_session.execute(main.ai_comment_statement(comment_id))).first()
+    response, job = main.stored_or_submitted(comment, comment_id)
+    if response is not None:
+        return response
+    await wait_for_job(job, app.config['AI_SYNC_WAIT'])
+    return main.ai_job_response(job, comment_id)
+
+
+async def ai_job_status(job_id):
+    job = main.find_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Задание не найдено'}), 404
+    if main.is_local_job(job):
+        await wait_for_job(job, main.long_poll_timeout())
+    else:
+        # Задание другого воркера (serve.py): ждём, опрашивая общее хранилище
+        deadline = time.monotonic() + main.long_poll_timeout()
+        while job.status not in ('done', 'failed') and time.monotonic() < deadline:
+            await asyncio.sleep(app.config['AI_JOB_POLL_INTERVAL'])
+            job = main.find_job(job_id) or job
+    return main.ai_job_response(job)
+
+
+async def wait_for_job(job, timeout):
+    """Как job.wait(timeout), но без блокировки цикла событий: воркер ИИ будит запрос через колбэк"""
+    if timeout <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def wake(future):
+        if not future.done():
+            future.set_result(None)
+
+    job.add_done_callback(lambda job: loop.call_soon_threadsafe(wake, done))
+    try:
+        await asyncio.wait_for(done, timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+# Endpoint -> асинхронная версия; только для GET и HEAD, POST на /post/<id> обрабатывает Flask
+ASYNC_VIEWS = {
+    'index': index,
+    'view_post': view_post,
+    'ai_assistant': ai_assistant,
+    'ai_job_status': ai_job_status,
+}
+
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin-1')
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    return environ
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return body
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_response(send, status, headers, chunks, head):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+    if not head:
+        # Куски потоковой страницы уходят клиенту по мере рендеринга
+        for chunk in chunks:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def dispatch_async(view, environ):
+    """Обработка запроса как в Flask.wsgi_app, но с асинхронным представлением"""
+    with app.request_context(environ):
+        async with async_sessions() as async_session:
+            g.async_session = async_session
+            try:
+                try:
+                    # Пользователь для хуков before_request загружается заранее, без синхронного запроса
+                    user_id = session.get('user_id')
+                    if user_id is not None:
+                        g.current_user = (main.cached_identity(user_id)
+                                          or main.remember_identity(await g.async_session.get(main.User, user_id)))
+                    request_started.send(app, _async_wrapper=app.ensure_sync)
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        rv = await view(**request.view_args)
+                except Exception as error:
+                    rv = app.handle_user_exception(error)
+                response = app.finalize_request(rv)
+            except Exception as error:
+                response = app.handle_exception(error)
+    # Тело потоковой страницы рендерится при отправке: stream_template сам вернёт контекст запроса
+    return response
+
+
+def dispatch_wsgi(environ):
+    result = {}
+
+    def start_response(status, headers, exc_info=None):
+        result['status'] = int(status.split(' ', 1)[0])
+        result['headers'] = headers
+
+    iterable = app(environ, start_response)
+    try:
+        chunks = list(iterable)
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+    return result['status'], result['headers'], chunks
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await async_engine.dispose()
+            wsgi_threads.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        raise RuntimeError(f'Неподдерживаемый тип соединения ASGI: {scope["type"]}')
+
+    environ = wsgi_environ(scope, await read_body(receive))
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        endpoint = None
+    view = ASYNC_VIEWS.get(endpoint)
+    if view is not None and scope['method'] in ('GET', 'HEAD'):
+        response = await dispatch_async(view, environ)
+        try:
+            await send_response(send, response.status_code, list(response.headers.items()), response.iter_encoded(),
+                                scope['method'] == 'HEAD')
+        finally:
+            response.close()
+    else:
+        # Ответ WSGI-приложения собирается целиком в потоке пула: итерировать его из цикла событий нельзя
+        loop = asyncio.get_running_loop()
+        status, headers, chunks = await loop.run_in_executor(wsgi_threads, dispatch_wsgi, environ)
+        await send_response(send, status, headers, chunks, scope['method'] == 'HEAD')
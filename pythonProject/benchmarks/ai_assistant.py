@@ -0,0 +1,96 @@
+# Микробенчмарк ИИ-ассистента на длинных комментариях: python benchmarks/ai_assistant.py
+# Сравнивает прежнюю реализацию (списки слов и f-строки на каждый вызов), Assistant, поиск
+# одним регулярным выражением по всем словам и повторные запросы через ResponseCache.
+# Каждый вызов получает новые объекты строк, как запрос из БД: иначе повторно использованная строка
+# приносит с собой уже посчитанный hash() и замеры получаются завышенными
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ai_assistant import Assistant, ResponseCache, revision  # noqa: E402
+
+FILLER = ('сегодня вечером в нашем доме снова отключили горячую воду и никто не предупредил жильцов '
+          'заранее управляющая компания обещает разобраться до конца недели').split()
+
+
+def legacy_response(comment_text, post_title):
+    comment_lower = comment_text.lower()
+    if any(word in comment_lower for word in ['помощь', 'помогите', 'не знаю', 'совет', 'как']):
+        responses = [f"💡 Совет по теме '{post_title}': ...", "🔍 ...", "📚 ..."]
+    elif any(word in comment_lower for word in ['ошибка', 'баг', 'не работает', 'сломалось', 'проблема']):
+        responses = ["🛠️ ...", "🐞 ...", "✅ ..."]
+    elif any(word in comment_lower for word in ['спасибо', 'благодарю', 'отлично', 'класс', 'понял']):
+        responses = ["😊 ...", "🌟 ...", "🚀 ..."]
+    elif any(word in comment_lower for word in ['безопасность', 'пароль', 'данные', 'хакер', 'угроза']):
+        responses = ["🔒 ...", "🛡️ ...", "⚠️ ..."]
+    else:
+        responses = [f"🤔 ... '{post_title}' ...", "💡 ...", f"📚 ... '{post_title}' ...", "✨ ..."]
+    return random.choice(responses) + " 🤖"
+
+
+# Вариант с одним скомпилированным выражением: группа c<N> - категория N, после совпадения
+# ищутся только слова более приоритетных категорий
+def regex_classifier(assistant):
+    groups = []
+    patterns = [None]
+    for index, category in enumerate(assistant.categories):
+        groups.append(f'(?P<c{index}>{"|".join(re.escape(word) for word in category.keywords)})')
+        patterns.append(re.compile('|'.join(groups)))
+
+    def classify(text):
+        best, pattern, position = None, patterns[-1], 0
+        while pattern is not None:
+            match = pattern.search(text, position)
+            if match is None:
+                break
+            best = int(match.lastgroup[1:])
+            pattern, position = patterns[best], match.start() + 1
+        return best
+    return classify
+
+
+def fresh(text):
+    # Срез создаёт новый объект строки без кэшированного hash(); время копирования - строка «копия строк»
+    return (text + '.')[:-1]
+
+
+def comments(rng, words):
+    text = ' '.join(rng.choice(FILLER) for _ in range(words))
+    return {
+        'без ключевых слов': text,
+        'слово в начале': 'Помогите! ' + text,
+        'слово в конце': text + ' Утечка данных, сменил пароль.',
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Вызовов в секунду для ответа ИИ-ассистента')
+    parser.add_argument('--words', type=int, default=2000, help='длина комментария в словах')
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    assistant = Assistant.from_file()
+    cache = ResponseCache(assistant)
+    regex_classify = regex_classifier(assistant)
+    title = 'Отключение горячей воды'
+    edited_at = datetime(2026, 1, 1)
+    for label, text in comments(random.Random(1), args.words).items():
+        print(f'{label} ({len(text)} символов):')
+        cache.respond(1, revision(edited_at, title), text, title)
+        for name, call in (('копия строк', lambda: (fresh(text), fresh(title))),
+                           ('прежняя реализация', lambda: legacy_response(fresh(text), fresh(title))),
+                           ('Assistant.respond', lambda: assistant.respond(fresh(text), fresh(title))),
+                           ('регулярное выражение', lambda: regex_classify(fresh(text).lower())),
+                           ('ResponseCache, попадание',
+                            lambda: cache.respond(1, revision(edited_at, fresh(title)), fresh(text), fresh(title)))):
+            seconds = timeit.timeit(call, number=args.number)
+            print(f'  {name:<26} {args.number / seconds:12,.0f} вызовов/с')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# Локальная заглушка модели для HttpModelBackend: python benchmarks/ai_model_stub.py --delay 3
+# Принимает POST {"comment", "post_title"} и через --delay секунд отвечает {"response"} шаблонами Assistant;
+# пакет POST {"items": [{"comment", "post_title"}, ...]} - одним ответом {"responses": [...]} с той же задержкой.
+# Запуск форума против заглушки: FLASK_AI_BACKEND=http FLASK_AI_MODEL_URL=http://127.0.0.1:8081/generate
+import argparse
+import json
+import os
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ai_assistant import DEFAULT_DATA_PATH, Assistant  # noqa: E402
+
+
+def make_handler(assistant, delay):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                if 'items' in body:
+                    result = {'responses': assistant.respond_many(
+                        [(item['comment'], item.get('post_title', '')) for item in body['items']])}
+                else:
+                    result = {'response': assistant.respond(body['comment'], body.get('post_title', ''))}
+            except (ValueError, KeyError, TypeError, AttributeError):
+                self.send_error(400, 'Ожидается JSON с полем comment или списком items')
+                return
+            time.sleep(delay)
+            data = json.dumps(result, ensure_ascii=False).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--delay', type=float, default=2.0, help='задержка ответа, с')
+    args = parser.parse_args()
+
+    assistant = Assistant.from_file(DEFAULT_DATA_PATH)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(assistant, args.delay))
+    print(f'Заглушка модели: http://{args.host}:{args.port}/generate, задержка {args.delay} с')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+# Сравнение WSGI- и ASGI-запуска форума при большом числе одновременных соединений:
+#   python benchmarks/asgi_vs_wsgi.py --db instance/forum.db --concurrency 256
+# Поднимает по очереди flask run (многопоточный WSGI-сервер, как app.run в main.py) и uvicorn asgi:application
+# на одной и той же базе, с ответами ИИ от заглушки модели (ai_model_stub.py, --ai-delay секунд на ответ).
+# Клиент асинхронный: --concurrency соединений одновременно, каждое на один запрос. Сценарий ai_long_poll
+# запрашивает ответ ИИ и ждёт его длинным опросом status_url?wait=30. Кроме p50/p99 и запросов в секунду
+# печатает наибольшее число потоков сервера за сценарий. Кэш страниц выключен, чтобы мерить запросы к БД
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime
+
+from load_test import RESULTS_DIR, ROOT, current_commit, id_ranges, pick, summarize
+
+SCENARIOS = {
+    'index': lambda rng, ids: '/',
+    'view_post': lambda rng, ids: f'/post/{pick(rng, ids["posts"])}',
+    'ai_long_poll': lambda rng, ids: f'/ai_assistant/{rng.randint(*ids["comments"])}',
+}
+
+SERVERS = {
+    'wsgi': lambda port: [sys.executable, '-m', 'flask', '--app', 'main', 'run', '--with-threads', '--port', str(port)],
+    'asgi': lambda port: [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', str(port),
+                          '--log-level', 'warning', '--no-access-log'],
+}
+
+
+async def get(port, path):
+    """(статус, тело) запроса GET по отдельному соединению; 599 - соединение не удалось"""
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nConnection: close\r\n\r\n'.encode())
+        data = await reader.read()
+        writer.close()
+        head, _, body = data.partition(b'\r\n\r\n')
+        return int(head.split(b' ', 2)[1]), body
+    except (OSError, IndexError, ValueError):
+        return 599, b''
+
+
+async def visit(port, path):
+    status, body = await get(port, path)
+    # Ответ ИИ, который ещё готовится, дожидаемся длинным опросом, как страница поста
+    while status == 202:
+        status, body = await get(port, json.loads(body)['status_url'] + '?wait=30')
+    return status
+
+
+async def run_scenario(port, paths, concurrency):
+    results = []
+    queue = iter(paths)
+
+    async def worker():
+        for path in queue:
+            started = time.perf_counter()
+            status = await visit(port, path)
+            results.append((status, time.perf_counter() - started, None))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+def thread_count(pid):
+    try:
+        with open(f'/proc/{pid}/status', encoding='utf-8') as file:
+            return next(int(line.split()[1]) for line in file if line.startswith('Threads:'))
+    except (OSError, StopIteration):
+        return None
+
+
+async def measure(port, pid, paths, concurrency):
+    peak = 0
+
+    async def sample():
+        nonlocal peak
+        while True:
+            peak = max(peak, thread_count(pid) or 0)
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.create_task(sample())
+    started = time.perf_counter()
+    results = await run_scenario(port, paths, concurrency)
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+    return results, elapsed, peak or None
+
+
+def wait_ready(port, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'Сервер на порту {port} завершился с кодом {process.returncode}')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f'Сервер на порту {port} не запустился за {timeout} с')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение WSGI и ASGI при большом числе соединений')
+    parser.add_argument('--db', required=True, help='файл SQLite с данными (flask --app main seed-data)')
+    parser.add_argument('--requests', type=int, default=2000, help='запросов на сценарий')
+    parser.add_argument('--concurrency', type=int, default=256, help='одновременных соединений')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--servers', default=','.join(SERVERS))
+    parser.add_argument('--port', type=int, default=5100)
+    parser.add_argument('--ai-delay', type=float, default=1.0, help='секунд на ответ заглушки модели')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=RESULTS_DIR)
+    args = parser.parse_args()
+
+    ids = id_ranges(args.db)
+    model_port = args.port + 99
+    env = dict(os.environ,
+               FLASK_SQLALCHEMY_DATABASE_URI=f'sqlite:///{os.path.abspath(args.db)}',
+               FLASK_DB_PROFILE='production',
+               FLASK_PAGE_CACHE_ENABLED='false',
+               FLASK_AI_BACKEND='http',
+               FLASK_AI_MODEL_URL=f'http://127.0.0.1:{model_port}/generate',
+               FLASK_AI_WORKERS=str(args.concurrency),
+               FLASK_AI_MAX_PENDING=str(args.requests * 2))
+    model = subprocess.Popen([sys.executable, os.path.join(ROOT, 'benchmarks', 'ai_model_stub.py'),
+                              '--port', str(model_port), '--delay', str(args.ai_delay)],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    report = {}
+    try:
+        for name in args.servers.split(','):
+            process = subprocess.Popen(SERVERS[name](args.port), cwd=ROOT, env=env,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_ready(args.port, process)
+                print(f'{name}:')
+                report[name] = {}
+                rng = random.Random(args.seed)
+                for scenario in args.scenarios.split(','):
+                    paths = [SCENARIOS[scenario](rng, ids) for _ in range(args.requests)]
+                    results, elapsed, peak = asyncio.run(measure(args.port, process.pid, paths, args.concurrency))
+                    stats = report[name][scenario] = dict(summarize(results, elapsed), threads_peak=peak)
+                    print(f'  {scenario:<13} p50 {stats["p50_ms"]:8.1f} мс   p99 {stats["p99_ms"]:8.1f} мс   '
+                          f'{stats["rps"]:8.1f} зап/с   потоков {peak}   ошибок {stats["errors"]}')
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        model.terminate()
+        model.wait()
+
+    commit = current_commit()
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f'{datetime.now():%Y%m%d-%H%M%S}-{commit}-asgi.json')
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({'commit': commit, 'created_at': datetime.now().isoformat(timespec='seconds'),
+                   'requests': args.requests, 'concurrency': args.concurrency, 'ai_delay': args.ai_delay,
+                   'servers': report}, file, ensure_ascii=False, indent=2)
+    print(f'Результат сохранён: {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+# Нагрузочный тест маршрутов форума на заполненной базе (flask --app main seed-data):
+#   python benchmarks/load_test.py --db instance/forum.db                 - в процессе, через тестовый клиент Flask
+#   python benchmarks/load_test.py --db instance/forum.db --http http://127.0.0.1:5000 --concurrency 16
+# Во втором случае сервер запускается с FLASK_SERVER_TIMING=true, иначе число SQL-запросов неизвестно.
+# Печатает p50/p99, запросы в секунду и SQL-запросов на запрос по сценариям и сохраняет результат
+# в benchmarks/results/<время>-<коммит>.json; --compare <файл> показывает изменение относительно прошлого замера
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+SQL_COUNT = re.compile(r'desc="(\d+) SQL"')
+
+# Имя -> (метод, путь по id из базы, нужен ли вход)
+SCENARIOS = {
+    'index_anon': ('GET', lambda rng, ids: '/', False),
+    'index': ('GET', lambda rng, ids: '/', True),
+    'view_post': ('GET', lambda rng, ids: f'/post/{pick(rng, ids["posts"])}', True),
+    'like_post': ('GET', lambda rng, ids: f'/like_post/{pick(rng, ids["posts"])}', True),
+    'api_like': ('POST', lambda rng, ids: f'/api/posts/{pick(rng, ids["posts"])}/like', True),
+    'admin_panel': ('GET', lambda rng, ids: '/admin', True),
+    'admin_posts': ('GET', lambda rng, ids: '/admin/posts', True),
+    'admin_comments': ('GET', lambda rng, ids: '/admin/comments', True),
+    'admin_users': ('GET', lambda rng, ids: '/admin/users', True),
+    'ai_assistant': ('GET', lambda rng, ids: f'/ai_assistant/{pick(rng, ids["comments"])}', False),
+}
+
+
+def pick(rng, id_range):
+    # Как и в seed.py, первые посты популярнее остальных
+    low, high = id_range
+    return low + int((high - low + 1) * rng.random() ** 3)
+
+
+def id_ranges(db_path):
+    with sqlite3.connect(f'file:{db_path}?mode=ro', uri=True) as connection:
+        ranges = {table: connection.execute(f'SELECT min(id), max(id) FROM {table}').fetchone()
+                  for table in ('post', 'comment')}
+    if None in ranges['post'] or None in ranges['comment']:
+        raise SystemExit('В базе нет постов или комментариев: заполните её командой flask --app main seed-data')
+    return {'posts': ranges['post'], 'comments': ranges['comment']}
+
+
+def sql_count(header):
+    match = SQL_COUNT.search(header or '')
+    return int(match.group(1)) if match else None
+
+
+class TestClientDriver:
+    """Запросы в том же процессе; один поток, без сети - время самого приложения"""
+
+    def __init__(self, db_path, username, password):
+        os.environ['FLASK_SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.abspath(db_path)}'
+        os.environ['FLASK_SERVER_TIMING'] = 'true'
+        sys.path.insert(0, ROOT)
+        import main
+        self.app = main.app
+        self.anonymous = self.app.test_client()
+        self.client = self.app.test_client()
+        response = self.client.post('/login', data={'username': username, 'password': password})
+        if response.status_code != 302:
+            raise SystemExit(f'Не удалось войти как {username}')
+
+    def request(self, method, path, login):
+        client = self.client if login else self.anonymous
+        started = time.perf_counter()
+        response = client.open(path, method=method)
+        elapsed = time.perf_counter() - started
+        return response.status_code, elapsed, sql_count(response.headers.get('Server-Timing'))
+
+    def run(self, method, paths, login, concurrency):
+        return [self.request(method, path, login) for path in paths]
+
+
+class HttpDriver:
+    """Запросы к работающему серверу из concurrency потоков, у каждого своя сессия"""
+
+    def __init__(self, base_url, username, password):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+
+    def opener(self, login):
+        jar = http.cookiejar.CookieJar()
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar), NoRedirect())
+        if login:
+            body = urllib.parse.urlencode({'username': self.username, 'password': self.password}).encode()
+            try:
+                opener.open(self.base_url + '/login', data=body).close()
+            except urllib.error.HTTPError as error:
+                # Успешный вход отвечает 302 на главную
+                if error.code != 302:
+                    raise
+            if not any(cookie.name == 'session' for cookie in jar):
+                raise SystemExit(f'Не удалось войти как {self.username}')
+        return opener
+
+    def request(self, opener, method, path):
+        request = urllib.request.Request(self.base_url + path, method=method,
+                                         data=b'' if method == 'POST' else None)
+        started = time.perf_counter()
+        try:
+            with opener.open(request) as response:
+                response.read()
+                status, header = response.status, response.headers.get('Server-Timing')
+        except urllib.error.HTTPError as error:
+            status, header = error.code, error.headers.get('Server-Timing')
+        return status, time.perf_counter() - started, sql_count(header)
+
+    def run(self, method, paths, login, concurrency):
+        results = []
+        lock = threading.Lock()
+        queue = iter(paths)
+
+        def worker():
+            opener = self.opener(login)
+            while True:
+                with lock:
+                    path = next(queue, None)
+                if path is None:
+                    return
+                result = self.request(opener, method, path)
+                with lock:
+                    results.append(result)
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Ответ 302 после лайка меряем сам по себе, без загрузки страницы поста
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(results, wall_seconds):
+    latencies = [elapsed * 1000 for status, elapsed, queries in results]
+    queries = [queries for status, elapsed, queries in results if queries is not None]
+    return {
+        'requests': len(results),
+        'errors': sum(1 for status, elapsed, queries in results if status >= 500),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'rps': round(len(results) / wall_seconds, 1),
+        'queries_per_request': round(statistics.mean(queries), 2) if queries else None,
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(previous_path, scenarios):
+    with open(previous_path, encoding='utf-8') as file:
+        previous = json.load(file)
+    print(f'Сравнение с {previous["commit"]} ({previous["created_at"]}):')
+    for name, current in scenarios.items():
+        before = previous['scenarios'].get(name)
+        if not before:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p99_ms', 'rps'):
+            if before[key]:
+                changes.append(f'{key} {(current[key] - before[key]) / before[key] * 100:+.0f}%')
+        print(f'  {name:<15} ' + '   '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест маршрутов форума')
+    parser.add_argument('--db', required=True, help='файл SQLite с данными (для выбора id постов и комментариев)')
+    parser.add_argument('--http', help='адрес работающего сервера; без него - тестовый клиент Flask')
+    parser.add_argument('--requests', type=int, default=200, help='запросов на сценарий')
+    parser.add_argument('--concurrency', type=int, default=8, help='потоков в режиме --http')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=RESULTS_DIR)
+    parser.add_argument('--compare', help='файл прошлого замера')
+    args = parser.parse_args()
+
+    ids = id_ranges(args.db)
+    rng = random.Random(args.seed)
+    if args.http:
+        driver = HttpDriver(args.http, args.username, args.password)
+    else:
+        driver = TestClientDriver(args.db, args.username, args.password)
+
+    scenarios = {}
+    for name in args.scenarios.split(','):
+        method, path, login = SCENARIOS[name]
+        paths = [path(rng, ids) for _ in range(args.requests)]
+        started = time.perf_counter()
+        results = driver.run(method, paths, login, args.concurrency)
+        scenarios[name] = summarize(results, time.perf_counter() - started)
+        stats = scenarios[name]
+        queries = '-' if stats['queries_per_request'] is None else f'{stats["queries_per_request"]:g}'
+        print(f'  {name:<15} p50 {stats["p50_ms"]:8.2f} мс   p99 {stats["p99_ms"]:8.2f} мс   '
+              f'{stats["rps"]:8.1f} зап/с   SQL {queries:>5}   ошибок {stats["errors"]}')
+
+    commit = current_commit()
+    report = {
+        'commit': commit,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'mode': 'http' if args.http else 'test_client',
+        'requests': args.requests,
+        'concurrency': args.concurrency if args.http else 1,
+        'scenarios': scenarios,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f'{datetime.now():%Y%m%d-%H%M%S}-{commit}.json')
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f'Результат сохранён: {path}')
+    if args.compare:
+        compare(args.compare, scenarios)
+
+
+if __name__ == '__main__':
+    main()
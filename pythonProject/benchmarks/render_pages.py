@@ -0,0 +1,126 @@
+# Размер HTML и время рендеринга страниц форума на заполненной базе (flask --app main seed-data):
+#   python benchmarks/render_pages.py --db instance/forum.db --compare benchmarks/results/<прошлый замер>.json
+# Страницы запрашиваются тестовым клиентом Flask с выключенным кэшем страниц; время шаблонов берётся
+# из Server-Timing (tpl). Отдельно меряется компиляция всех шаблонов в новом процессе: первый запуск
+# с пустым кэшем байт-кода Jinja и второй - с заполненным
+import argparse
+import gzip
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+from load_test import RESULTS_DIR, ROOT, TestClientDriver, current_commit, id_ranges, percentile
+
+RENDER_TIME = re.compile(r'tpl;dur=([\d.]+)')
+
+# Имя -> (путь по id из базы, нужен ли вход). Первый пост - самый популярный, у него больше всего комментариев
+PAGES = {
+    'index_anon': (lambda ids: '/', False),
+    'index': (lambda ids: '/', True),
+    'view_post': (lambda ids: f'/post/{ids["posts"][0]}', True),
+    'search': (lambda ids: '/search?q=пожар', True),
+    'admin_posts': (lambda ids: '/admin/posts', True),
+    'admin_comments': (lambda ids: '/admin/comments', True),
+    'admin_users': (lambda ids: '/admin/users', True),
+}
+
+COMPILE_TEMPLATES = '''
+import time
+import main
+started = time.perf_counter()
+for name in main.app.jinja_env.list_templates():
+    main.app.jinja_env.get_template(name)
+print((time.perf_counter() - started) * 1000)
+'''
+
+
+def measure_page(client, path, repeat):
+    render_ms = []
+    for _ in range(repeat):
+        response = client.get(path)
+        if response.status_code != 200:
+            raise SystemExit(f'{path}: ответ {response.status_code}')
+        render_ms.append(float(RENDER_TIME.search(response.headers['Server-Timing']).group(1)))
+    body = response.get_data()
+    return {
+        'bytes': len(body),
+        'gzip_bytes': len(gzip.compress(body)),
+        'render_p50_ms': round(statistics.median(render_ms), 2),
+        'render_p99_ms': round(percentile(render_ms, 0.99), 2),
+    }
+
+
+def measure_compile(db_path):
+    # Новый процесс с собственным каталогом кэша байт-кода: первый запуск заполняет его, второй читает
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, FLASK_SQLALCHEMY_DATABASE_URI=f'sqlite:///{os.path.abspath(db_path)}',
+                   FLASK_TEMPLATE_BYTECODE_CACHE_DIR=cache_dir)
+        timings = [float(subprocess.run([sys.executable, '-c', COMPILE_TEMPLATES], cwd=ROOT, env=env, check=True,
+                                        capture_output=True, text=True).stdout.split()[-1])
+                   for _ in range(2)]
+    return {'compile_cold_ms': round(timings[0], 1), 'compile_warm_ms': round(timings[1], 1)}
+
+
+def compare(previous_path, pages, startup):
+    with open(previous_path, encoding='utf-8') as file:
+        previous = json.load(file)
+    print(f'Сравнение с {previous["commit"]} ({previous["created_at"]}):')
+    for name, current in pages.items():
+        before = previous['pages'].get(name)
+        if not before:
+            continue
+        changes = [f'{key} {(current[key] - before[key]) / before[key] * 100:+.0f}%'
+                   for key in ('bytes', 'gzip_bytes', 'render_p50_ms') if before[key]]
+        print(f'  {name:<15} ' + '   '.join(changes))
+    for key, value in startup.items():
+        if previous['startup'].get(key):
+            print(f'  {key:<15} {(value - previous["startup"][key]) / previous["startup"][key] * 100:+.0f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Размер и время рендеринга страниц форума')
+    parser.add_argument('--db', required=True, help='файл SQLite с данными (flask --app main seed-data)')
+    parser.add_argument('--repeat', type=int, default=50, help='запросов на страницу')
+    parser.add_argument('--pages', default=','.join(PAGES))
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--output', default=RESULTS_DIR)
+    parser.add_argument('--compare', help='файл прошлого замера')
+    args = parser.parse_args()
+
+    ids = id_ranges(args.db)
+    startup = measure_compile(args.db)
+    print(f'  компиляция шаблонов: {startup["compile_cold_ms"]:.1f} мс, '
+          f'с кэшем байт-кода {startup["compile_warm_ms"]:.1f} мс')
+
+    # Кэш страниц отдавал бы готовый HTML без рендеринга
+    os.environ['FLASK_PAGE_CACHE_ENABLED'] = 'false'
+    # У потоковых страниц нет tpl в Server-Timing: рендеринг идёт уже после отправки заголовков
+    os.environ['FLASK_STREAM_TEMPLATES'] = 'false'
+    driver = TestClientDriver(args.db, args.username, args.password)
+    pages = {}
+    for name in args.pages.split(','):
+        path, login = PAGES[name]
+        client = driver.client if login else driver.anonymous
+        stats = pages[name] = measure_page(client, path(ids), args.repeat)
+        print(f'  {name:<15} {stats["bytes"]:8d} байт   gzip {stats["gzip_bytes"]:7d} байт   '
+              f'рендеринг p50 {stats["render_p50_ms"]:7.2f} мс   p99 {stats["render_p99_ms"]:7.2f} мс')
+
+    commit = current_commit()
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f'{datetime.now():%Y%m%d-%H%M%S}-{commit}-render.json')
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({'commit': commit, 'created_at': datetime.now().isoformat(timespec='seconds'),
+                   'repeat': args.repeat, 'startup': startup, 'pages': pages}, file, ensure_ascii=False, indent=2)
+    print(f'Результат сохранён: {path}')
+    if args.compare:
+        compare(args.compare, pages, startup)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# Замер полнотекстового поиска на большой базе: python benchmarks/search_fts.py --comments 1000000
+# Создаёт временную SQLite-базу с таблицами post и comment, индексом FTS5 из search.py
+# и сравнивает время поиска MATCH с наивным LIKE '%слово%'.
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import search as forum_search  # noqa: E402
+
+WORDS = ('пожар газ утечка скорая помощь милиция вызов номер телефон служба дом подъезд соседи '
+         'квартира лифт свет вода отопление авария дорога машина ребёнок врач аптека больница '
+         'шум запах дым огонь электричество счётчик ремонт двор улица район город').split()
+QUERIES = ['пожар', 'утечка газ', 'скорая помощь', 'соседи шум', 'отоплен', 'электричество счётчик']
+SYLLABLES = 'ба ве ги до жу за ки ло ма не по ру са ти фу ха це чи ша ын эк юн як'.split()
+
+
+def vocabulary(rng, size):
+    # Словарь с распределением Ципфа: тематические слова вперемешку с синтетическими
+    words = list(WORDS)
+    while len(words) < size:
+        words.append(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    rng.shuffle(words)
+    return words, list(itertools.accumulate(1 / rank for rank in range(1, len(words) + 1)))
+
+
+def sentence(rng, vocab, length):
+    words, cum_weights = vocab
+    return ' '.join(rng.choices(words, cum_weights=cum_weights, k=length))
+
+
+def populate(connection, posts, comments, batch_size, rng, vocab):
+    connection.execute(text(
+        'CREATE TABLE post (id INTEGER PRIMARY KEY, title VARCHAR(200) NOT NULL, content TEXT NOT NULL)'))
+    connection.execute(text(
+        'CREATE TABLE comment (id INTEGER PRIMARY KEY, content TEXT NOT NULL, post_id INTEGER NOT NULL)'))
+
+    insert_post = text('INSERT INTO post (id, title, content) VALUES (:id, :title, :content)')
+    insert_comment = text('INSERT INTO comment (id, content, post_id) VALUES (:id, :content, :post_id)')
+    for start in range(1, posts + 1, batch_size):
+        connection.execute(insert_post, [
+            {'id': post_id, 'title': sentence(rng, vocab, 5), 'content': sentence(rng, vocab, 40)}
+            for post_id in range(start, min(start + batch_size, posts + 1))
+        ])
+    for start in range(1, comments + 1, batch_size):
+        connection.execute(insert_comment, [
+            {'id': comment_id, 'content': sentence(rng, vocab, 15), 'post_id': rng.randint(1, posts)}
+            for comment_id in range(start, min(start + batch_size, comments + 1))
+        ])
+
+
+def timed(function, repeat):
+    durations = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        durations.append((time.perf_counter() - started) * 1000)
+    return result, durations
+
+
+def report(label, durations):
+    durations = sorted(durations)
+    p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+    print(f'  {label:<28} p50 {statistics.median(durations):8.2f} мс   p95 {p95:8.2f} мс')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер поиска FTS5 по постам и комментариям')
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--comments', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--per-page', type=int, default=20)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--like-repeat', type=int, default=3, help='повторов для LIKE, 0 - не замерять')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    vocab = vocabulary(rng, args.vocabulary)
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f'sqlite:///{os.path.join(directory, "bench.db")}')
+
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            populate(connection, args.posts, args.comments, args.batch_size, rng, vocab)
+        print(f'Вставка {args.posts} постов и {args.comments} комментариев: {time.perf_counter() - started:.1f} с')
+
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            forum_search.create_search_index(connection)
+            count = forum_search.reindex(connection)
+        print(f'Построение индекса ({count} записей): {time.perf_counter() - started:.1f} с')
+
+        # Стоимость синхронизации триггерами: вставка с уже существующим индексом
+        with engine.begin() as connection:
+            _, durations = timed(lambda: connection.execute(
+                text('INSERT INTO comment (content, post_id) VALUES (:content, 1)'),
+                {'content': sentence(rng, vocab, 15)}), args.repeat)
+        report('INSERT comment + триггер', durations)
+
+        print(f'Поиск, первая страница по {args.per_page}:')
+        with engine.connect() as connection:
+            for query in QUERIES:
+                results, durations = timed(
+                    lambda: forum_search.search(connection, query, args.per_page), args.repeat)
+                report(f'MATCH «{query}»', durations)
+            results, durations = timed(
+                lambda: forum_search.search(connection, QUERIES[0], args.per_page, args.per_page * 50), args.repeat)
+            report(f'MATCH «{QUERIES[0]}», стр. 51', durations)
+
+            if args.like_repeat:
+                like = text("SELECT id FROM comment WHERE content LIKE :pattern ORDER BY id DESC LIMIT :limit")
+                for query in QUERIES[:2]:
+                    _, durations = timed(lambda: connection.execute(
+                        like, {'pattern': f'%{query}%', 'limit': args.per_page}).fetchall(), args.like_repeat)
+                    report(f'LIKE «{query}»', durations)
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
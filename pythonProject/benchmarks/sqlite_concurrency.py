@@ -0,0 +1,125 @@
+# Конкурентные чтения и записи SQLite с профилем БД и без: python benchmarks/sqlite_concurrency.py --seconds 10
+# Писатели переключают лайки (INSERT/DELETE like и UPDATE счётчика поста в одной транзакции, как like_post),
+# читатели листают ленту. Профиль default - настройки SQLite по умолчанию без повторов,
+# production - PRAGMA из sqlite_profile.py, пул соединений и повтор записи при блокировке
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlite_profile import install_pragmas, is_locked, production_pragmas, retry_on_lock  # noqa: E402
+
+FEED = text('SELECT id, title, like_count FROM post ORDER BY created_at DESC, id DESC LIMIT 20 OFFSET :offset')
+FIND_LIKE = text('SELECT id FROM "like" WHERE user_id = :user_id AND post_id = :post_id')
+ADD_LIKE = text('INSERT INTO "like" (user_id, post_id) VALUES (:user_id, :post_id)')
+REMOVE_LIKE = text('DELETE FROM "like" WHERE id = :id')
+BUMP_POST = text('UPDATE post SET like_count = like_count + :delta WHERE id = :post_id')
+
+
+def populate(engine, posts):
+    with engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE post (id INTEGER PRIMARY KEY, title VARCHAR(200) NOT NULL, '
+            'created_at FLOAT NOT NULL, like_count INTEGER NOT NULL DEFAULT 0)'))
+        connection.execute(text(
+            'CREATE TABLE "like" (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, post_id INTEGER NOT NULL, '
+            'UNIQUE (user_id, post_id))'))
+        connection.execute(text('CREATE INDEX ix_post_created_at_id ON post (created_at, id)'))
+        connection.execute(text('INSERT INTO post (id, title, created_at) VALUES (:id, :title, :created_at)'), [
+            {'id': post_id, 'title': f'Пост {post_id}', 'created_at': post_id} for post_id in range(1, posts + 1)
+        ])
+
+
+def toggle_like(engine, user_id, post_id):
+    with engine.begin() as connection:
+        like = connection.execute(FIND_LIKE, {'user_id': user_id, 'post_id': post_id}).first()
+        if like:
+            connection.execute(REMOVE_LIKE, {'id': like.id})
+        else:
+            connection.execute(ADD_LIKE, {'user_id': user_id, 'post_id': post_id})
+        connection.execute(BUMP_POST, {'delta': -1 if like else 1, 'post_id': post_id})
+
+
+def run(engine, args, retry):
+    stats = {'reads': 0, 'writes': 0, 'locked': 0, 'retried': 0}
+    lock = threading.Lock()
+    stop = time.monotonic() + args.seconds
+
+    def count(name):
+        with lock:
+            stats[name] += 1
+
+    def writer(seed):
+        rng = random.Random(seed)
+        while time.monotonic() < stop:
+            user_id, post_id = rng.randint(1, 1000), rng.randint(1, args.hot_posts)
+            try:
+                if retry:
+                    retry_on_lock(lambda: toggle_like(engine, user_id, post_id), on_retry=lambda: count('retried'))
+                else:
+                    toggle_like(engine, user_id, post_id)
+                count('writes')
+            except OperationalError as error:
+                if not is_locked(error):
+                    raise
+                count('locked')
+
+    def reader(seed):
+        rng = random.Random(seed)
+        while time.monotonic() < stop:
+            try:
+                with engine.connect() as connection:
+                    connection.execute(FEED, {'offset': rng.randrange(0, args.posts, 20)}).fetchall()
+                count('reads')
+            except OperationalError as error:
+                if not is_locked(error):
+                    raise
+                count('locked')
+
+    threads = [threading.Thread(target=writer, args=(seed,)) for seed in range(args.writers)]
+    threads += [threading.Thread(target=reader, args=(1000 + seed,)) for seed in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пропускная способность SQLite при конкурентных лайках и чтении ленты')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--hot-posts', type=int, default=50, help='лайки достаются первым N постам')
+    parser.add_argument('--pool-size', type=int, default=10)
+    parser.add_argument('--busy-timeout', type=int, default=5000, help='мс, для профиля production')
+    args = parser.parse_args()
+
+    print(f'{args.readers} читателей и {args.writers} писателей, {args.seconds:g} с на профиль')
+    for profile in ('default', 'production'):
+        with tempfile.TemporaryDirectory() as directory:
+            url = f'sqlite:///{os.path.join(directory, "bench.db")}'
+            if profile == 'production':
+                engine = create_engine(url, pool_size=args.pool_size, max_overflow=args.readers + args.writers)
+                install_pragmas(engine, production_pragmas(busy_timeout=args.busy_timeout))
+            else:
+                engine = create_engine(url)
+            populate(engine, args.posts)
+
+            stats = run(engine, args, retry=profile == 'production')
+            print(f'  {profile:<11} чтений {stats["reads"] / args.seconds:9.0f}/с   '
+                  f'записей {stats["writes"] / args.seconds:7.0f}/с   '
+                  f'ошибок блокировки {stats["locked"]:5}   повторов {stats["retried"]:5}')
+            engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+# Кэш отрендеренных страниц: LRU-хранилища и версии сущностей для точной инвалидации
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.managers import BaseManager
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+# Хранилище в памяти процесса: LRU поверх OrderedDict. С max_entries=None записи не вытесняются
+# и живут до истечения ttl (состояние заданий): истёкшие удаляются при чтении и периодически при записи
+class InProcessBackend:
+    name = 'memory'
+    sweep_every = 1000
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._writes = 0
+        # Счётчики версий не вытесняются вместе со страницами - храним их отдельно от LRU
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            if self.max_entries is None:
+                self._writes += 1
+                if self._writes % self.sweep_every == 0:
+                    self._drop_expired()
+            while self.max_entries is not None and len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def _drop_expired(self):
+        now = time.monotonic()
+        for key in [key for key, (_, expires_at) in self._data.items() if expires_at is not None and expires_at < now]:
+            del self._data[key]
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            value = self._counters.get(key, 0) + 1
+            self._counters[key] = value
+            return value
+
+    def get_counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def size(self):
+        with self._lock:
+            return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._counters.clear()
+
+
+# Общее хранилище для нескольких воркеров: Redis или любой совместимый с ним сервер.
+# Вытеснение LRU выполняет сам сервер (maxmemory-policy allkeys-lru), записи живут не дольше ttl.
+class RedisBackend:
+    name = 'redis'
+
+    def __init__(self, url=None, client=None, prefix='forum:', default_ttl=3600):
+        if client is None:
+            if redis is None:
+                raise RuntimeError('Для общего кэша нужен пакет redis: pip install redis')
+            client = redis.Redis.from_url(url or 'redis://localhost:6379/0')
+        self.client = client
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+
+    def get(self, key):
+        data = self.client.get(self.prefix + key)
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl or self.default_ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key):
+        return int(self.client.incr(self.prefix + 'counter:' + key))
+
+    def get_counter(self, key):
+        value = self.client.get(self.prefix + 'counter:' + key)
+        return int(value) if value is not None else 0
+
+    def size(self):
+        # Размер всей базы Redis, включая чужие ключи - для метрик этого достаточно
+        return int(self.client.dbsize())
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+# Общее хранилище воркеров одной машины (serve.py): InProcessBackend в отдельном процессе,
+# доступный по Unix-сокету через multiprocessing.managers. Значения передаются и хранятся
+# сериализованными, как в Redis; ключ доступа к сокету выводится из SECRET_KEY приложения
+class SharedStoreManager(BaseManager):
+    pass
+
+
+def store_authkey(secret):
+    return hashlib.sha256(b'shared-cache:' + secret.encode()).digest()
+
+
+def serve_shared_store(address, secret, max_entries=10000):
+    """Запускает хранилище на Unix-сокете address и обслуживает его до завершения процесса.
+    store - LRU кэшей на max_entries записей, jobs - состояние заданий: без вытеснения, записи живут до ttl,
+    чтобы поток страниц в кэше не вытеснил идущее задание"""
+    store = InProcessBackend(max_entries=max_entries)
+    jobs = InProcessBackend(max_entries=None)
+    # Сокет, оставшийся от упавшего хранилища, мешает занять адрес заново
+    if os.path.exists(address):
+        os.unlink(address)
+    SharedStoreManager.register('store', callable=lambda: store)
+    SharedStoreManager.register('jobs', callable=lambda: jobs)
+    SharedStoreManager(address=address, authkey=store_authkey(secret)).get_server().serve_forever()
+
+
+class SharedBackend:
+    name = 'shared'
+
+    def __init__(self, address, secret, store='store'):
+        # store - какое хранилище процесса использовать: store (кэши) или jobs (задания)
+        self.address = address
+        self.authkey = store_authkey(secret)
+        self.store_name = store
+        self._store = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def store(self):
+        # Подключение создаётся лениво и заново в каждом процессе: объект создаётся в мастере до fork,
+        # а соединение прокси нельзя делить между процессами. Потоки процесса прокси разводит сам
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    SharedStoreManager.register(self.store_name)
+                    manager = SharedStoreManager(address=self.address, authkey=self.authkey)
+                    manager.connect()
+                    self._store = getattr(manager, self.store_name)()
+                    self._pid = os.getpid()
+        return self._store
+
+    def _forget_store(self):
+        # Соединение потока прокси делят все прокси одного адреса - мёртвое убираем, иначе новый прокси взял бы
+        # его же. Освобождение старого объекта отменяем: новое хранилище запущено fork того же мастера, id его
+        # объекта совпадает, и decref старого прокси удалил бы объект нового
+        if self._store is not None:
+            self._store._tls.__dict__.pop('connection', None)
+            self._store._close.cancel()
+        self._pid = None
+
+    def call(self, method, *args):
+        try:
+            return getattr(self.store(), method)(*args)
+        except (OSError, EOFError):
+            # Хранилище перезапущено мастером: подключаемся заново и повторяем один раз
+            self._forget_store()
+            return getattr(self.store(), method)(*args)
+
+    def get(self, key):
+        data = self.call('get', key)
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.call('set', key, pickle.dumps(value), ttl)
+
+    def delete(self, key):
+        self.call('delete', key)
+
+    def incr(self, key):
+        return self.call('incr', key)
+
+    def get_counter(self, key):
+        return self.call('get_counter', key)
+
+    def size(self):
+        return self.call('size')
+
+    def clear(self):
+        self.call('clear')
+
+
+# Кэш страниц: ключ = маршрут + версии сущностей + адрес запроса.
+# Запись меняет версию сущности, и старые ключи просто перестают запрашиваться.
+class PageCache:
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def versions(self, entities):
+        return [self.backend.get_counter('version:' + entity) for entity in entities]
+
+    def bump(self, *entities):
+        for entity in entities:
+            self.backend.incr('version:' + entity)
+
+    def key(self, route, entities, path):
+        stamp = ','.join(f'{entity}={version}' for entity, version in zip(entities, self.versions(entities)))
+        return f'page:{route}:{stamp}:{path}'
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value, ttl=self.ttl)
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'backend': self.backend.name,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 4) if total else 0.0,
+            'entries': self.backend.size(),
+        }
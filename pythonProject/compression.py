@@ -0,0 +1,81 @@
+# Сжатие ответов по Accept-Encoding (br, если установлен пакет brotli, и gzip) и потоковая отдача:
+# тело целиком или по кускам, без сборки всего документа в памяти
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+                          'application/json'}
+
+
+def available_encodings():
+    # Порядок - предпочтение сервера при одинаковом качестве у клиента: br плотнее gzip
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encodings, encodings):
+    """Кодировка из encodings, которую клиент принимает с наибольшим качеством, или None"""
+    best, best_quality = None, 0
+    for encoding in encodings:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def gzip_compressor(level):
+    # wbits=31 - формат gzip (заголовок и контрольная сумма), а не голый deflate
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def brotli_compressor(quality):
+    compressor = brotli.Compressor(quality=quality)
+    return compressor.process, compressor.flush, compressor.finish
+
+
+def compressor(encoding, gzip_level=6, brotli_quality=5):
+    """(сжать кусок, сбросить накопленное, завершить поток) для encoding"""
+    if encoding == 'br':
+        return brotli_compressor(brotli_quality)
+    return gzip_compressor(gzip_level)
+
+
+def compress(body, encoding, **levels):
+    process, flush, finish = compressor(encoding, **levels)
+    return process(body) + finish()
+
+
+def compress_stream(chunks, encoding, **levels):
+    """Сжатие потока: каждый кусок сбрасывается сразу, чтобы клиент мог показывать страницу по мере получения"""
+    process, flush, finish = compressor(encoding, **levels)
+    try:
+        for chunk in chunks:
+            data = process(chunk.encode() if isinstance(chunk, str) else chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        # Закрытие внешнего генератора (обрыв соединения) закрывает и исходный - вместе с ним контекст запроса
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def coalesce(chunks, size):
+    """Объединяет мелкие куски (Jinja отдаёт их по одному тегу) в куски не меньше size символов"""
+    buffer, length = [], 0
+    try:
+        for chunk in chunks:
+            buffer.append(chunk)
+            length += len(chunk)
+            if length >= size:
+                yield ''.join(buffer)
+                buffer, length = [], 0
+        if buffer:
+            yield ''.join(buffer)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
@@ -1,16 +1,164 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import (Flask, render_template, request, redirect, url_for, session, flash, jsonify, has_request_context,
+                   make_response, g, abort, before_render_template, template_rendered, stream_template)
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.sql import Executable
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import is_resource_modified
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import atexit
+import base64
+import hashlib
+import inspect
+import json
+import logging
+import os
 import random
+import threading
+import time
+from collections import Counter, namedtuple
+
+import click
+
+import api
+from cache import InProcessBackend, PageCache, RedisBackend, SharedBackend
+import compression
+import search as forum_search
+import seed as forum_seed
+from metrics import RequestMetrics
+from query_debug import (QUERY_BUDGETS, LazyLoads, NPlusOneDetected, QueryBudgetExceeded, caller_location,
+                         query_budget, relationship_name)
+from sqlite_profile import install_pragmas, production_pragmas, retry_on_lock
+from write_behind import LikeBuffer
+from ai_assistant import (DEFAULT_DATA_PATH, Assistant, HttpModelBackend, Job, JobQueue, QueueFull, ResponseCache,
+                          revision)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'super-secret-key-for-forum-2026'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///forum.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['POSTS_PER_PAGE'] = 20
+app.config['ADMIN_PER_PAGE'] = 50
+app.config['SEARCH_PER_PAGE'] = 20
+app.config['COMMENTS_PER_PAGE'] = 50
+# Пользователи с большим числом постов удаляются в фоне, пачками по PURGE_BATCH_SIZE постов
+app.config['BACKGROUND_PURGE_THRESHOLD'] = 1000
+app.config['PURGE_BATCH_SIZE'] = 500
+# Сколько секунд состояние фонового удаления хранится в кэше после последнего обновления и сколько
+# последних удалений показывает админка
+app.config['PURGE_JOB_TTL'] = 3600
+app.config['PURGE_JOB_HISTORY'] = 20
+# Кэш страниц для анонимных посетителей: memory (в процессе), shared (общее хранилище воркеров serve.py
+# на Unix-сокете PAGE_CACHE_SOCKET) или redis (общий для воркеров и машин). Тот же выбор - для кэша ролей
+# и ответов ИИ
+app.config['PAGE_CACHE_ENABLED'] = True
+app.config['PAGE_CACHE_BACKEND'] = 'memory'
+app.config['PAGE_CACHE_REDIS_URL'] = 'redis://localhost:6379/0'
+app.config['PAGE_CACHE_SOCKET'] = None
+app.config['PAGE_CACHE_MAX_ENTRIES'] = 1000
+app.config['PAGE_CACHE_TTL'] = 300
+# Состояние заданий (ответы ИИ, фоновые удаления) хранится отдельно от кэшей и не вытесняется ими.
+# Для redis - отдельный сервер или база с maxmemory-policy noeviction; по умолчанию - PAGE_CACHE_REDIS_URL
+app.config['JOB_STORE_REDIS_URL'] = None
+# Сколько секунд роли пользователя берутся из кэша без обращения к БД
+app.config['ROLE_CACHE_TTL'] = 30
+# ИИ-ассистент: файл категорий и шаблонов ответов, размер кэша готовых ответов
+app.config['AI_ASSISTANT_DATA'] = DEFAULT_DATA_PATH
+app.config['AI_RESPONSE_CACHE_SIZE'] = 10000
+app.config['AI_BATCH_LIMIT'] = 100
+# Источник ответов: template (шаблоны) или http (модель по адресу AI_MODEL_URL, ответ не дольше AI_MODEL_TIMEOUT с)
+app.config['AI_BACKEND'] = 'template'
+app.config['AI_MODEL_URL'] = 'http://127.0.0.1:8081/generate'
+app.config['AI_MODEL_TIMEOUT'] = 10
+# Пул потоков для ответов ИИ; сколько секунд запрос ждёт ответа, прежде чем вернуть задание для опроса,
+# и сколько самое большее ждёт ответа опрос статуса задания (?wait=)
+app.config['AI_WORKERS'] = 4
+app.config['AI_MAX_PENDING'] = 100
+# Сколько новых заданий может поставить в очередь один пакетный запрос (/ai_assistant/batch): пакет из
+# AI_BATCH_LIMIT комментариев не должен занимать всю очередь AI_MAX_PENDING и отказывать остальным
+app.config['AI_BATCH_MAX_PENDING'] = 20
+app.config['AI_SYNC_WAIT'] = 0.5
+app.config['AI_LONG_POLL_MAX'] = 25
+# Сколько секунд состояние задания хранится в общем кэше и как часто его опрашивает чужой воркер
+app.config['AI_JOB_TTL'] = 600
+app.config['AI_JOB_POLL_INTERVAL'] = 0.1
+# Готовить ответ ИИ в фоне при записи комментария и хранить его в таблице ai_suggestion
+app.config['AI_PREGENERATE'] = False
+# Профиль БД: default (настройки SQLite по умолчанию) или production (WAL, PRAGMA на каждом соединении, пул)
+app.config['DB_PROFILE'] = 'default'
+app.config['DB_BUSY_TIMEOUT'] = 5000
+app.config['DB_MMAP_SIZE'] = 256 * 1024 * 1024
+app.config['DB_CACHE_SIZE'] = -64000
+app.config['DB_POOL_SIZE'] = 10
+app.config['DB_MAX_OVERFLOW'] = 20
+# Повтор записи при "database is locked": число попыток и начальная пауза в секундах
+app.config['DB_WRITE_ATTEMPTS'] = 5
+app.config['DB_RETRY_DELAY'] = 0.05
+# Отложенная запись лайков: в БД пачкой раз в LIKE_BUFFER_INTERVAL_MS мс или по LIKE_BUFFER_MAX_EVENTS событий
+app.config['LIKE_BUFFER_ENABLED'] = False
+app.config['LIKE_BUFFER_INTERVAL_MS'] = 200
+app.config['LIKE_BUFFER_MAX_EVENTS'] = 500
+# Метрики маршрутов на /metrics (формат Prometheus), заголовок Server-Timing в ответах,
+# SQL-запросы дольше SLOW_QUERY_MS мс пишутся в журнал (и в файл SLOW_QUERY_LOG, если задан)
+app.config['METRICS_ENABLED'] = True
+app.config['SERVER_TIMING'] = False
+app.config['SLOW_QUERY_MS'] = 100
+app.config['SLOW_QUERY_LOG'] = None
+# Режим разработки и тестов: сообщать о повторных ленивых загрузках одного отношения (N+1) и о превышении
+# бюджета SQL-запросов маршрута (@query_budget); QUERY_DEBUG_RAISE - исключение вместо записи в журнал
+app.config['QUERY_DEBUG'] = False
+app.config['QUERY_DEBUG_RAISE'] = False
+app.config['NPLUSONE_THRESHOLD'] = 2
+# Проверять планы запросов (EXPLAIN QUERY PLAN) и писать в лог полные сканирования таблиц
+app.config['CHECK_QUERY_PLANS'] = False
+# ASGI-режим (uvicorn asgi:application): потоки для маршрутов, у которых нет асинхронной версии
+app.config['ASGI_THREADS'] = 32
+# Шаблоны: кэш скомпилированного байт-кода Jinja на диске (None - временный каталог системы), чтобы новые
+# процессы не компилировали шаблоны заново; срок кэширования статики с отпечатком в адресе, в секундах
+app.config['TEMPLATE_BYTECODE_CACHE'] = True
+app.config['TEMPLATE_BYTECODE_CACHE_DIR'] = None
+app.config['STATIC_MAX_AGE'] = 365 * 24 * 3600
+# Длинные страницы (списки админки, пост с комментариями) отдаются по мере рендеринга кусками
+# от STREAM_CHUNK_SIZE символов: первый байт уходит раньше, а весь документ не собирается в памяти
+app.config['STREAM_TEMPLATES'] = True
+app.config['STREAM_CHUNK_SIZE'] = 16384
+# Сжатие ответов от COMPRESS_MIN_SIZE байт: br (с пакетом brotli) или gzip, по Accept-Encoding клиента.
+# Сжатые тела страниц из кэша страниц и статики хранятся в памяти процесса, до COMPRESS_CACHE_SIZE штук
+app.config['COMPRESS_ENABLED'] = True
+app.config['COMPRESS_MIN_SIZE'] = 1024
+app.config['COMPRESS_LEVEL'] = 6
+app.config['COMPRESS_BROTLI_QUALITY'] = 5
+app.config['COMPRESS_CACHE_SIZE'] = 500
+# JSON API (/api/v1): размер страницы списка по умолчанию и наибольший (?limit=), число id в ?ids=
+app.config['API_PER_PAGE'] = 20
+app.config['API_MAX_PER_PAGE'] = 100
+app.config['API_BATCH_LIMIT'] = 100
+# Переопределение настроек из окружения: FLASK_CHECK_QUERY_PLANS=true и т.п.
+app.config.from_prefixed_env()
+if app.config['DB_PROFILE'] == 'production':
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+    })
+
+# Без пробелов и переносов вокруг тегов {% %}: строки списков не тянут за собой отступы шаблона
+app.jinja_options = {**app.jinja_options, 'trim_blocks': True, 'lstrip_blocks': True}
+if app.config['TEMPLATE_BYTECODE_CACHE']:
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_BYTECODE_CACHE_DIR'])
 
 db = SQLAlchemy(app)
 
+with app.app_context():
+    if app.config['DB_PROFILE'] == 'production':
+        install_pragmas(db.engine, production_pragmas(busy_timeout=app.config['DB_BUSY_TIMEOUT'],
+                                                      mmap_size=app.config['DB_MMAP_SIZE'],
+                                                      cache_size=app.config['DB_CACHE_SIZE']))
+
 
 # Модели базы данных
 class User(db.Model):
@@ -24,6 +172,11 @@ class User(db.Model):
     comments = db.relationship('Comment', backref='author', lazy=True)
     likes = db.relationship('Like', backref='user', lazy=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Денормализованные счётчики, обновляются в тех же транзакциях, что и данные
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (db.Index('ix_user_created_at', 'created_at'),)
 
 
 class Post(db.Model):
@@ -34,6 +187,19 @@ class Post(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     comments = db.relationship('Comment', backref='post', lazy=True)
     likes = db.relationship('Like', backref='post', lazy=True)
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Версия поста: растёт при любом изменении поста, его комментариев или лайков (для ETag)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    changed_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_post_created_at_id', 'created_at', 'id'),
+        db.Index('ix_post_user_id_created_at', 'user_id', 'created_at'),
+        # Сортировки списка постов в админке
+        db.Index('ix_post_like_count_id', 'like_count', 'id'),
+        db.Index('ix_post_comment_count_id', 'comment_count', 'id'),
+    )
 
 
 class Comment(db.Model):
@@ -46,6 +212,12 @@ class Comment(db.Model):
     updated_at = db.Column(db.DateTime, nullable=True)
     edited_by_admin = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        db.Index('ix_comment_post_id_created_at', 'post_id', 'created_at'),
+        db.Index('ix_comment_user_id', 'user_id'),
+        db.Index('ix_comment_created_at', 'created_at'),
+    )
+
 
 class Like(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -53,7 +225,20 @@ class Like(db.Model):
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    __table_args__ = (db.UniqueConstraint('user_id', 'post_id', name='_user_post_like'),)
+    # Уникальный индекс (user_id, post_id) покрывает и выборки по user_id
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'post_id', name='_user_post_like'),
+        db.Index('ix_like_post_id', 'post_id'),
+    )
+
+
+# Заранее подготовленный ответ ИИ; revision - ревизия комментария (comment_revision),
+# при несовпадении с текущей ответ устарел
+class AiSuggestion(db.Model):
+    comment_id = db.Column(db.Integer, db.ForeignKey('comment.id'), primary_key=True)
+    revision = db.Column(db.String(40), nullable=False)
+    response = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
 # Данные экстренных служб
@@ -64,9 +249,187 @@ EMERGENCY_SERVICES = [
     {"name": "Служба газа", "phone": "104"}
 ]
 
+
+# Статика с отпечатком содержимого в адресе (/static/forum.css?v=...): новая версия файла получает новый адрес,
+# поэтому браузер и прокси хранят его STATIC_MAX_AGE секунд без повторных запросов
+static_fingerprints = {}
+
+
+def static_fingerprint(filename):
+    fingerprint = static_fingerprints.get(filename)
+    if fingerprint is None or app.debug:
+        with open(os.path.join(app.static_folder, filename), 'rb') as file:
+            fingerprint = static_fingerprints[filename] = hashlib.sha1(file.read()).hexdigest()[:12]
+    return fingerprint
+
+
+@app.template_global()
+def static_url(filename):
+    return url_for('static', filename=filename, v=static_fingerprint(filename))
+
+
+@app.after_request
+def cache_fingerprinted_static(response):
+    if request.endpoint != 'static' or response.status_code not in (200, 304):
+        return response
+    # Адрес без отпечатка или со старым отпечатком - обычная проверка по ETag
+    if request.args.get('v') == static_fingerprint(request.view_args['filename']):
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['STATIC_MAX_AGE']
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+# Части страниц, не зависящие от запроса и пользователя (боковая панель), рендерятся один раз на процесс
+static_fragments = {}
+
+
+@app.template_global()
+def static_fragment(name):
+    html = static_fragments.get(name)
+    if html is None or app.jinja_env.auto_reload:
+        html = static_fragments[name] = Markup(app.jinja_env.get_template(name).render(
+            emergency_services=EMERGENCY_SERVICES))
+    return html
+
+# Таблицы производных данных, у которых колонка сменила смысл: если в базе ещё есть старая колонка,
+# таблица пересоздаётся пустой. ai_suggestion.content_hash хранил хэш текста, revision - ревизию комментария;
+# ответы подготовятся заново (pregenerate-ai или при первом запросе)
+RECREATED_TABLES = {'ai_suggestion': 'content_hash'}
+
+
+# Миграция схемы: create_all не добавляет новые колонки и индексы в уже существующие таблицы
+def migrate_schema():
+    inspector = db.inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    added = []
+    with db.engine.begin() as connection:
+        for name, retired in RECREATED_TABLES.items():
+            if retired in {column['name'] for column in inspector.get_columns(name)}:
+                db.metadata.tables[name].drop(connection)
+                db.metadata.tables[name].create(connection)
+                added.append(name)
+        inspector.clear_cache()
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+                connection.exec_driver_sql(f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}')
+                added.append(f'{table.name}.{column.name}')
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+    return added
+
+
+# Пересчёт счётчиков одним UPDATE на таблицу; None - пересчитать все строки
+def refresh_post_counters(post_ids=None):
+    if post_ids is not None and not post_ids:
+        return
+    statement = db.update(Post).values(
+        like_count=db.select(db.func.count(Like.id)).where(Like.post_id == Post.id).scalar_subquery(),
+        comment_count=db.select(db.func.count(Comment.id)).where(Comment.post_id == Post.id).scalar_subquery(),
+    )
+    if post_ids is not None:
+        statement = statement.where(Post.id.in_(post_ids))
+    db.session.execute(statement, execution_options={'synchronize_session': False})
+
+
+def refresh_user_counters(user_ids=None):
+    if user_ids is not None and not user_ids:
+        return
+    statement = db.update(User).values(
+        post_count=db.select(db.func.count(Post.id)).where(Post.user_id == User.id).scalar_subquery(),
+        comment_count=db.select(db.func.count(Comment.id)).where(Comment.user_id == User.id).scalar_subquery(),
+    )
+    if user_ids is not None:
+        statement = statement.where(User.id.in_(user_ids))
+    db.session.execute(statement, execution_options={'synchronize_session': False})
+
+
+def refresh_counters():
+    refresh_post_counters()
+    refresh_user_counters()
+
+
+# Изменение счётчиков и версии поста на месте (без чтения строки), в текущей транзакции
+def bump_post_counters(post_id, likes=0, comments=0):
+    Post.query.filter_by(id=post_id).update({
+        Post.like_count: Post.like_count + likes,
+        Post.comment_count: Post.comment_count + comments,
+        Post.version: Post.version + 1,
+        Post.changed_at: datetime.utcnow(),
+    }, synchronize_session=False)
+
+
+def touch_post(post_id):
+    bump_post_counters(post_id)
+
+
+def bump_user_counters(user_id, posts=0, comments=0):
+    User.query.filter_by(id=user_id).update({
+        User.post_count: User.post_count + posts,
+        User.comment_count: User.comment_count + comments,
+    }, synchronize_session=False)
+
+
 # Создание базы данных
 with app.app_context():
     db.create_all()
+    if migrate_schema():
+        refresh_counters()
+        db.session.commit()
+    # Поисковый индекс FTS5 и триггеры синхронизации; при первом создании заполняется из таблиц
+    with db.engine.begin() as connection:
+        if forum_search.create_search_index(connection):
+            forum_search.reindex(connection)
+
+
+# Полный пересчёт счётчиков: flask --app main rebuild-counters
+@app.cli.command('rebuild-counters')
+def rebuild_counters_command():
+    refresh_counters()
+    db.session.commit()
+    invalidate_pages(site=True)
+    click.echo('Счётчики пересчитаны.')
+
+
+# Полная перестройка поискового индекса: flask --app main reindex-search
+@app.cli.command('reindex-search')
+def reindex_search_command():
+    with db.engine.begin() as connection:
+        forum_search.create_search_index(connection)
+        count = forum_search.reindex(connection)
+    click.echo(f'Поисковый индекс перестроен: {count} записей.')
+
+
+# Синтетические данные для нагрузочных тестов: flask --app main seed-data --posts 100000 --comments 1000000.
+# У всех пользователей пароль --password; администратор admin создаётся, если его нет
+@app.cli.command('seed-data')
+# Комментарии и лайки ссылаются на пользователей и посты, поэтому тех нужно хотя бы по одному
+@click.option('--users', default=1000, show_default=True, type=click.IntRange(min=1))
+@click.option('--posts', default=10000, show_default=True, type=click.IntRange(min=1))
+@click.option('--comments', default=100000, show_default=True, type=click.IntRange(min=0))
+@click.option('--likes', default=200000, show_default=True, type=click.IntRange(min=0))
+@click.option('--batch-size', default=10000, show_default=True, type=click.IntRange(min=1))
+@click.option('--seed', 'random_seed', default=42, show_default=True)
+@click.option('--password', default='password', show_default=True)
+def seed_data_command(users, posts, comments, likes, batch_size, random_seed, password):
+    password_hash = generate_password_hash(password)
+    started = time.perf_counter()
+    with db.engine.begin() as connection:
+        inserted = forum_seed.seed(connection, db.metadata.tables, users, posts, comments, likes, password_hash,
+                                   batch_size=batch_size, rng=random.Random(random_seed),
+                                   progress=lambda table, count: click.echo(f'\r{table}: {count}', nl=False))
+    click.echo()
+    if not User.query.filter_by(username='admin').first():
+        db.session.add(User(username='admin', email='admin@example.com', password=password_hash, is_admin=True))
+        db.session.commit()
+    invalidate_pages(site=True)
+    click.echo(f'Добавлено за {time.perf_counter() - started:.1f} с: '
+               + ', '.join(f'{table} {count}' for table, count in inserted.items()))
 
 
 # Декоратор для проверки прав администратора
@@ -76,7 +439,7 @@ def admin_required(f):
             flash('Пожалуйста, войдите в систему.')
             return redirect(url_for('login'))
 
-        user = User.query.get(session['user_id'])
+        user = current_user()
 
         # Проверка: пользователь существует в базе данных
         if not user:
@@ -103,7 +466,7 @@ def moderator_required(f):
             flash('Пожалуйста, войдите в систему.')
             return redirect(url_for('login'))
 
-        user = User.query.get(session['user_id'])
+        user = current_user()
 
         if not user:
             flash('Пользователь не найден. Пожалуйста, войдите снова.')
@@ -122,58 +485,702 @@ def moderator_required(f):
     return wrap
 
 
-# ИИ-ассистент (симуляция для бесплатной версии)
-def ai_assistant_response(comment_text, post_title):
-    """Генерирует полезный ответ ИИ на основе комментария"""
-
-    # Анализируем тональность комментария
-    comment_lower = comment_text.lower()
-
-    # Шаблоны ответов для разных ситуаций
-    if any(word in comment_lower for word in ['помощь', 'помогите', 'не знаю', 'совет', 'как']):
-        responses = [
-            f"💡 Совет по теме '{post_title}': Попробуйте сначала изучить официальную документацию. Часто ответы на базовые вопросы уже есть там!",
-            f"🔍 Рекомендую поискать похожие проблемы на форуме. Возможно, кто-то уже сталкивался с этим!",
-            f"📚 Для решения подобных задач полезно ознакомиться с основами. Начните с простых примеров и постепенно усложняйте задачу."
-        ]
-    elif any(word in comment_lower for word in ['ошибка', 'баг', 'не работает', 'сломалось', 'проблема']):
-        responses = [
-            f"🛠️ При возникновении ошибок: 1) Проверьте логи, 2) Убедитесь, что все зависимости установлены, 3) Попробуйте воспроизвести проблему на чистом окружении.",
-            f"🐞 Совет по отладке: добавьте больше логов в код, чтобы отследить, на каком этапе возникает проблема. Часто причина скрыта в неожиданном месте!",
-            f"✅ Проверьте распространённые причины: опечатки в коде, неправильные пути к файлам, устаревшие версии библиотек."
-        ]
-    elif any(word in comment_lower for word in ['спасибо', 'благодарю', 'отлично', 'класс', 'понял']):
-        responses = [
-            f"😊 Рад, что помог! Если возникнут ещё вопросы — обращайтесь. Обучение — это процесс, и у всех бывают трудности.",
-            f"🌟 Отлично, что разобрались! Теперь вы сможете помочь другим участникам форума с похожими вопросами.",
-            f"🚀 Продолжайте в том же духе! Каждая решённая проблема делает вас лучше как специалиста."
-        ]
-    elif any(word in comment_lower for word in ['безопасность', 'пароль', 'данные', 'хакер', 'угроза']):
-        responses = [
-            f"🔒 Важно помнить: никогда не храните пароли в открытом виде. Всегда используйте хеширование (например, bcrypt) и HTTPS для передачи данных.",
-            f"🛡️ Для защиты от атак: регулярно обновляйте зависимости, используйте параметризованные запросы против SQL-инъекций, и ограничивайте права доступа.",
-            f"⚠️ Будьте осторожны с личными данными! Никогда не публикуйте реальные пароли, ключи API или конфиденциальную информацию в публичных обсуждениях."
-        ]
+# Запись с повтором при блокировке БД: func() выполняет изменения и commit, при повторе транзакция откатывается
+def write_with_retry(func, on_retry=None):
+    def rollback():
+        db.session.rollback()
+        if on_retry is not None:
+            on_retry()
+    return retry_on_lock(func, attempts=app.config['DB_WRITE_ATTEMPTS'], delay=app.config['DB_RETRY_DELAY'],
+                         on_retry=rollback)
+
+
+# Декоратор для маршрутов, меняющих данные: при "database is locked" маршрут выполняется заново.
+# Flash-сообщения неудачной попытки отбрасываются, чтобы не показать их дважды
+def write_retry(f):
+    def wrap(*args, **kwargs):
+        flashes = list(session.get('_flashes', []))
+
+        def restore_flashes():
+            if flashes:
+                session['_flashes'] = list(flashes)
+            else:
+                session.pop('_flashes', None)
+
+        return write_with_retry(lambda: f(*args, **kwargs), on_retry=restore_flashes)
+
+    wrap.__name__ = f.__name__
+    return wrap
+
+
+# Кэш страниц
+def make_cache_backend(max_entries=None):
+    if app.config['PAGE_CACHE_BACKEND'] == 'redis':
+        return RedisBackend(url=app.config['PAGE_CACHE_REDIS_URL'])
+    if app.config['PAGE_CACHE_BACKEND'] == 'shared':
+        return SharedBackend(app.config['PAGE_CACHE_SOCKET'], app.config['SECRET_KEY'])
+    return InProcessBackend(max_entries=max_entries or app.config['PAGE_CACHE_MAX_ENTRIES'])
+
+
+page_cache = PageCache(make_cache_backend(), ttl=app.config['PAGE_CACHE_TTL'])
+
+
+# Хранилище состояния заданий: того же вида, что кэш, но без вытеснения - записи живут до своего ttl,
+# и поток страниц в кэше не может вытеснить идущее задание
+def make_job_store():
+    if app.config['PAGE_CACHE_BACKEND'] == 'redis':
+        return RedisBackend(url=app.config['JOB_STORE_REDIS_URL'] or app.config['PAGE_CACHE_REDIS_URL'],
+                            prefix='forum:jobs:')
+    if app.config['PAGE_CACHE_BACKEND'] == 'shared':
+        return SharedBackend(app.config['PAGE_CACHE_SOCKET'], app.config['SECRET_KEY'], store='jobs')
+    return InProcessBackend(max_entries=None)
+
+
+# Декоратор кэширования страницы. entities - шаблоны сущностей, от версий которых зависит страница,
+# например 'post:{post_id}'; версия 'site' входит в ключ всегда
+def cached_page(*entities):
+    def decorator(f):
+        def cache_key(kwargs):
+            # Кэшируем только одинаковые для всех ответы: GET без входа и без flash-сообщений
+            if (not app.config['PAGE_CACHE_ENABLED'] or request.method != 'GET'
+                    or 'user_id' in session or '_flashes' in session):
+                return None
+            return page_cache.key(request.endpoint,
+                                  ['site'] + [entity.format(**kwargs) for entity in entities],
+                                  request.full_path)
+
+        def cached_response(key):
+            cached = page_cache.get(key)
+            if cached is None:
+                return None
+            response = make_response(cached['body'])
+            response.headers.extend(cached['headers'])
+            return response.make_conditional(request)
+
+        def store(key, rv):
+            response = make_response(rv)
+            if response.status_code == 200 and response.mimetype == 'text/html':
+                page_cache.set(key, {
+                    'body': response.get_data(as_text=True),
+                    'headers': [(name, value) for name, value in response.headers.items()
+                                if name in ('ETag', 'Last-Modified', 'Cache-Control')],
+                })
+            return response
+
+        # Асинхронные версии страниц (asgi.py) кэшируются в том же кэше и по тем же ключам
+        if inspect.iscoroutinefunction(f):
+            async def wrap(*args, **kwargs):
+                key = g.page_cache_key = cache_key(kwargs)
+                if key is None:
+                    return await f(*args, **kwargs)
+                response = cached_response(key)
+                if response is None:
+                    response = store(key, await f(*args, **kwargs))
+                return response
+        else:
+            def wrap(*args, **kwargs):
+                key = g.page_cache_key = cache_key(kwargs)
+                if key is None:
+                    return f(*args, **kwargs)
+                response = cached_response(key)
+                if response is None:
+                    response = store(key, f(*args, **kwargs))
+                return response
+
+        wrap.__name__ = f.__name__
+        return wrap
+    return decorator
+
+
+# Инвалидация после commit: меняем версии затронутых страниц
+def invalidate_pages(post_id=None, site=False):
+    entities = ['feed']
+    if post_id is not None:
+        entities.append(f'post:{post_id}')
+    if site:
+        entities.append('site')
+    page_cache.bump(*entities)
+
+
+# Условные GET-запросы: слабый ETag из версий постов и Last-Modified (у страниц поста, только без входа).
+# Соль - отпечаток развёрнутой версии: SECRET_KEY, код приложения, шаблоны и статика. Новая разметка даёт
+# новые ETag, а у всех воркеров и машин с одной версией соль одинакова, и 304 может ответить любой из них
+def deploy_fingerprint():
+    digest = hashlib.sha1(app.config['SECRET_KEY'].encode())
+    paths = [os.path.abspath(__file__)]
+    for folder in (os.path.join(app.root_path, app.template_folder), app.static_folder):
+        for root, _, names in os.walk(folder):
+            paths.extend(os.path.join(root, name) for name in names)
+    for path in sorted(paths):
+        with open(path, 'rb') as file:
+            digest.update(os.path.relpath(path, app.root_path).encode() + b'\0' + file.read())
+    return digest.hexdigest()
+
+
+ETAG_SALT = deploy_fingerprint()
+
+
+def page_etag(*parts):
+    # Страница зависит от того, кто смотрит: имя в меню, кнопки автора и админа
+    viewer = (session.get('user_id'), bool(session.get('is_admin')))
+    return hashlib.sha1(repr((ETAG_SALT, viewer) + parts).encode()).hexdigest()[:24]
+
+
+def not_modified(etag, last_modified):
+    """Возвращает ответ 304, если у клиента актуальная версия страницы, иначе None"""
+    # Last-Modified не зависит от того, кто смотрит, а страница зависит (как и ETag) - для вошедшего
+    # пользователя проверяется только ETag, иначе клиент с одним If-Modified-Since получил бы чужую версию
+    if 'user_id' in session:
+        last_modified = None
+    # Страницу с flash-сообщениями нельзя подтверждать 304 - сообщения показываются один раз
+    g.validators = None if '_flashes' in session else (etag, last_modified)
+    if g.validators and not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return with_validators(make_response('', 304))
+    return None
+
+
+def with_validators(response):
+    response = make_response(response)
+    if g.get('validators'):
+        etag, last_modified = g.validators
+        response.set_etag(etag, weak=True)
+        if last_modified:
+            response.last_modified = last_modified
+        response.cache_control.no_cache = True
+    return response
+
+
+# Метрики: время ответа, число и время SQL-запросов и время шаблонов по маршрутам.
+# Таймер запускается раньше остальных before_request, поэтому в замер входит и загрузка пользователя
+request_metrics = RequestMetrics()
+slow_query_log = app.logger.getChild('slow_sql')
+if app.config['SLOW_QUERY_LOG']:
+    slow_query_handler = logging.FileHandler(app.config['SLOW_QUERY_LOG'], encoding='utf-8')
+    slow_query_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    slow_query_log.addHandler(slow_query_handler)
+
+
+def metrics_route():
+    if has_request_context():
+        return request.endpoint or 'not_found'
+    return 'background'
+
+
+@app.before_request
+def start_request_timer():
+    if app.config['METRICS_ENABLED'] or app.config['QUERY_DEBUG']:
+        g.request_started = time.perf_counter()
+        g.sql_count = 0
+        g.sql_seconds = 0.0
+        g.render_seconds = 0.0
+
+
+def sql_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def sql_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    if has_request_context() and 'request_started' in g:
+        g.sql_count += 1
+        g.sql_seconds += elapsed
+    if app.config['METRICS_ENABLED'] and elapsed * 1000 >= app.config['SLOW_QUERY_MS']:
+        route = metrics_route()
+        request_metrics.observe_slow_query(route)
+        slow_query_log.warning('Медленный запрос %.1f мс в %s: %s', elapsed * 1000, route, ' '.join(statement.split()))
+
+
+def sql_failed(exception_context):
+    started = exception_context.connection is not None and exception_context.connection.info.get('query_started')
+    if started:
+        started.pop()
+
+
+@before_render_template.connect_via(app)
+def template_started(sender, template, context, **extra):
+    if 'request_started' in g:
+        g.render_started = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def template_finished(sender, template, context, **extra):
+    if 'render_started' in g:
+        g.render_seconds += time.perf_counter() - g.pop('render_started')
+
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    if app.config['METRICS_ENABLED'] and response.is_streamed:
+        # Потоковая страница рендерится уже после after_request: учитываем её, когда ответ отдан целиком
+        route, method, state = metrics_route(), request.method, g._get_current_object()
+        response.call_on_close(lambda: request_metrics.observe_request(
+            route, method, response.status_code, time.perf_counter() - state.request_started,
+            state.sql_count, state.sql_seconds, state.render_seconds))
+    elif app.config['METRICS_ENABLED']:
+        request_metrics.observe_request(metrics_route(), request.method, response.status_code, elapsed,
+                                        g.sql_count, g.sql_seconds, g.render_seconds)
+    if app.config['SERVER_TIMING']:
+        # У потоковой страницы заголовки уходят до рендеринга - времени шаблонов в них нет
+        response.headers['Server-Timing'] = (
+            f'app;dur={elapsed * 1000:.1f}, db;dur={g.sql_seconds * 1000:.1f};desc="{g.sql_count} SQL"'
+            + ('' if response.is_streamed else f', tpl;dur={g.render_seconds * 1000:.1f}'))
+    return response
+
+
+# Поиск N+1 и проверка бюджетов SQL-запросов (QUERY_DEBUG): отчёт после ответа маршрута
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+@app.before_request
+def start_query_debug():
+    if app.config['QUERY_DEBUG']:
+        g.lazy_loads = LazyLoads()
+
+
+def track_lazy_load(orm_execute_state):
+    if has_request_context() and 'lazy_loads' in g:
+        relationship = relationship_name(orm_execute_state)
+        if relationship:
+            g.lazy_loads.record(relationship, caller_location(APP_ROOT))
+
+
+@app.after_request
+def check_query_debug(response):
+    if 'lazy_loads' not in g:
+        return response
+    route = metrics_route()
+    problems = [NPlusOneDetected(f'N+1 в {route}: {relationship} загружено лениво {count} раз, впервые в {location}')
+                for relationship, count, location in g.lazy_loads.repeated(app.config['NPLUSONE_THRESHOLD'])]
+    budget = QUERY_BUDGETS.get(request.endpoint)
+    if budget is not None and g.sql_count > budget:
+        problems.append(QueryBudgetExceeded(f'{route}: {g.sql_count} SQL-запросов при бюджете {budget}'))
+    for problem in problems:
+        app.logger.warning('%s', problem)
+    if problems and app.config['QUERY_DEBUG_RAISE']:
+        raise problems[0]
+    return response
+
+
+# Сжатие ответов по Accept-Encoding. Хук зарегистрирован после хуков метрик, а after_request выполняются
+# в обратном порядке - время сжатия входит в замер маршрута
+compressed_bodies = InProcessBackend(max_entries=app.config['COMPRESS_CACHE_SIZE'])
+
+
+@app.after_request
+def compress_response(response):
+    if (not app.config['COMPRESS_ENABLED'] or response.status_code != 200 or 'Content-Encoding' in response.headers
+            or response.mimetype not in compression.COMPRESSIBLE_MIMETYPES or response.cache_control.no_transform):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = compression.negotiate(request.accept_encodings, compression.available_encodings())
+    if encoding is None:
+        return response
+    levels = {'gzip_level': app.config['COMPRESS_LEVEL'], 'brotli_quality': app.config['COMPRESS_BROTLI_QUALITY']}
+
+    if response.is_streamed and not response.direct_passthrough:
+        # Длина потоковой страницы заранее неизвестна, а короткие страницы потоком не отдаются - сжимаем всегда
+        response.response = compression.compress_stream(response.response, encoding, **levels)
+    else:
+        # Файлы статики (send_file) читаются целиком: они небольшие, а сжатое тело кэшируется
+        response.direct_passthrough = False
+        body = response.get_data()
+        if len(body) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        # Одинаковые для всех ответы (кэш страниц, публичная статика) сжимаются один раз на процесс
+        if g.get('page_cache_key') is not None or response.cache_control.public:
+            key = f'{encoding}:{hashlib.sha1(body).hexdigest()}'
+            compressed = compressed_bodies.get(key)
+            if compressed is None:
+                compressed = compression.compress(body, encoding, **levels)
+                compressed_bodies.set(key, compressed)
+        else:
+            compressed = compression.compress(body, encoding, **levels)
+        response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # Сжатое тело побайтно отличается от исходного: сильный ETag (статика) становится слабым
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+# Метрики для Prometheus
+@app.route('/metrics')
+@query_budget(1)
+def metrics():
+    if not app.config['METRICS_ENABLED']:
+        abort(404)
+    return request_metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+# Пользователь текущего запроса: загружается один раз и используется декораторами и представлениями.
+# Роли кэшируются на ROLE_CACHE_TTL секунд и сбрасываются при их изменении
+Identity = namedtuple('Identity', ['id', 'username', 'is_admin', 'is_moderator'])
+
+role_cache = make_cache_backend()
+
+
+def current_user():
+    if 'current_user' not in g:
+        g.current_user = load_identity(session.get('user_id'))
+    return g.current_user
+
+
+def load_identity(user_id):
+    if user_id is None:
+        return None
+
+    identity = cached_identity(user_id)
+    if identity is None:
+        # Объект остаётся в identity map сессии - повторный db.session.get() в запросе не пойдёт в БД
+        identity = remember_identity(db.session.get(User, user_id))
+    return identity
+
+
+def cached_identity(user_id):
+    return role_cache.get(f'identity:{user_id}')
+
+
+def remember_identity(user):
+    if user is None:
+        return None
+    identity = Identity(user.id, user.username, bool(user.is_admin), bool(user.is_moderator))
+    role_cache.set(f'identity:{user.id}', identity, ttl=app.config['ROLE_CACHE_TTL'])
+    return identity
+
+
+def forget_identity(user_id):
+    role_cache.delete(f'identity:{user_id}')
+
+
+# Роли в сессии (меню, кнопки) обновляются сразу после их изменения администратором
+@app.before_request
+def sync_session_roles():
+    if 'user_id' not in session:
+        return
+    user = current_user()
+    if user and (session.get('is_admin') != user.is_admin or session.get('is_moderator') != user.is_moderator):
+        session['is_admin'] = user.is_admin
+        session['is_moderator'] = user.is_moderator
+
+
+# Курсорная (keyset) пагинация: курсор хранит значения колонок сортировки последней строки
+def encode_cursor(*values):
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, *columns):
+    """Разбирает курсор в значения с типами колонок; для битого курсора возвращает None"""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            return None
+        return [cursor_value(value, column) for value, column in zip(values, columns)]
+    except (ValueError, TypeError):
+        return None
+
+
+def cursor_value(value, column):
+    """Значение из курсора с типом колонки; ValueError или TypeError, если тип не тот (в курсоре JSON клиента)"""
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    # bool - подкласс int; SQLite хранит целые не длиннее 64 бит
+    if not isinstance(value, python_type) or isinstance(value, bool):
+        raise TypeError(f'{column.key}: ожидается {python_type.__name__}')
+    if python_type is int and not -2 ** 63 <= value < 2 ** 63:
+        raise ValueError(f'{column.key}: значение вне диапазона')
+    return value
+
+
+def keyset_statement(query, sort_column, id_column, cursor, per_page, descending=True):
+    """Query или select() страницы после курсора - на одну строку больше, чтобы узнать, есть ли следующая"""
+    after = decode_cursor(cursor, sort_column, id_column)
+    if after:
+        position = db.tuple_(sort_column, id_column)
+        query = query.filter(position < tuple(after) if descending else position > tuple(after))
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
     else:
-        responses = [
-            f"🤔 Интересная мысль! Добавлю, что в контексте '{post_title}' также важно учитывать...",
-            f"💡 Дополню ваш комментарий: многие сталкиваются с подобным. Полезный лайфхак — ...",
-            f"📚 Если хотите глубже изучить тему '{post_title}', рекомендую посмотреть материалы по...",
-            f"✨ Ваш комментарий поднимает важный аспект. Стоит также обратить внимание на..."
-        ]
+        query = query.order_by(sort_column.asc(), id_column.asc())
+    return query.limit(per_page + 1)
+
+
+def split_page(rows, per_page, key):
+    """Возвращает (строки страницы, курсор следующей страницы или None)"""
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        return rows, encode_cursor(*key(rows[-1]))
+    return rows, None
+
+
+def keyset_page(query, sort_column, id_column, cursor, per_page, key, descending=True):
+    """Возвращает (объекты страницы select(Model), курсор следующей страницы или None)"""
+    rows = db.session.scalars(keyset_statement(query, sort_column, id_column, cursor, per_page, descending)).all()
+    return split_page(rows, per_page, key)
+
+
+def created_at_key(row):
+    return row.created_at, row.id
+
+
+# Запросы ленты и страницы поста строятся отдельно от выполнения: те же запросы выполняет
+# асинхронная версия этих страниц (asgi.py)
+def feed_statement(cursor):
+    # Авторы в том же запросе, счётчики - из денормализованных колонок
+    return keyset_statement(db.select(Post).options(db.joinedload(Post.author)), Post.created_at, Post.id, cursor,
+                            app.config['POSTS_PER_PAGE'])
+
+
+def liked_statement(viewer_id, post_ids):
+    # Лайки текущего пользователя - одним запросом на всю страницу
+    return db.select(Like.post_id).where(Like.user_id == viewer_id, Like.post_id.in_(post_ids))
+
+
+def feed_page(cursor, viewer_id=None):
+    posts, next_cursor = split_page(db.session.scalars(feed_statement(cursor)).all(), app.config['POSTS_PER_PAGE'],
+                                    created_at_key)
+    liked_post_ids = set()
+    if viewer_id and posts:
+        liked_post_ids = set(db.session.scalars(liked_statement(viewer_id, [post.id for post in posts])))
+    return (posts, next_cursor) + buffered_likes(posts, viewer_id, liked_post_ids)
+
+
+def buffered_likes(posts, viewer_id, liked_post_ids):
+    """(лайкнутые посты, изменения счётчиков) с учётом лайков, ещё не записанных из буфера"""
+    like_deltas = {}
+    if like_buffer is not None:
+        post_ids = [post.id for post in posts]
+        like_deltas = like_buffer.deltas(set(post_ids))
+        if viewer_id:
+            liked_post_ids = like_buffer.liked(viewer_id, post_ids, liked_post_ids)
+    return liked_post_ids, like_deltas
+
+
+def render_feed(cursor, posts, next_cursor, liked_post_ids, like_deltas):
+    return with_validators(render_template('index.html',
+                                           posts=posts,
+                                           cursor=cursor,
+                                           next_cursor=next_cursor,
+                                           liked_post_ids=liked_post_ids,
+                                           like_deltas=like_deltas))
+
+
+# Комментарии поста в порядке написания, постранично; авторы - в том же запросе
+def comments_statement(post_id, cursor):
+    statement = db.select(Comment).options(db.joinedload(Comment.author)).where(Comment.post_id == post_id)
+    return keyset_statement(statement, Comment.created_at, Comment.id, cursor, app.config['COMMENTS_PER_PAGE'],
+                            descending=False)
+
+
+def comments_page(post_id, cursor):
+    return split_page(db.session.scalars(comments_statement(post_id, cursor)).all(), app.config['COMMENTS_PER_PAGE'],
+                      created_at_key)
+
+
+# Отпечаток страницы ленты: id и версии постов страницы, без авторов и шаблона
+def feed_stamp_statement(cursor):
+    return keyset_statement(db.select(Post.id, Post.version, Post.created_at), Post.created_at, Post.id, cursor,
+                            app.config['POSTS_PER_PAGE'])
+
+
+def feed_validators(rows, cursor):
+    """(ETag, Last-Modified) страницы ленты по строкам feed_stamp_statement()"""
+    rows, next_cursor = split_page(rows, app.config['POSTS_PER_PAGE'], created_at_key)
+    etag = page_etag('feed', cursor, next_cursor, [(row.id, row.version) for row in rows], like_generation())
+    # Без Last-Modified: удаление поста меняет состав страницы, но не делает максимум дат новее.
+    # Удаление и любые другие изменения страницы видны по ETag
+    return etag, None
+
+
+def feed_stamp(cursor):
+    return feed_validators(db.session.execute(feed_stamp_statement(cursor)).all(), cursor)
+
+
+# Страница поста: отпечаток (версия поста), пост с автором и отрисовка
+def post_stamp_statement(post_id):
+    return db.select(Post.version, Post.created_at, Post.changed_at).where(Post.id == post_id)
+
+
+def post_validators(stamp, post_id, cursor):
+    if stamp is None:
+        abort(404)
+    return page_etag('post', post_id, stamp.version, cursor), stamp.changed_at or stamp.created_at
+
+
+def post_statement(post_id):
+    return db.select(Post).options(db.joinedload(Post.author)).where(Post.id == post_id)
+
+
+def render_post(post, cursor, comments, next_cursor):
+    return with_validators(stream_page('view_post.html',
+                                       post=post,
+                                       comments=comments,
+                                       cursor=cursor,
+                                       next_cursor=next_cursor))
+
+
+def stream_page(template_name, **context):
+    """Как render_template, но с STREAM_TEMPLATES HTML отдаётся по мере рендеринга"""
+    # Ленивые загрузки из шаблона потоковой страницы прошли бы мимо проверок QUERY_DEBUG - рендерим целиком
+    if not app.config['STREAM_TEMPLATES'] or app.config['QUERY_DEBUG']:
+        return render_template(template_name, **context)
+    # Кэш страниц (cached_page) при сохранении сам соберёт такой ответ в строку
+    return app.response_class(compression.coalesce(stream_template(template_name, **context),
+                                                   app.config['STREAM_CHUNK_SIZE']))
+
+
+# ИИ-ассистент (симуляция для бесплатной версии): категории и ответы - в AI_ASSISTANT_DATA
+assistant = Assistant.from_file(app.config['AI_ASSISTANT_DATA'])
 
-    return random.choice(responses) + " 🤖"
+
+def make_ai_backend():
+    if app.config['AI_BACKEND'] == 'http':
+        return HttpModelBackend(app.config['AI_MODEL_URL'], timeout=app.config['AI_MODEL_TIMEOUT'])
+    return assistant
+
+
+ai_responses = ResponseCache(make_ai_backend(), backend=make_cache_backend(app.config['AI_RESPONSE_CACHE_SIZE']))
+ai_jobs = JobQueue(ai_responses, max_workers=app.config['AI_WORKERS'], max_pending=app.config['AI_MAX_PENDING'])
+
+
+def comment_revision(comment, post_title):
+    """Ревизия ответа ИИ для комментария - объекта Comment или строки запроса с created_at и updated_at"""
+    return revision(comment.updated_at or comment.created_at, post_title)
+
+
+# Постановка ответа ИИ в очередь
+def submit_ai_job(comment_id, revision, comment_text, post_title):
+    return track_ai_job(ai_jobs.submit(comment_id, revision, comment_text, post_title), comment_id, revision)
+
+
+# Снимок задания - в общее хранилище для других воркеров; в режиме AI_PREGENERATE готовый ответ
+# сохраняется в ai_suggestion
+def track_ai_job(job, comment_id, revision):
+    if ai_job_store.name != 'memory':
+        publish_job(job)
+        job.add_done_callback(publish_job)
+    if app.config['AI_PREGENERATE']:
+        job.add_done_callback(lambda job: job.status == 'done' and store_suggestion(comment_id, revision, job.response))
+    return job
+
+
+# Состояние заданий в общем хранилище: при нескольких воркерах опрос статуса может прийти не в тот воркер,
+# который готовит ответ
+ai_job_store = make_job_store()
+
+
+def publish_job(job):
+    ai_job_store.set(f'ai_job:{job.id}', job.to_dict(), ttl=app.config['AI_JOB_TTL'])
+
+
+def find_job(job_id):
+    """Задание этого процесса или снимок задания другого воркера; None, если задания нет"""
+    job = ai_jobs.get(job_id)
+    if job is None and ai_job_store.name != 'memory':
+        data = ai_job_store.get(f'ai_job:{job_id}')
+        job = data and Job.from_dict(data)
+    return job
+
+
+def is_local_job(job):
+    return ai_jobs.get(job.id) is job
+
+
+def store_suggestion(comment_id, revision, response):
+    with app.app_context():
+        statement = sqlite_insert(AiSuggestion).values(
+            comment_id=comment_id, revision=revision, response=response, created_at=datetime.utcnow())
+        statement = statement.on_conflict_do_update(
+            index_elements=[AiSuggestion.comment_id],
+            set_={'revision': revision, 'response': response, 'created_at': datetime.utcnow()})
+
+        def store():
+            db.session.execute(statement)
+            db.session.commit()
+
+        try:
+            write_with_retry(store)
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Не удалось сохранить ответ ИИ для комментария %s', comment_id)
+
+
+# Фоновая подготовка ответа после записи комментария (после commit). При переполненной очереди
+# ответ будет подготовлен при первом запросе
+def pregenerate_suggestion(comment, post_title):
+    if not app.config['AI_PREGENERATE']:
+        return
+    try:
+        submit_ai_job(comment.id, comment_revision(comment, post_title), comment.content, post_title)
+    except QueueFull:
+        app.logger.warning('Очередь ИИ переполнена, ответ для комментария %s отложен', comment.id)
+
+
+# Подготовка ответов ИИ для всех комментариев без актуального ответа: flask --app main pregenerate-ai
+@app.cli.command('pregenerate-ai')
+def pregenerate_ai_command():
+    rows = db.session.query(Comment.id, Comment.content, Comment.created_at, Comment.updated_at, Post.title,
+                            AiSuggestion.revision) \
+        .join(Post, Post.id == Comment.post_id).outerjoin(AiSuggestion, AiSuggestion.comment_id == Comment.id).all()
+    stored = 0
+    for row in rows:
+        current = comment_revision(row, row.title)
+        if row.revision != current:
+            store_suggestion(row.id, current, ai_responses.respond(row.id, current, row.content, row.title))
+            stored += 1
+    click.echo(f'Ответы ИИ подготовлены: {stored} из {len(rows)} комментариев.')
 
 
 # Главная страница
 @app.route('/')
+@query_budget(5)
+@cached_page('feed')
 def index():
-    posts = Post.query.order_by(Post.created_at.desc()).all()
-    return render_template('index.html', posts=posts, emergency_services=EMERGENCY_SERVICES)
+    cursor = request.args.get('cursor')
+
+    unchanged = not_modified(*feed_stamp(cursor))
+    if unchanged:
+        return unchanged
+
+    return render_feed(cursor, *feed_page(cursor, session.get('user_id')))
+
+
+# Поиск по постам и комментариям
+@app.route('/search')
+@query_budget(3)
+def search():
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = app.config['SEARCH_PER_PAGE']
+
+    results = []
+    if query:
+        # Берём на одну запись больше, чтобы узнать, есть ли следующая страница
+        results = forum_search.search(db.session.connection(), query, per_page + 1, (page - 1) * per_page)
+    has_next = len(results) > per_page
+
+    return render_template('search.html',
+                           query=query,
+                           results=results[:per_page],
+                           page=page,
+                           has_next=has_next)
 
 
 # Регистрация
 @app.route('/register', methods=['GET', 'POST'])
+@query_budget(4)
+@write_retry
 def register():
     if request.method == 'POST':
         username = request.form['username']
@@ -196,11 +1203,12 @@ def register():
         flash('Регистрация успешна! Теперь вы можете войти.')
         return redirect(url_for('login'))
 
-    return render_template('register.html', emergency_services=EMERGENCY_SERVICES)
+    return render_template('register.html')
 
 
 # Вход
 @app.route('/login', methods=['GET', 'POST'])
+@query_budget(2)
 def login():
     if request.method == 'POST':
         username = request.form['username']
@@ -212,16 +1220,19 @@ def login():
             session['username'] = user.username
             session['is_admin'] = user.is_admin
             session['is_moderator'] = user.is_moderator
+            # Роли только что прочитаны из БД - устаревшая запись кэша не должна их перезаписать
+            forget_identity(user.id)
             flash('Вы успешно вошли!')
             return redirect(url_for('index'))
         else:
             flash('Неверное имя пользователя или пароль!')
 
-    return render_template('login.html', emergency_services=EMERGENCY_SERVICES)
+    return render_template('login.html')
 
 
 # Выход
 @app.route('/logout')
+@query_budget(1)
 def logout():
     session.pop('user_id', None)
     session.pop('username', None)
@@ -233,6 +1244,8 @@ def logout():
 
 # Создание поста
 @app.route('/create_post', methods=['GET', 'POST'])
+@query_budget(4)
+@write_retry
 def create_post():
     if 'user_id' not in session:
         flash('Пожалуйста, войдите в систему для создания поста.')
@@ -248,16 +1261,20 @@ def create_post():
 
         new_post = Post(title=title, content=content, user_id=session['user_id'])
         db.session.add(new_post)
+        bump_user_counters(session['user_id'], posts=1)
         db.session.commit()
+        invalidate_pages()
 
         flash('Пост успешно создан!')
         return redirect(url_for('index'))
 
-    return render_template('create_post.html', emergency_services=EMERGENCY_SERVICES)
+    return render_template('create_post.html')
 
 
 # Редактирование поста
 @app.route('/edit_post/<int:post_id>', methods=['GET', 'POST'])
+@query_budget(4)
+@write_retry
 def edit_post(post_id):
     if 'user_id' not in session:
         flash('Пожалуйста, войдите в систему.')
@@ -279,16 +1296,80 @@ def edit_post(post_id):
 
         post.title = title
         post.content = content
+        touch_post(post_id)
         db.session.commit()
+        invalidate_pages(post_id)
 
         flash('Пост успешно обновлен!')
         return redirect(url_for('view_post', post_id=post_id))
 
-    return render_template('edit_post.html', post=post, emergency_services=EMERGENCY_SERVICES)
+    return render_template('edit_post.html', post=post)
+
+
+# Каскадное удаление постов набором DELETE ... WHERE post_id IN (...) (без commit).
+# post_ids - список id или подзапрос db.select(Post.id)
+def delete_posts(post_ids):
+    # Авторы комментариев к этим постам теряют свои комментарии
+    lost_comments = (db.select(db.func.count(Comment.id))
+                     .where(Comment.user_id == User.id, Comment.post_id.in_(post_ids))
+                     .scalar_subquery())
+    db.session.execute(
+        db.update(User)
+        .where(User.id.in_(db.select(Comment.user_id).where(Comment.post_id.in_(post_ids))))
+        .values(comment_count=User.comment_count - lost_comments),
+        execution_options={'synchronize_session': False})
+
+    # Авторы постов теряют посты
+    lost_posts = (db.select(db.func.count(Post.id))
+                  .where(Post.user_id == User.id, Post.id.in_(post_ids))
+                  .scalar_subquery())
+    db.session.execute(
+        db.update(User)
+        .where(User.id.in_(db.select(Post.user_id).where(Post.id.in_(post_ids))))
+        .values(post_count=User.post_count - lost_posts),
+        execution_options={'synchronize_session': False})
+
+    AiSuggestion.query.filter(AiSuggestion.comment_id.in_(
+        db.select(Comment.id).where(Comment.post_id.in_(post_ids)))).delete(synchronize_session=False)
+    Comment.query.filter(Comment.post_id.in_(post_ids)).delete(synchronize_session=False)
+    Like.query.filter(Like.post_id.in_(post_ids)).delete(synchronize_session=False)
+    Post.query.filter(Post.id.in_(post_ids)).delete(synchronize_session=False)
+
+
+# Удаление пользователя со всем содержимым фиксированным числом запросов (без commit)
+def purge_user(user_id):
+    # Чужие посты теряют лайки и комментарии пользователя
+    lost_likes = (db.select(db.func.count(Like.id))
+                  .where(Like.post_id == Post.id, Like.user_id == user_id)
+                  .scalar_subquery())
+    db.session.execute(
+        db.update(Post)
+        .where(Post.id.in_(db.select(Like.post_id).where(Like.user_id == user_id)))
+        .values(like_count=Post.like_count - lost_likes, version=Post.version + 1, changed_at=datetime.utcnow()),
+        execution_options={'synchronize_session': False})
+
+    lost_comments = (db.select(db.func.count(Comment.id))
+                     .where(Comment.post_id == Post.id, Comment.user_id == user_id)
+                     .scalar_subquery())
+    db.session.execute(
+        db.update(Post)
+        .where(Post.id.in_(db.select(Comment.post_id).where(Comment.user_id == user_id)))
+        .values(comment_count=Post.comment_count - lost_comments, version=Post.version + 1,
+                changed_at=datetime.utcnow()),
+        execution_options={'synchronize_session': False})
+
+    delete_posts(db.select(Post.id).where(Post.user_id == user_id))
+    AiSuggestion.query.filter(AiSuggestion.comment_id.in_(
+        db.select(Comment.id).where(Comment.user_id == user_id))).delete(synchronize_session=False)
+    Comment.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    Like.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    User.query.filter_by(id=user_id).delete(synchronize_session=False)
 
 
 # Удаление поста
 @app.route('/delete_post/<int:post_id>')
+@query_budget(9)
+@write_retry
 def delete_post(post_id):
     if 'user_id' not in session:
         flash('Пожалуйста, войдите в систему.')
@@ -301,11 +1382,9 @@ def delete_post(post_id):
         flash('Вы можете удалять только свои посты!')
         return redirect(url_for('index'))
 
-    # Удаляем все комментарии и лайки к посту
-    Comment.query.filter_by(post_id=post_id).delete()
-    Like.query.filter_by(post_id=post_id).delete()
-    db.session.delete(post)
+    delete_posts([post.id])
     db.session.commit()
+    invalidate_pages(post_id)
 
     flash('Пост удален!')
     return redirect(url_for('index'))
@@ -313,8 +1392,18 @@ def delete_post(post_id):
 
 # Просмотр поста
 @app.route('/post/<int:post_id>', methods=['GET', 'POST'])
+@query_budget(7)
+@cached_page('post:{post_id}')
+@write_retry
 def view_post(post_id):
-    post = Post.query.get_or_404(post_id)
+    cursor = request.args.get('cursor')
+    if request.method == 'GET':
+        stamp = db.session.execute(post_stamp_statement(post_id)).first()
+        unchanged = not_modified(*post_validators(stamp, post_id, cursor))
+        if unchanged:
+            return unchanged
+
+    post = db.first_or_404(post_statement(post_id))
 
     if request.method == 'POST':
         content = request.form['content']
@@ -333,15 +1422,49 @@ def view_post(post_id):
             new_comment = Comment(content=content, user_id=session['user_id'], post_id=post_id, is_anonymous=False)
 
         db.session.add(new_comment)
+        bump_post_counters(post_id, comments=1)
+        if new_comment.user_id:
+            bump_user_counters(new_comment.user_id, comments=1)
         db.session.commit()
+        invalidate_pages(post_id)
+        pregenerate_suggestion(new_comment, post.title)
         flash('Комментарий добавлен!')
         return redirect(url_for('view_post', post_id=post_id))
 
-    return render_template('view_post.html', post=post, emergency_services=EMERGENCY_SERVICES)
+    return render_post(post, cursor, *comments_page(post_id, cursor))
+
+
+def comments_stamp_statement(post_id):
+    return db.select(Post.user_id, Post.version, Post.created_at, Post.changed_at).where(Post.id == post_id)
+
+
+# Следующие страницы комментариев для подгрузки при прокрутке: готовый HTML и курсор
+@app.route('/post/<int:post_id>/comments')
+@query_budget(3)
+def post_comments(post_id):
+    cursor = request.args.get('cursor')
+    stamp = db.session.execute(comments_stamp_statement(post_id)).first()
+    if stamp is None:
+        abort(404)
+    unchanged = not_modified(page_etag('comments', post_id, stamp.version, cursor),
+                             stamp.changed_at or stamp.created_at)
+    if unchanged:
+        return unchanged
+
+    comments, next_cursor = comments_page(post_id, cursor)
+    html = render_template('_comments.html', comments=comments, post_author_id=stamp.user_id)
+    return with_validators(jsonify({
+        'html': html,
+        'count': len(comments),
+        'next_cursor': next_cursor,
+        'next_url': url_for('post_comments', post_id=post_id, cursor=next_cursor) if next_cursor else None,
+    }))
 
 
 # Редактирование комментария
 @app.route('/edit_comment/<int:comment_id>', methods=['GET', 'POST'])
+@query_budget(6)
+@write_retry
 def edit_comment(comment_id):
     if 'user_id' not in session:
         flash('Пожалуйста, войдите в систему.')
@@ -368,16 +1491,21 @@ def edit_comment(comment_id):
         if session.get('is_admin'):
             comment.edited_by_admin = True
 
+        touch_post(comment.post_id)
         db.session.commit()
+        invalidate_pages(comment.post_id)
+        pregenerate_suggestion(comment, comment.post.title)
 
         flash('Комментарий успешно обновлен!')
         return redirect(url_for('view_post', post_id=comment.post_id))
 
-    return render_template('edit_comment.html', comment=comment, emergency_services=EMERGENCY_SERVICES)
+    return render_template('edit_comment.html', comment=comment)
 
 
 # Удаление комментария
 @app.route('/delete_comment/<int:comment_id>')
+@query_budget(7)
+@write_retry
 def delete_comment(comment_id):
     if 'user_id' not in session:
         flash('Пожалуйста, войдите в систему.')
@@ -391,120 +1519,468 @@ def delete_comment(comment_id):
         flash('Вы можете удалять только свои комментарии или комментарии к своим постам!')
         return redirect(url_for('view_post', post_id=comment.post_id))
 
+    AiSuggestion.query.filter_by(comment_id=comment.id).delete(synchronize_session=False)
     db.session.delete(comment)
+    bump_post_counters(comment.post_id, comments=-1)
+    if comment.user_id:
+        bump_user_counters(comment.user_id, comments=-1)
     db.session.commit()
+    invalidate_pages(comment.post_id)
 
     flash('Комментарий удален!')
     return redirect(url_for('view_post', post_id=comment.post_id))
 
 
+# Переключение лайка без предварительного SELECT (без commit): DELETE ... RETURNING снимает лайк,
+# иначе INSERT ... ON CONFLICT DO NOTHING ставит его, а UPDATE ... RETURNING меняет счётчик в той же транзакции.
+# Возвращает (поставлен ли лайк, новое число лайков) или None, если поста нет
+def toggle_like(user_id, post_id):
+    removed = db.session.execute(
+        db.delete(Like).where(Like.user_id == user_id, Like.post_id == post_id).returning(Like.id),
+        execution_options={'synchronize_session': False}).first()
+    if removed:
+        delta = -1
+    else:
+        # Параллельный запрос того же пользователя уже поставил лайк - счётчик не трогаем
+        added = db.session.execute(
+            sqlite_insert(Like).values(user_id=user_id, post_id=post_id, created_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=[Like.user_id, Like.post_id]).returning(Like.id)).first()
+        delta = 1 if added else 0
+
+    like_count = db.session.execute(
+        db.update(Post).where(Post.id == post_id)
+        .values(like_count=Post.like_count + delta, version=Post.version + 1, changed_at=datetime.utcnow())
+        .returning(Post.like_count),
+        execution_options={'synchronize_session': False}).scalar()
+    if like_count is None:
+        db.session.rollback()
+        return None
+    return delta >= 0, like_count
+
+
+# Запись пачки лайков из буфера одной транзакцией: changes - {(user_id, post_id): поставлен ли лайк}.
+# Лайки удалённых за это время постов и пользователей отбрасываются. commit(функция) фиксирует транзакцию
+# так, чтобы буфер одновременно перестал показывать пачку (LikeBuffer._commit)
+def apply_like_changes(changes, commit):
+    post_ids = {post_id for user_id, post_id in changes}
+    user_ids = {user_id for user_id, post_id in changes}
+    live_posts = set(db.session.scalars(db.select(Post.id).where(Post.id.in_(post_ids))))
+    live_users = set(db.session.scalars(db.select(User.id).where(User.id.in_(user_ids))))
+    now = datetime.utcnow()
+
+    deltas = Counter()
+    removed = [key for key, liked in changes.items() if not liked]
+    if removed:
+        deltas.subtract(db.session.scalars(
+            db.delete(Like).where(db.tuple_(Like.user_id, Like.post_id).in_(removed)).returning(Like.post_id),
+            execution_options={'synchronize_session': False}).all())
+    added = [{'user_id': user_id, 'post_id': post_id, 'created_at': now}
+             for (user_id, post_id), liked in changes.items()
+             if liked and post_id in live_posts and user_id in live_users]
+    if added:
+        deltas.update(db.session.scalars(
+            sqlite_insert(Like).values(added)
+            .on_conflict_do_nothing(index_elements=[Like.user_id, Like.post_id]).returning(Like.post_id)).all())
+
+    changed = [{'post_id': post_id, 'delta': delta} for post_id, delta in deltas.items() if delta]
+    if changed:
+        post = Post.__table__
+        db.session.execute(
+            post.update().where(post.c.id == db.bindparam('post_id'))
+            .values(like_count=post.c.like_count + db.bindparam('delta'), version=post.c.version + 1, changed_at=now),
+            changed)
+    commit(db.session.commit)
+    return [row['post_id'] for row in changed]
+
+
+def write_likes(changes, commit):
+    with app.app_context():
+        try:
+            changed = write_with_retry(lambda: apply_like_changes(changes, commit))
+        except Exception:
+            app.logger.exception('Не удалось записать пачку лайков (%s), повтор при следующей записи', len(changes))
+            raise
+    for post_id in changed:
+        invalidate_pages(post_id)
+
+
+like_buffer = None
+if app.config['LIKE_BUFFER_ENABLED']:
+    like_buffer = LikeBuffer(write_likes, interval=app.config['LIKE_BUFFER_INTERVAL_MS'] / 1000,
+                             max_events=app.config['LIKE_BUFFER_MAX_EVENTS'])
+    like_buffer.start()
+    # Накопленное записывается при остановке процесса
+    atexit.register(like_buffer.close)
+
+
+def like_state_statement(user_id, post_id):
+    return db.select(Post.like_count, db.exists().where(Like.user_id == user_id, Like.post_id == Post.id)) \
+        .where(Post.id == post_id)
+
+
+# Переключение лайка с записью: сразу в БД или через буфер. Возвращает (поставлен ли лайк, число лайков) или None
+def switch_like(user_id, post_id):
+    if like_buffer is None:
+        result = toggle_like(user_id, post_id)
+        if result is not None:
+            db.session.commit()
+            invalidate_pages(post_id)
+        return result
+
+    # Текущее состояние из БД одним запросом, поверх него - буфер
+    row = db.session.execute(like_state_statement(user_id, post_id)).first()
+    if row is None:
+        return None
+    liked = like_buffer.toggle(user_id, post_id, row[1])
+    page_cache.bump('likes')
+    return liked, row[0] + like_buffer.deltas({post_id}).get(post_id, 0)
+
+
+# Номер изменения лайков через буфер - для ETag ленты: счётчики на странице меняются раньше, чем версии
+# постов в БД. Хранится в общем хранилище кэша, чтобы у воркеров serve.py был один и тот же номер
+def like_generation():
+    if like_buffer is None:
+        return None
+    return page_cache.versions(['likes'])[0]
+
+
 # Лайк поста
 @app.route('/like_post/<int:post_id>')
+@query_budget(4)
+@write_retry
 def like_post(post_id):
     if 'user_id' not in session:
         flash('Пожалуйста, войдите в систему для лайка.')
         return redirect(url_for('login'))
 
-    post = Post.query.get_or_404(post_id)
+    result = switch_like(session['user_id'], post_id)
+    if result is None:
+        abort(404)
 
-    # Проверяем, лайкал ли пользователь уже этот пост
-    existing_like = Like.query.filter_by(user_id=session['user_id'], post_id=post_id).first()
+    flash('Пост понравился!' if result[0] else 'Лайк удален!')
+    return redirect(url_for('view_post', post_id=post_id))
 
-    if existing_like:
-        # Удаляем лайк (дизлайк)
-        db.session.delete(existing_like)
-        flash('Лайк удален!')
-    else:
-        # Добавляем лайк
-        new_like = Like(user_id=session['user_id'], post_id=post_id)
-        db.session.add(new_like)
-        flash('Пост понравился!')
 
-    db.session.commit()
-    return redirect(url_for('view_post', post_id=post_id))
+# Лайк без перезагрузки страницы: {"liked": ..., "like_count": ...}
+@app.route('/api/posts/<int:post_id>/like', methods=['POST'])
+@query_budget(4)
+@write_retry
+def api_like_post(post_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Войдите в систему для лайка', 'login_url': url_for('login')}), 401
+
+    result = switch_like(session['user_id'], post_id)
+    if result is None:
+        return jsonify({'success': False, 'error': 'Пост не найден'}), 404
+
+    liked, like_count = result
+    return jsonify({'success': True, 'post_id': post_id, 'liked': liked, 'like_count': like_count})
 
 
 # Маршрут для ИИ-ассистента
 @app.route('/ai_assistant/<int:comment_id>')
+@query_budget(2)
 def ai_assistant(comment_id):
-    comment = Comment.query.get_or_404(comment_id)
-    post = Post.query.get(comment.post_id)
-
-    # Генерируем ответ ИИ
-    ai_response = ai_assistant_response(comment.content, post.title)
+    comment = db.session.execute(ai_comment_statement(comment_id)).first()
+    response, job = stored_or_submitted(comment, comment_id)
+    if response is not None:
+        return response
+    job.wait(app.config['AI_SYNC_WAIT'])
+    return ai_job_response(job, comment_id)
+
+
+def ai_comment_statement(comment_id):
+    # Текст комментария, заголовок поста и сохранённый ответ одним запросом по первичным ключам
+    return db.select(Comment.content, Comment.created_at, Comment.updated_at, Post.title, AiSuggestion.revision,
+                     AiSuggestion.response) \
+        .join(Post, Post.id == Comment.post_id).outerjoin(AiSuggestion, AiSuggestion.comment_id == Comment.id) \
+        .where(Comment.id == comment_id)
+
+
+def stored_or_submitted(comment, comment_id):
+    """(готовый ответ, None) для сохранённого ответа или ошибки, иначе (None, поставленное задание)"""
+    if comment is None:
+        abort(404)
+    current = comment_revision(comment, comment.title)
+    if comment.response is not None and comment.revision == current:
+        return jsonify({'success': True, 'status': 'done', 'response': comment.response,
+                        'comment_id': comment_id}), None
+
+    # Ответ готовит пул воркеров; быстрый ответ (шаблоны, кэш) возвращаем сразу,
+    # медленный - как задание, которое страница опрашивает по status_url
+    try:
+        return None, submit_ai_job(comment_id, current, comment.content, comment.title)
+    except QueueFull as error:
+        return (jsonify({'success': False, 'error': str(error)}), 503), None
+
+
+def ai_job_response(job, comment_id=None):
+    data = job.to_dict()
+    data['comment_id'] = comment_id
+    if job.status == 'failed':
+        return jsonify(success=False, **data), 502
+    if job.status != 'done':
+        return jsonify(success=True, status_url=url_for('ai_job_status', job_id=job.id), **data), 202
+    return jsonify(success=True, **data)
+
+
+# Статус задания ИИ для опроса со страницы. С ?wait=N ответ ждёт завершения задания до N секунд
+# (не больше AI_LONG_POLL_MAX); в WSGI-режиме ожидание занимает поток, в ASGI (asgi.py) - нет
+@app.route('/ai_assistant/jobs/<job_id>')
+@query_budget(1)
+def ai_job_status(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Задание не найдено'}), 404
+    if is_local_job(job):
+        job.wait(long_poll_timeout())
+    else:
+        # Задание другого воркера: ждём, опрашивая общее хранилище
+        deadline = time.monotonic() + long_poll_timeout()
+        while job.status not in ('done', 'failed') and time.monotonic() < deadline:
+            time.sleep(app.config['AI_JOB_POLL_INTERVAL'])
+            job = find_job(job_id) or job
+    return ai_job_response(job)
+
+
+def long_poll_timeout():
+    return min(max(request.args.get('wait', 0, type=float), 0), app.config['AI_LONG_POLL_MAX'])
+
+
+def ai_batch_statement(comment_ids=None, post_id=None):
+    """Комментарии с заголовком поста и сохранённым ответом: по списку id или первые AI_BATCH_LIMIT у поста"""
+    statement = db.select(Comment.id, Comment.content, Comment.created_at, Comment.updated_at, Post.title,
+                          AiSuggestion.revision, AiSuggestion.response) \
+        .join(Post, Post.id == Comment.post_id).outerjoin(AiSuggestion, AiSuggestion.comment_id == Comment.id)
+    if comment_ids is not None:
+        return statement.where(Comment.id.in_(comment_ids))
+    return statement.where(Comment.post_id == post_id).order_by(Comment.created_at, Comment.id) \
+        .limit(app.config['AI_BATCH_LIMIT'])
+
+
+# Ответы ИИ для нескольких комментариев за один запрос: {"comment_ids": [...]} или {"post_id": N}.
+# С "cached_only": true - только уже готовые ответы (ai_suggestion и кэш), без генерации и очереди:
+# так страница поста подгружает ответы заранее, не расходуя модель на комментарии, о которых не спрашивали
+# Ответ: готовые ответы (responses), задания для опроса (pending) и не принятые очередью комментарии (failed);
+# если очередь не приняла ни одного, ответ 503
+@app.route('/ai_assistant/batch', methods=['POST'])
+@query_budget(2)
+def ai_assistant_batch():
+    data = request.get_json(silent=True) or {}
+    limit = app.config['AI_BATCH_LIMIT']
+
+    comment_ids = data.get('comment_ids')
+    if isinstance(comment_ids, list) and all(isinstance(value, int) for value in comment_ids):
+        if len(comment_ids) > limit:
+            return jsonify({'success': False, 'error': f'Не больше {limit} комментариев за запрос'}), 400
+        statement = ai_batch_statement(comment_ids=comment_ids)
+    elif isinstance(data.get('post_id'), int):
+        statement = ai_batch_statement(post_id=data['post_id'])
+    else:
+        return jsonify({'success': False, 'error': 'Нужен post_id или список comment_ids'}), 400
+
+    # Актуальные сохранённые ответы берутся из ai_suggestion. Остальные шаблоны классифицируют сразу, одним
+    # проходом в этом запросе; внешней модели пакет уходит одним запросом из пула (submit_many), и что
+    # не успело за AI_SYNC_WAIT, возвращается как задания
+    responses = {}
+    items = []
+    for row in db.session.execute(statement).all():
+        current = comment_revision(row, row.title)
+        if row.response is not None and row.revision == current:
+            responses[str(row.id)] = row.response
+        else:
+            items.append((row.id, current, row.content, row.title))
+    if data.get('cached_only') is True:
+        responses.update((str(comment_id), response)
+                         for comment_id, response in ai_responses.cached_many(items).items())
+        return jsonify({'success': True, 'responses': responses, 'pending': {}, 'failed': {}})
+    if ai_responses.source.name == 'template':
+        responses.update((str(comment_id), response)
+                         for comment_id, response in ai_responses.respond_many(items).items())
+        return jsonify({'success': True, 'responses': responses, 'pending': {}, 'failed': {}})
+
+    # Новых заданий у пакета не больше AI_BATCH_MAX_PENDING; комментарии сверх этого и не принятые
+    # переполненной очередью перечисляются в failed - их можно запросить позже по одному
+    jobs, rejected = ai_jobs.submit_many(items, limit=app.config['AI_BATCH_MAX_PENDING'])
+    for comment_id, current, _, _ in items:
+        if comment_id in jobs:
+            track_ai_job(jobs[comment_id], comment_id, current)
+    failed = {str(comment_id): 'Слишком много запросов к ИИ, попробуйте позже' for comment_id in rejected}
+    if failed and not responses and not jobs:
+        return jsonify({'success': False, 'error': next(iter(failed.values())), 'failed': failed}), 503
+
+    deadline = time.monotonic() + app.config['AI_SYNC_WAIT']
+    for job in jobs.values():
+        job.wait(max(deadline - time.monotonic(), 0))
+    responses.update((str(comment_id), job.response) for comment_id, job in jobs.items() if job.status == 'done')
 
     return jsonify({
         'success': True,
-        'response': ai_response,
-        'comment_id': comment_id
+        'responses': responses,
+        'pending': {str(comment_id): url_for('ai_job_status', job_id=job.id)
+                    for comment_id, job in jobs.items() if job.status in ('pending', 'running')},
+        'failed': failed,
     })
 
 
 # ==================== АДМИН-ПАНЕЛЬ ====================
 
+def recent_users_statement():
+    return db.select(User).order_by(User.created_at.desc(), User.id.desc()).limit(5)
+
+
 # Панель администратора - главная страница
 @app.route('/admin')
+@query_budget(3)
 @admin_required
 def admin_panel():
-    users = User.query.order_by(User.created_at.desc()).all()
-    posts = Post.query.order_by(Post.created_at.desc()).all()
-    comments = Comment.query.order_by(Comment.created_at.desc()).all()
+    # Статистика - одним запросом из COUNT(*), без загрузки строк
+    def count_of(model):
+        return db.select(db.func.count()).select_from(model).scalar_subquery()
+
+    totals = db.session.execute(db.select(
+        count_of(User).label('users'),
+        count_of(Post).label('posts'),
+        count_of(Comment).label('comments'),
+        count_of(Like).label('likes'),
+    )).one()
 
-    # Статистика
-    total_users = len(users)
-    total_posts = len(posts)
-    total_comments = len(comments)
-    total_likes = Like.query.count()
+    recent_users = db.session.scalars(recent_users_statement()).all()
 
     return render_template('admin.html',
-                           users=users,
-                           posts=posts,
-                           comments=comments,
-                           total_users=total_users,
-                           total_posts=total_posts,
-                           total_comments=total_comments,
-                           total_likes=total_likes,
-                           emergency_services=EMERGENCY_SERVICES)
+                           purge_jobs=purge_jobs_snapshot(),
+                           users=recent_users,
+                           total_users=totals.users,
+                           total_posts=totals.posts,
+                           total_comments=totals.comments,
+                           total_likes=totals.likes)
+
+
+# Сортировка и курсорная пагинация списков админки по параметрам sort, dir и cursor
+def admin_list_page(query, sort_columns, id_column):
+    sort = request.args.get('sort')
+    if sort not in sort_columns:
+        sort = next(iter(sort_columns))
+    descending = request.args.get('dir') != 'asc'
+    column = sort_columns[sort]
+
+    items, next_cursor = keyset_page(query, column, id_column, request.args.get('cursor'),
+                                     app.config['ADMIN_PER_PAGE'],
+                                     key=lambda item: (getattr(item, column.key), item.id),
+                                     descending=descending)
+
+    # Текущие фильтры и сортировка - для ссылки на следующую страницу
+    list_args = {name: value for name, value in request.args.items() if name != 'cursor' and value}
+    return {
+        'next_cursor': next_cursor,
+        'cursor': request.args.get('cursor'),
+        'sort': sort,
+        'descending': descending,
+        'list_args': list_args,
+    }, items
+
+
+# Запросы списков админки с фильтрами из args (request.args); сортировки - первая по умолчанию
+ADMIN_POST_SORTS = {
+    'created_at': Post.created_at,
+    'like_count': Post.like_count,
+    'comment_count': Post.comment_count,
+}
+ADMIN_COMMENT_SORTS = {'created_at': Comment.created_at}
+ADMIN_USER_SORTS = {
+    'created_at': User.created_at,
+    'username': User.username,
+}
+
+
+def admin_posts_statement(args):
+    statement = db.select(Post).options(db.joinedload(Post.author))
+    search = args.get('q', '').strip()
+    if search:
+        statement = statement.where(Post.title.contains(search))
+    author = args.get('author', '').strip()
+    if author:
+        statement = statement.where(
+            Post.user_id == db.select(User.id).where(User.username == author).scalar_subquery())
+    return statement
+
+
+def admin_comments_statement(args):
+    statement = db.select(Comment).options(db.joinedload(Comment.author), db.joinedload(Comment.post))
+    search = args.get('q', '').strip()
+    if search:
+        statement = statement.where(Comment.content.contains(search))
+    post_id = args.get('post_id', type=int)
+    if post_id:
+        statement = statement.where(Comment.post_id == post_id)
+    if args.get('anonymous') == 'yes':
+        statement = statement.where(Comment.is_anonymous.is_(True))
+    elif args.get('anonymous') == 'no':
+        statement = statement.where(Comment.is_anonymous.isnot(True))
+    return statement
+
+
+def admin_users_statement(args):
+    statement = db.select(User)
+    search = args.get('q', '').strip()
+    if search:
+        statement = statement.where(db.or_(User.username.contains(search), User.email.contains(search)))
+    role = args.get('role')
+    if role == 'admin':
+        statement = statement.where(User.is_admin.is_(True))
+    elif role == 'moderator':
+        statement = statement.where(User.is_moderator.is_(True), User.is_admin.isnot(True))
+    elif role == 'user':
+        statement = statement.where(User.is_admin.isnot(True), User.is_moderator.isnot(True))
+    return statement
 
 
 # Все посты (для админа)
 @app.route('/admin/posts')
+@query_budget(2)
 @admin_required
 def admin_posts():
-    posts = Post.query.order_by(Post.created_at.desc()).all()
-    return render_template('admin_posts.html', posts=posts, emergency_services=EMERGENCY_SERVICES)
+    page, posts = admin_list_page(admin_posts_statement(request.args), ADMIN_POST_SORTS, Post.id)
+    return stream_page('admin_posts.html', posts=posts, page=page)
 
 
 # Все комментарии (для админа)
 @app.route('/admin/comments')
+@query_budget(2)
 @admin_required
 def admin_comments():
-    comments = Comment.query.order_by(Comment.created_at.desc()).all()
-    return render_template('admin_comments.html', comments=comments, emergency_services=EMERGENCY_SERVICES)
+    page, comments = admin_list_page(admin_comments_statement(request.args), ADMIN_COMMENT_SORTS, Comment.id)
+    return stream_page('admin_comments.html', comments=comments, page=page)
 
 
 # Все пользователи (для админа)
 @app.route('/admin/users')
+@query_budget(2)
 @admin_required
 def admin_users():
-    users = User.query.order_by(User.created_at.desc()).all()
-    return render_template('admin_users.html', users=users, emergency_services=EMERGENCY_SERVICES)
+    page, users = admin_list_page(admin_users_statement(request.args), ADMIN_USER_SORTS, User.id)
+    return stream_page('admin_users.html', users=users, page=page)
 
 
 # Сделать пользователя администратором
 @app.route('/admin/make_admin/<int:user_id>')
+@query_budget(4)
 @admin_required
+@write_retry
 def make_admin(user_id):
     user = User.query.get_or_404(user_id)
     user.is_admin = True
     db.session.commit()
+    forget_identity(user_id)
     flash(f'✅ Пользователь {user.username} теперь администратор!')
     return redirect(url_for('admin_users'))
 
 
 # Убрать права администратора
 @app.route('/admin/remove_admin/<int:user_id>')
+@query_budget(4)
 @admin_required
+@write_retry
 def remove_admin(user_id):
     user = User.query.get_or_404(user_id)
     if user.id == session['user_id']:
@@ -512,35 +1988,44 @@ def remove_admin(user_id):
         return redirect(url_for('admin_users'))
     user.is_admin = False
     db.session.commit()
+    forget_identity(user_id)
     flash(f'✅ Права администратора у пользователя {user.username} удалены!')
     return redirect(url_for('admin_users'))
 
 
 # Сделать пользователя модератором
 @app.route('/admin/make_moderator/<int:user_id>')
+@query_budget(4)
 @admin_required
+@write_retry
 def make_moderator(user_id):
     user = User.query.get_or_404(user_id)
     user.is_moderator = True
     db.session.commit()
+    forget_identity(user_id)
     flash(f'✅ Пользователь {user.username} теперь модератор!')
     return redirect(url_for('admin_users'))
 
 
 # Убрать права модератора
 @app.route('/admin/remove_moderator/<int:user_id>')
+@query_budget(4)
 @admin_required
+@write_retry
 def remove_moderator(user_id):
     user = User.query.get_or_404(user_id)
     user.is_moderator = False
     db.session.commit()
+    forget_identity(user_id)
     flash(f'✅ Права модератора у пользователя {user.username} удалены!')
     return redirect(url_for('admin_users'))
 
 
 # Удалить пользователя (админ)
 @app.route('/admin/delete_user/<int:user_id>')
+@query_budget(14)
 @admin_required
+@write_retry
 def delete_user(user_id):
     user = User.query.get_or_404(user_id)
     if user.id == session['user_id']:
@@ -549,37 +2034,151 @@ def delete_user(user_id):
 
     username = user.username
 
-    # Удаляем все посты пользователя
-    posts = Post.query.filter_by(user_id=user_id).all()
-    for post in posts:
-        Comment.query.filter_by(post_id=post.id).delete()
-        Like.query.filter_by(post_id=post.id).delete()
-        db.session.delete(post)
-
-    # Удаляем все комментарии пользователя
-    Comment.query.filter_by(user_id=user_id).delete()
-
-    # Удаляем лайки пользователя
-    Like.query.filter_by(user_id=user_id).delete()
+    # Крупные аккаунты удаляем в фоне, чтобы не держать запрос и блокировку БД
+    if user.post_count > app.config['BACKGROUND_PURGE_THRESHOLD']:
+        if start_purge_job(user):
+            flash(f'✅ Удаление пользователя {username} запущено в фоне. Прогресс - в админке.')
+        else:
+            flash(f'Удаление пользователя {username} уже выполняется.')
+        return redirect(url_for('admin_panel'))
 
-    # Удаляем пользователя
-    db.session.delete(user)
+    purge_user(user_id)
     db.session.commit()
+    forget_identity(user_id)
+    invalidate_pages(site=True)
 
     flash(f'✅ Пользователь {username} удален!')
     return redirect(url_for('admin_users'))
 
 
+# Фоновые задачи удаления пользователей. Состояние хранится в общем хранилище заданий (make_job_store): при
+# нескольких воркерах админка и опрос прогресса попадают в любой из них. Номер задания выдаёт incr хранилища
+# (он атомарен во всех хранилищах), по номеру лежит purge_job:<номер>, по пользователю - номер его
+# последнего задания. Задание, воркер которого упал, пропадёт через PURGE_JOB_TTL после последней пачки
+purge_job_store = make_job_store()
+purge_jobs_lock = threading.Lock()
+
+
+def start_purge_job(user):
+    # Блокировка защищает от двойного запуска внутри процесса; между воркерами повторный клик в ту же
+    # секунду может запустить второе задание - оно просто не найдёт постов для удаления
+    with purge_jobs_lock:
+        job = purge_job_store.get(f'purge_job:{purge_job_store.get(f"purge_user:{user.id}")}')
+        if job and job['status'] == 'running':
+            return False
+        job_id = purge_job_store.incr('purge_job')
+        save_purge_job(job_id, {
+            'user_id': user.id,
+            'username': user.username,
+            'total_posts': user.post_count,
+            'deleted_posts': 0,
+            'status': 'running',
+            'error': None,
+            'started_at': datetime.utcnow(),
+            'finished_at': None,
+        })
+        purge_job_store.set(f'purge_user:{user.id}', job_id, ttl=app.config['PURGE_JOB_TTL'])
+    threading.Thread(target=run_purge_job, args=(job_id, user.id), daemon=True).start()
+    return True
+
+
+def save_purge_job(job_id, job):
+    purge_job_store.set(f'purge_job:{job_id}', job, ttl=app.config['PURGE_JOB_TTL'])
+
+
+def update_purge_job(job_id, **changes):
+    # Задание меняет только поток, который его выполняет, поэтому чтение и запись не пересекаются
+    job = purge_job_store.get(f'purge_job:{job_id}')
+    if job is not None:
+        job.update(changes)
+        save_purge_job(job_id, job)
+
+
+def run_purge_job(job_id, user_id):
+    batch_size = app.config['PURGE_BATCH_SIZE']
+    with app.app_context():
+        try:
+            # Посты удаляем пачками, каждая пачка - отдельная короткая транзакция
+            deleted = 0
+            while True:
+                batch = db.session.scalars(
+                    db.select(Post.id).where(Post.user_id == user_id).order_by(Post.id).limit(batch_size)).all()
+                if not batch:
+                    break
+                write_with_retry(lambda: (delete_posts(batch), db.session.commit()))
+                invalidate_pages(site=True)
+                deleted += len(batch)
+                update_purge_job(job_id, deleted_posts=deleted)
+
+            write_with_retry(lambda: (purge_user(user_id), db.session.commit()))
+            forget_identity(user_id)
+            invalidate_pages(site=True)
+            update_purge_job(job_id, status='done', finished_at=datetime.utcnow())
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception('Ошибка фонового удаления пользователя %s', user_id)
+            update_purge_job(job_id, status='failed', error=str(e), finished_at=datetime.utcnow())
+
+
+def purge_jobs_snapshot():
+    """Последние PURGE_JOB_HISTORY заданий всех воркеров, новые первыми"""
+    last = purge_job_store.get_counter('purge_job')
+    jobs = (purge_job_store.get(f'purge_job:{job_id}')
+            for job_id in range(last, max(last - app.config['PURGE_JOB_HISTORY'], 0), -1))
+    return [job for job in jobs if job is not None]
+
+
+# Прогресс фоновых удалений (для опроса из админки)
+@app.route('/admin/purge_jobs')
+@query_budget(1)
+@admin_required
+def admin_purge_jobs():
+    # Копии: хранилище в памяти процесса отдаёт те же объекты, что хранит
+    jobs = [dict(job, started_at=job['started_at'].isoformat(),
+                 finished_at=job['finished_at'] and job['finished_at'].isoformat())
+            for job in purge_jobs_snapshot()]
+    return jsonify({'jobs': jobs})
+
+
+# Статистика кэша страниц
+@app.route('/admin/cache_stats')
+@query_budget(1)
+@admin_required
+def admin_cache_stats():
+    return jsonify(page_cache.stats())
+
+
+# Воркеры сервера serve.py: мастер публикует список воркеров, каждый воркер - своё состояние
+@app.route('/admin/workers')
+@query_budget(1)
+@admin_required
+def admin_workers():
+    server = page_cache.backend.get('server') or {}
+    workers = [page_cache.backend.get(f'worker:{pid}') for pid in server.get('workers', [])]
+    return jsonify(server=server, workers=[worker for worker in workers if worker])
+
+
+# Статистика буфера лайков: события, взаимно отменённые переключения, размеры пачек
+@app.route('/admin/like_buffer_stats')
+@query_budget(1)
+@admin_required
+def admin_like_buffer_stats():
+    if like_buffer is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(like_buffer.stats(), enabled=True))
+
+
 # Удалить пост (админ)
 @app.route('/admin/delete_post/<int:post_id>')
+@query_budget(8)
 @admin_required
+@write_retry
 def admin_delete_post(post_id):
     post = Post.query.get_or_404(post_id)
 
-    Comment.query.filter_by(post_id=post_id).delete()
-    Like.query.filter_by(post_id=post_id).delete()
-    db.session.delete(post)
+    delete_posts([post.id])
     db.session.commit()
+    invalidate_pages(post_id)
 
     flash('✅ Пост удален администратором!')
     return redirect(url_for('admin_posts'))
@@ -587,11 +2186,18 @@ def admin_delete_post(post_id):
 
 # Удалить комментарий (админ)
 @app.route('/admin/delete_comment/<int:comment_id>')
+@query_budget(6)
 @admin_required
+@write_retry
 def admin_delete_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
+    AiSuggestion.query.filter_by(comment_id=comment.id).delete(synchronize_session=False)
     db.session.delete(comment)
+    bump_post_counters(comment.post_id, comments=-1)
+    if comment.user_id:
+        bump_user_counters(comment.user_id, comments=-1)
     db.session.commit()
+    invalidate_pages(comment.post_id)
 
     flash('✅ Комментарий удален администратором!')
     return redirect(url_for('admin_comments'))
@@ -599,7 +2205,9 @@ def admin_delete_comment(comment_id):
 
 # Редактировать комментарий (админ)
 @app.route('/admin/edit_comment/<int:comment_id>', methods=['GET', 'POST'])
+@query_budget(6)
 @admin_required
+@write_retry
 def admin_edit_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
 
@@ -613,18 +2221,23 @@ def admin_edit_comment(comment_id):
         comment.content = content
         comment.updated_at = datetime.utcnow()
         comment.edited_by_admin = True
+        touch_post(comment.post_id)
 
         db.session.commit()
+        invalidate_pages(comment.post_id)
+        pregenerate_suggestion(comment, comment.post.title)
 
         flash('✅ Комментарий успешно обновлен администратором!')
         return redirect(url_for('admin_comments'))
 
-    return render_template('admin_edit_comment.html', comment=comment, emergency_services=EMERGENCY_SERVICES)
+    return render_template('admin_edit_comment.html', comment=comment)
 
 
 # Редактировать пост (админ)
 @app.route('/admin/edit_post/<int:post_id>', methods=['GET', 'POST'])
+@query_budget(4)
 @admin_required
+@write_retry
 def admin_edit_post(post_id):
     post = Post.query.get_or_404(post_id)
 
@@ -638,34 +2251,447 @@ def admin_edit_post(post_id):
 
         post.title = title
         post.content = content
+        touch_post(post_id)
 
         db.session.commit()
+        invalidate_pages(post_id)
 
         flash('✅ Пост успешно обновлен администратором!')
         return redirect(url_for('admin_posts'))
 
-    return render_template('admin_edit_post.html', post=post, emergency_services=EMERGENCY_SERVICES)
+    return render_template('admin_edit_post.html', post=post)
+
+
+def profile_posts_statement(user_id):
+    # Посты пользователя новыми первыми - сортирует индекс (user_id, created_at), а не шаблон
+    return db.select(Post).where(Post.user_id == user_id).order_by(Post.created_at.desc(), Post.id.desc())
 
 
 # Мой профиль
 @app.route('/profile')
+@query_budget(3)
 def profile():
     if 'user_id' not in session:
         flash('Пожалуйста, войдите в систему.')
         return redirect(url_for('login'))
 
-    user = User.query.get(session['user_id'])
+    identity = current_user()
 
     # Проверка: пользователь существует в базе данных
-    if not user:
+    if not identity:
         flash('Пользователь не найден. Пожалуйста, войдите снова.')
         session.pop('user_id', None)
         session.pop('username', None)
         session.pop('is_admin', None)
         return redirect(url_for('login'))
 
-    return render_template('profile.html', user=user, emergency_services=EMERGENCY_SERVICES)
+    user = db.session.get(User, identity.id)
+    posts = db.session.scalars(profile_posts_statement(identity.id)).all()
+    return render_template('profile.html', user=user, posts=posts)
+
+
+# ==================== JSON API ====================
+
+# Версия 1: /api/v1/... Строки читаются запросами Core по нужным колонкам и сразу превращаются в JSON, без
+# ORM-объектов. ?fields= сужает сам SELECT, ?include= добавляет колонки связанных таблиц JOIN-ом в тот же запрос
+# (author, post) или денормализованные счётчики (counts). Права те же, что у страниц: посты и комментарии
+# видны всем, email и роли - самому пользователю и администратору, лайки пользователя - ему и администратору
+ApiResource = namedtuple('ApiResource', ['model', 'fields', 'default', 'includes', 'joins', 'private'])
+
+API_POSTS = ApiResource(
+    model=Post,
+    fields={'id': Post.id, 'title': Post.title, 'content': Post.content, 'user_id': Post.user_id,
+            'created_at': Post.created_at, 'changed_at': Post.changed_at},
+    default=('id', 'title', 'content', 'user_id', 'created_at', 'changed_at'),
+    includes={
+        'author': {'author__id': User.id, 'author__username': User.username},
+        'counts': {'counts__likes': Post.like_count, 'counts__comments': Post.comment_count},
+        # Лайкнул ли пост текущий пользователь - одним запросом на все строки (post_items)
+        'liked': {},
+    },
+    joins={'author': (User, User.id == Post.user_id)},
+    private=(),
+)
+
+API_COMMENTS = ApiResource(
+    model=Comment,
+    fields={'id': Comment.id, 'post_id': Comment.post_id, 'user_id': Comment.user_id, 'content': Comment.content,
+            'is_anonymous': Comment.is_anonymous, 'created_at': Comment.created_at,
+            'updated_at': Comment.updated_at, 'edited_by_admin': Comment.edited_by_admin},
+    default=('id', 'post_id', 'user_id', 'content', 'is_anonymous', 'created_at', 'updated_at'),
+    includes={
+        'author': {'author__id': User.id, 'author__username': User.username},
+        'post': {'post__id': Post.id, 'post__title': Post.title},
+    },
+    # У анонимного комментария автора нет - author будет null
+    joins={'author': (User, User.id == Comment.user_id), 'post': (Post, Post.id == Comment.post_id)},
+    private=(),
+)
+
+API_USERS = ApiResource(
+    model=User,
+    fields={'id': User.id, 'username': User.username, 'email': User.email, 'is_admin': User.is_admin,
+            'is_moderator': User.is_moderator, 'created_at': User.created_at},
+    default=('id', 'username', 'created_at'),
+    includes={'counts': {'counts__posts': User.post_count, 'counts__comments': User.comment_count}},
+    joins={},
+    private=('email', 'is_admin', 'is_moderator'),
+)
+
+API_LIKES = ApiResource(
+    model=Like,
+    fields={'id': Like.id, 'user_id': Like.user_id, 'post_id': Like.post_id, 'created_at': Like.created_at},
+    default=('id', 'post_id', 'created_at'),
+    includes={'post': {'post__id': Post.id, 'post__title': Post.title}},
+    joins={'post': (Post, Post.id == Like.post_id)},
+    private=(),
+)
+
+
+@app.errorhandler(api.ApiError)
+def api_error(error):
+    return jsonify({'success': False, 'error': str(error)}), error.status
+
+
+def api_params(resource):
+    """(поля, связанные данные) из ?fields= и ?include="""
+    return (api.parse_fields(request.args.get('fields'), list(resource.fields), resource.default),
+            api.parse_include(request.args.get('include'), list(resource.includes)))
+
+
+def api_statement(resource, fields, include):
+    # id и created_at выбираются всегда: по ним строится курсор и раскладываются строки пакетного запроса
+    columns = {'id': resource.model.id, 'created_at': resource.model.created_at}
+    columns.update((name, resource.fields[name]) for name in fields)
+    for name in include:
+        columns.update(resource.includes[name])
+    statement = db.select(*[column.label(name) for name, column in columns.items()]).select_from(resource.model)
+    for name in include:
+        if name in resource.joins:
+            statement = statement.outerjoin(*resource.joins[name])
+    return statement
+
+
+def api_items(resource, rows, fields, include):
+    viewer = current_user()
+    names = fields + [column for name in include for column in resource.includes[name]]
+    items = []
+    for row in rows:
+        item = api.serialize(row, names)
+        if resource.private and not (viewer and (viewer.is_admin or viewer.id == row.id)):
+            for name in resource.private:
+                item.pop(name, None)
+        items.append(item)
+    return items
+
+
+def post_items(rows, fields, include):
+    """Посты с поправкой счётчиков на ещё не записанные лайки из буфера и с отметкой liked"""
+    items = api_items(API_POSTS, rows, fields, include)
+    viewer_id = session.get('user_id')
+    liked_post_ids = set()
+    if 'liked' in include and viewer_id and rows:
+        liked_post_ids = set(db.session.scalars(liked_statement(viewer_id, [row.id for row in rows])))
+    liked_post_ids, like_deltas = buffered_likes(rows, viewer_id, liked_post_ids)
+    for row, item in zip(rows, items):
+        if 'counts' in include:
+            item['counts']['likes'] += like_deltas.get(row.id, 0)
+        if 'liked' in include:
+            item['liked'] = row.id in liked_post_ids
+    return items
+
+
+def api_page(resource, statement, descending=True):
+    """Строки страницы списка по ?cursor= и ?limit= и курсор следующей страницы"""
+    per_page = min(max(request.args.get('limit', app.config['API_PER_PAGE'], type=int), 1),
+                   app.config['API_MAX_PER_PAGE'])
+    statement = api_page_statement(resource, statement, request.args.get('cursor'), per_page, descending)
+    return split_page(db.session.execute(statement).all(), per_page, created_at_key)
+
+
+def api_page_statement(resource, statement, cursor, per_page, descending=True):
+    return keyset_statement(statement, resource.model.created_at, resource.model.id, cursor, per_page, descending)
+
+
+def api_batch_statement(resource, statement, ids):
+    return statement.where(resource.model.id.in_(ids))
+
+
+def api_batch(resource, statement):
+    """Строки по ?ids= одним запросом, в порядке ids, и id, которых нет"""
+    ids = api.parse_ids(request.args['ids'], app.config['API_BATCH_LIMIT'])
+    rows = {row.id: row for row in db.session.execute(api_batch_statement(resource, statement, ids))}
+    return [rows[id_] for id_ in ids if id_ in rows], [id_ for id_ in ids if id_ not in rows]
+
+
+def api_one_statement(resource, statement, object_id):
+    return statement.where(resource.model.id == object_id)
+
+
+def api_one(resource, statement, object_id, not_found):
+    row = db.session.execute(api_one_statement(resource, statement, object_id)).first()
+    if row is None:
+        raise api.ApiError(not_found, 404)
+    return row
+
+
+def api_list_response(items, next_cursor):
+    next_url = None
+    if next_cursor:
+        next_url = url_for(request.endpoint, **request.view_args, **dict(request.args.items(), cursor=next_cursor))
+    return jsonify({'success': True, 'data': items, 'next_cursor': next_cursor, 'next_url': next_url})
+
+
+def api_batch_response(items, missing):
+    return jsonify({'success': True, 'data': items, 'missing': missing})
+
+
+def api_posts_statement(fields, include, author=None):
+    statement = api_statement(API_POSTS, fields, include)
+    if author:
+        statement = statement.where(Post.user_id == author)
+    return statement
+
+
+# Лента постов (новые первыми, ?author=<id> - посты пользователя) или посты по ?ids=
+@app.route('/api/v1/posts')
+@query_budget(3)
+def api_posts():
+    fields, include = api_params(API_POSTS)
+    if 'ids' in request.args:
+        rows, missing = api_batch(API_POSTS, api_statement(API_POSTS, fields, include))
+        return api_batch_response(post_items(rows, fields, include), missing)
+
+    statement = api_posts_statement(fields, include, request.args.get('author', type=int))
+    rows, next_cursor = api_page(API_POSTS, statement)
+    return api_list_response(post_items(rows, fields, include), next_cursor)
+
+
+@app.route('/api/v1/posts/<int:post_id>')
+@query_budget(3)
+def api_post(post_id):
+    fields, include = api_params(API_POSTS)
+    row = api_one(API_POSTS, api_statement(API_POSTS, fields, include), post_id, 'Пост не найден')
+    return jsonify({'success': True, 'data': post_items([row], fields, include)[0]})
+
+
+def api_post_comments_statement(fields, include, post_id):
+    return api_statement(API_COMMENTS, fields, include).where(Comment.post_id == post_id)
+
+
+# Комментарии поста в порядке написания
+@app.route('/api/v1/posts/<int:post_id>/comments')
+@query_budget(3)
+def api_post_comments(post_id):
+    fields, include = api_params(API_COMMENTS)
+    if db.session.execute(db.select(Post.id).where(Post.id == post_id)).first() is None:
+        raise api.ApiError('Пост не найден', 404)
+    rows, next_cursor = api_page(API_COMMENTS, api_post_comments_statement(fields, include, post_id),
+                                 descending=False)
+    return api_list_response(api_items(API_COMMENTS, rows, fields, include), next_cursor)
+
+
+# Комментарии по ?ids= (например, все комментарии из уведомлений одним запросом)
+@app.route('/api/v1/comments')
+@query_budget(2)
+def api_comments():
+    fields, include = api_params(API_COMMENTS)
+    if 'ids' not in request.args:
+        raise api.ApiError('Нужен параметр ids; комментарии поста - /api/v1/posts/<id>/comments')
+    rows, missing = api_batch(API_COMMENTS, api_statement(API_COMMENTS, fields, include))
+    return api_batch_response(api_items(API_COMMENTS, rows, fields, include), missing)
+
+
+@app.route('/api/v1/comments/<int:comment_id>')
+@query_budget(2)
+def api_comment(comment_id):
+    fields, include = api_params(API_COMMENTS)
+    row = api_one(API_COMMENTS, api_statement(API_COMMENTS, fields, include), comment_id, 'Комментарий не найден')
+    return jsonify({'success': True, 'data': api_items(API_COMMENTS, [row], fields, include)[0]})
+
+
+# Пользователи по ?ids= (авторы из ленты одним запросом); полный список - только в админке
+@app.route('/api/v1/users')
+@query_budget(2)
+def api_users():
+    fields, include = api_params(API_USERS)
+    if 'ids' not in request.args:
+        raise api.ApiError('Нужен параметр ids')
+    rows, missing = api_batch(API_USERS, api_statement(API_USERS, fields, include))
+    return api_batch_response(api_items(API_USERS, rows, fields, include), missing)
+
+
+@app.route('/api/v1/users/<int:user_id>')
+@query_budget(2)
+def api_user(user_id):
+    fields, include = api_params(API_USERS)
+    row = api_one(API_USERS, api_statement(API_USERS, fields, include), user_id, 'Пользователь не найден')
+    return jsonify({'success': True, 'data': api_items(API_USERS, [row], fields, include)[0]})
+
+
+def api_user_likes_statement(fields, include, user_id):
+    return api_statement(API_LIKES, fields, include).where(Like.user_id == user_id)
+
+
+# Лайки пользователя, новые первыми. Ещё не записанные из буфера (LIKE_BUFFER_ENABLED) появятся после записи
+@app.route('/api/v1/users/<int:user_id>/likes')
+@query_budget(2)
+def api_user_likes(user_id):
+    fields, include = api_params(API_LIKES)
+    viewer = current_user()
+    if viewer is None:
+        raise api.ApiError('Войдите в систему', 401)
+    if viewer.id != user_id and not viewer.is_admin:
+        raise api.ApiError('Лайки пользователя видны только ему и администратору', 403)
+    rows, next_cursor = api_page(API_LIKES, api_user_likes_statement(fields, include, user_id))
+    return api_list_response(api_items(API_LIKES, rows, fields, include), next_cursor)
+
+
+# ==================== ПРОВЕРКА ИНДЕКСОВ ====================
+
+# Запросы маршрутов с типовыми параметрами - из тех же построителей запросов, что вызывают маршруты, поэтому
+# проверяется ровно то, что выполняется. Элемент возвращает запрос (выполняется с первой строкой) или сам
+# выполняет изменения - для несуществующих id; check_route_queries откатывает транзакцию
+def sample_cursor(sort_column):
+    """Курсор второй страницы для сортировки по sort_column и id"""
+    value = {datetime: datetime.utcnow(), int: 1, str: 'a'}[sort_column.type.python_type]
+    return encode_cursor(value, 1)
+
+
+def admin_list_queries(route, build, sort_columns, id_column, filters):
+    """Запросы списка админки: каждая сортировка в обе стороны, без фильтров и с фильтрами, со второй страницей"""
+    return [(route, lambda args=args, column=column, descending=descending, cursor=cursor:
+             keyset_statement(build(MultiDict(args)), column, id_column, cursor and sample_cursor(column),
+                              app.config['ADMIN_PER_PAGE'], descending))
+            for args in ({}, filters)
+            for column in sort_columns.values()
+            for descending in (True, False)
+            for cursor in (False, True)]
+
+
+def api_list_queries(route, resource, build, descending=True):
+    fields, include = list(resource.fields), list(resource.includes)
+    return [(route, lambda cursor=cursor: api_page_statement(resource, build(fields, include),
+                                                             cursor and sample_cursor(resource.model.created_at),
+                                                             app.config['API_PER_PAGE'], descending))
+            for cursor in (False, True)]
+
+
+def api_lookup_queries(route, resource):
+    """Запросы по id и по ?ids= со всеми полями и связанными данными"""
+    statement = api_statement(resource, list(resource.fields), list(resource.includes))
+    return [(route, lambda: api_one_statement(resource, statement, 1)),
+            (route, lambda: api_batch_statement(resource, statement, [1, 2]))]
+
+
+ROUTE_QUERIES = [
+    ('index', lambda: feed_stamp_statement(None)),
+    ('index', lambda: feed_stamp_statement(sample_cursor(Post.created_at))),
+    ('index', lambda: feed_statement(None)),
+    ('index', lambda: feed_statement(sample_cursor(Post.created_at))),
+    ('index', lambda: liked_statement(1, [1, 2])),
+    ('search', lambda: forum_search.search(db.session.connection(), 'пожар', 1, 0)),
+    ('view_post', lambda: post_stamp_statement(1)),
+    ('view_post', lambda: post_statement(1)),
+    ('view_post', lambda: comments_statement(1, None)),
+    ('view_post', lambda: comments_statement(1, sample_cursor(Comment.created_at))),
+    ('post_comments', lambda: comments_stamp_statement(1)),
+    ('like_post', lambda: like_state_statement(1, 1)),
+    ('like_post', lambda: toggle_like(0, 0)),
+    ('delete_post', lambda: delete_posts([0])),
+    ('delete_user', lambda: purge_user(0)),
+    ('ai_assistant', lambda: ai_comment_statement(1)),
+    ('ai_assistant_batch', lambda: ai_batch_statement(comment_ids=[1, 2])),
+    ('ai_assistant_batch', lambda: ai_batch_statement(post_id=1)),
+    ('profile', lambda: profile_posts_statement(1)),
+    ('admin_panel', recent_users_statement),
+    *admin_list_queries('admin_posts', admin_posts_statement, ADMIN_POST_SORTS, Post.id,
+                        {'q': 'пожар', 'author': 'admin'}),
+    *admin_list_queries('admin_comments', admin_comments_statement, ADMIN_COMMENT_SORTS, Comment.id,
+                        {'q': 'пожар', 'post_id': '1', 'anonymous': 'yes'}),
+    *admin_list_queries('admin_users', admin_users_statement, ADMIN_USER_SORTS, User.id,
+                        {'q': 'admin', 'role': 'user'}),
+    *api_list_queries('api_posts', API_POSTS, lambda fields, include: api_posts_statement(fields, include)),
+    *api_list_queries('api_posts', API_POSTS, lambda fields, include: api_posts_statement(fields, include, 1)),
+    *api_list_queries('api_post_comments', API_COMMENTS,
+                      lambda fields, include: api_post_comments_statement(fields, include, 1), descending=False),
+    *api_list_queries('api_user_likes', API_LIKES,
+                      lambda fields, include: api_user_likes_statement(fields, include, 1)),
+    *api_lookup_queries('api_posts', API_POSTS),
+    *api_lookup_queries('api_comments', API_COMMENTS),
+    *api_lookup_queries('api_users', API_USERS),
+]
+
+_checked_statements = set()
+query_plan_warnings = []
+# Маршрут запроса из ROUTE_QUERIES, который сейчас проверяется вне HTTP-запроса
+_checked_route = None
+
+
+# Полные сканирования таблиц в плане запроса (SCAN без USING INDEX).
+# Поиск MATCH по FTS5 выглядит как SCAN ... VIRTUAL TABLE INDEX - это обращение к полнотекстовому индексу
+def full_table_scans(dbapi_connection, statement, parameters):
+    rows = dbapi_connection.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+    return [row[3] for row in rows
+            if row[3].startswith('SCAN ') and ' USING ' not in row[3] and 'CONSTANT ROW' not in row[3]
+            and 'VIRTUAL TABLE INDEX' not in row[3]]
+
+
+def check_query_plan(conn, cursor, statement, parameters, context, executemany):
+    if not app.config['CHECK_QUERY_PLANS'] or executemany or statement in _checked_statements:
+        return
+    if not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+        return
+    _checked_statements.add(statement)
+
+    scans = full_table_scans(cursor.connection, statement, parameters)
+    if scans:
+        route = request.endpoint if has_request_context() else (_checked_route or 'cli')
+        query_plan_warnings.append((route, scans, statement))
+        app.logger.warning('Полное сканирование таблицы в %s: %s\n%s', route, '; '.join(scans), statement)
+
+
+def check_route_queries():
+    """Прогоняет запросы маршрутов через EXPLAIN QUERY PLAN и возвращает найденные сканирования"""
+    global _checked_route
+    _checked_statements.clear()
+    query_plan_warnings.clear()
+    enabled = app.config['CHECK_QUERY_PLANS']
+    app.config['CHECK_QUERY_PLANS'] = True
+    try:
+        for _checked_route, build in ROUTE_QUERIES:
+            statement = build()
+            if isinstance(statement, Executable):
+                db.session.execute(statement).first()
+    finally:
+        _checked_route = None
+        app.config['CHECK_QUERY_PLANS'] = enabled
+        db.session.rollback()
+    return list(query_plan_warnings)
+
+
+# Проверка индексов: flask --app main check-indexes
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    warnings = check_route_queries()
+    for route, scans, statement in warnings:
+        click.echo(f'[{route}] {"; ".join(scans)}')
+        click.echo(f'    {" ".join(statement.split())}')
+    if warnings:
+        raise SystemExit(f'Найдено полных сканирований таблиц: {len(warnings)}')
+    click.echo(f'Полных сканирований нет, проверено запросов: {len(ROUTE_QUERIES)}.')
+
+
+with app.app_context():
+    db.event.listen(db.engine, 'after_cursor_execute', check_query_plan)
+    db.event.listen(db.engine, 'before_cursor_execute', sql_started)
+    db.event.listen(db.engine, 'after_cursor_execute', sql_finished)
+    db.event.listen(db.engine, 'handle_error', sql_failed)
+    db.event.listen(OrmSession, 'do_orm_execute', track_lazy_load)
+    if app.config['CHECK_QUERY_PLANS']:
+        check_route_queries()
 
 
+# Сервер разработки; в production - python serve.py (несколько воркеров) или uvicorn asgi:application
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,95 @@
+# Метрики запросов в памяти процесса: гистограммы времени ответа и числа SQL-запросов по маршрутам,
+# суммарное время SQL и шаблонов, медленные запросы. Отдаются в текстовом формате Prometheus
+import threading
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+def label_string(labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped))
+
+
+class RequestMetrics:
+    def __init__(self, prefix='forum'):
+        self.prefix = prefix
+        self._requests = {}
+        self._latency = {}
+        self._queries = {}
+        self._sql_seconds = {}
+        self._render_seconds = {}
+        self._slow_queries = {}
+        self._lock = threading.Lock()
+
+    def observe_request(self, route, method, status, seconds, sql_count, sql_seconds, render_seconds):
+        with self._lock:
+            key = (route, method)
+            status_key = key + (status,)
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+            self._latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self._queries.setdefault(key, Histogram(QUERY_COUNT_BUCKETS)).observe(sql_count)
+            self._sql_seconds[key] = self._sql_seconds.get(key, 0) + sql_seconds
+            self._render_seconds[key] = self._render_seconds.get(key, 0) + render_seconds
+
+    def observe_slow_query(self, route):
+        with self._lock:
+            self._slow_queries[route] = self._slow_queries.get(route, 0) + 1
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus (text/plain; version=0.0.4)"""
+        lines = []
+        with self._lock:
+            self._counter(lines, 'requests_total', 'Обработанные HTTP-запросы',
+                          {('route', 'method', 'status'): self._requests})
+            self._histogram(lines, 'request_duration_seconds', 'Время ответа маршрута', self._latency)
+            self._histogram(lines, 'sql_queries_per_request', 'SQL-запросов за HTTP-запрос', self._queries)
+            self._counter(lines, 'sql_seconds_total', 'Суммарное время SQL-запросов',
+                          {('route', 'method'): self._sql_seconds})
+            self._counter(lines, 'template_render_seconds_total', 'Суммарное время рендеринга шаблонов',
+                          {('route', 'method'): self._render_seconds})
+            self._counter(lines, 'slow_queries_total', 'SQL-запросы медленнее порога SLOW_QUERY_MS',
+                          {('route',): {(route,): count for route, count in self._slow_queries.items()}})
+        return '\n'.join(lines) + '\n'
+
+    def _counter(self, lines, name, help_text, series):
+        name = f'{self.prefix}_{name}'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for label_names, values in series.items():
+            for key, value in sorted(values.items()):
+                lines.append(f'{name}{{{label_string(dict(zip(label_names, key)))}}} {value:g}')
+
+    def _histogram(self, lines, name, help_text, histograms):
+        name = f'{self.prefix}_{name}'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for (route, method), histogram in sorted(histograms.items()):
+            labels = label_string({'route': route, 'method': method})
+            for bound, count in histogram.cumulative():
+                lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum{{{labels}}} {histogram.sum:g}')
+            lines.append(f'{name}_count{{{labels}}} {histogram.count}')
@@ -0,0 +1,63 @@
+# Режим разработки и тестов: поиск N+1 (повторные ленивые загрузки одного отношения за запрос)
+# и бюджеты числа SQL-запросов маршрутов
+import os
+import sys
+
+# Имя представления -> допустимое число SQL-запросов за HTTP-запрос
+QUERY_BUDGETS = {}
+
+
+class NPlusOneDetected(Exception):
+    pass
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(limit):
+    """Объявляет бюджет маршрута; имя представления совпадает с endpoint"""
+    def decorator(f):
+        QUERY_BUDGETS[f.__name__] = limit
+        return f
+    return decorator
+
+
+def relationship_name(orm_execute_state):
+    """'Post.author' для ленивой загрузки отношения, иначе None"""
+    if not orm_execute_state.is_select or orm_execute_state.lazy_loaded_from is None:
+        return None
+    relationship = orm_execute_state.loader_strategy_path.path[-1]
+    return f'{relationship.parent.class_.__name__}.{relationship.key}'
+
+
+def caller_location(app_root):
+    """Строка шаблона, из которой пришла загрузка, или первая строка кода приложения"""
+    code_location = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        template = frame.f_globals.get('__jinja_template__')
+        if template is not None:
+            return f'{template.name or "<строка>"}:{template.get_corresponding_lineno(frame.f_lineno)}'
+        filename = frame.f_code.co_filename
+        if (code_location is None and filename.startswith(app_root) and filename != __file__
+                and 'site-packages' not in filename):
+            code_location = f'{os.path.relpath(filename, app_root)}:{frame.f_lineno} ({frame.f_code.co_name})'
+        frame = frame.f_back
+    return code_location or 'неизвестно'
+
+
+class LazyLoads:
+    """Ленивые загрузки за один HTTP-запрос: отношение -> число загрузок и место первой"""
+
+    def __init__(self):
+        self.counts = {}
+        self.locations = {}
+
+    def record(self, relationship, location):
+        self.counts[relationship] = self.counts.get(relationship, 0) + 1
+        self.locations.setdefault(relationship, location)
+
+    def repeated(self, threshold):
+        return [(relationship, count, self.locations[relationship])
+                for relationship, count in self.counts.items() if count >= threshold]
@@ -0,0 +1,111 @@
+# Полнотекстовый поиск по постам и комментариям на SQLite FTS5.
+# rowid в индексе: id * 2 для поста и id * 2 + 1 для комментария - так триггеры удаляют записи по ключу
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import text
+
+# Маркеры подсветки в ответе FTS5; заменяются на <mark> после экранирования HTML
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        title, body, post_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS post_search_insert AFTER INSERT ON post BEGIN
+        INSERT INTO search_index (rowid, title, body, post_id) VALUES (new.id * 2, new.title, new.content, new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS post_search_update AFTER UPDATE OF title, content ON post BEGIN
+        UPDATE search_index SET title = new.title, body = new.content WHERE rowid = old.id * 2;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS post_search_delete AFTER DELETE ON post BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 2;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS comment_search_insert AFTER INSERT ON comment BEGIN
+        INSERT INTO search_index (rowid, title, body, post_id) VALUES (new.id * 2 + 1, '', new.content, new.post_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS comment_search_update AFTER UPDATE OF content ON comment BEGIN
+        UPDATE search_index SET body = new.content WHERE rowid = old.id * 2 + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS comment_search_delete AFTER DELETE ON comment BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 2 + 1;
+    END""",
+]
+
+SEARCH_SQL = text("""
+    SELECT search_index.rowid AS rowid,
+           search_index.post_id AS post_id,
+           post.title AS post_title,
+           highlight(search_index, 0, :mark_start, :mark_end) AS title,
+           snippet(search_index, 1, :mark_start, :mark_end, '…', 24) AS snippet,
+           bm25(search_index, 4.0, 1.0) AS rank
+    FROM search_index
+    JOIN post ON post.id = search_index.post_id
+    WHERE search_index MATCH :match
+    ORDER BY rank
+    LIMIT :limit OFFSET :offset
+""")
+
+
+def create_search_index(connection):
+    """Создаёт индекс и триггеры синхронизации; возвращает True, если индекс создан впервые"""
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'")).first()
+    for statement in SCHEMA:
+        connection.execute(text(statement))
+    return exists is None
+
+
+def reindex(connection):
+    """Полностью перестраивает индекс из таблиц post и comment; возвращает число записей"""
+    connection.execute(text('DELETE FROM search_index'))
+    posts = connection.execute(text(
+        'INSERT INTO search_index (rowid, title, body, post_id) SELECT id * 2, title, content, id FROM post'))
+    comments = connection.execute(text(
+        "INSERT INTO search_index (rowid, title, body, post_id) SELECT id * 2 + 1, '', content, post_id FROM comment"))
+    connection.execute(text("INSERT INTO search_index (search_index) VALUES ('optimize')"))
+    return posts.rowcount + comments.rowcount
+
+
+def match_expression(query, max_terms=10):
+    """Превращает ввод пользователя в безопасное выражение MATCH: все слова, последнее - по префиксу"""
+    terms = re.findall(r'\w+', query)[:max_terms]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def highlighted(value):
+    return Markup(str(escape(value)).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+def search(connection, query, limit, offset=0):
+    """Результаты поиска по релевантности BM25: список словарей с подсвеченными фрагментами"""
+    match = match_expression(query)
+    if match is None:
+        return []
+
+    rows = connection.execute(SEARCH_SQL, {
+        'match': match,
+        'limit': limit,
+        'offset': offset,
+        'mark_start': MARK_START,
+        'mark_end': MARK_END,
+    })
+    results = []
+    for row in rows:
+        is_comment = row.rowid % 2 == 1
+        results.append({
+            'kind': 'comment' if is_comment else 'post',
+            'post_id': row.post_id,
+            'comment_id': row.rowid // 2 if is_comment else None,
+            'post_title': row.post_title,
+            'title': highlighted(row.title) if not is_comment else escape(row.post_title),
+            'snippet': highlighted(row.snippet),
+            'rank': row.rank,
+        })
+    return results
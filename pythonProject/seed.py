@@ -0,0 +1,105 @@
+# Синтетические данные форума для нагрузочных тестов: пользователи, посты, комментарии и лайки.
+# Строки пишутся пачками через executemany (Core, без ORM); счётчики считаются заранее в памяти,
+# поэтому пересчёт после заливки не нужен. Популярность постов и активность авторов неравномерны
+import random
+from datetime import datetime, timedelta
+
+WORDS = ('пожар газ утечка скорая помощь милиция вызов номер телефон служба дом подъезд соседи '
+         'квартира лифт свет вода отопление авария дорога машина ребёнок врач аптека больница '
+         'шум запах дым огонь электричество счётчик ремонт двор улица район город совет вопрос '
+         'спасибо ошибка проблема пароль данные безопасность как почему помогите').split()
+
+
+def skewed(rng, count):
+    # Номер от 1 до count, малые номера выпадают чаще: «вирусные» посты и активные пользователи
+    return 1 + int(count * rng.random() ** 3)
+
+
+def sentence(rng, length):
+    return ' '.join(rng.choices(WORDS, k=length))
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def seed(connection, tables, users, posts, comments, likes, password_hash, batch_size=10000, days=365,
+         rng=None, progress=None):
+    """Добавляет данные к уже существующим; tables - db.metadata.tables. Возвращает число вставленных строк"""
+    rng = rng or random.Random(42)
+    progress = progress or (lambda table, count: None)
+    user_table, post_table, comment_table, like_table = (
+        tables['user'], tables['post'], tables['comment'], tables['like'])
+
+    def next_id(table):
+        return (connection.execute(table.select().with_only_columns(table.c.id).order_by(table.c.id.desc())
+                                   .limit(1)).scalar() or 0) + 1
+
+    first_user, first_post, first_comment = next_id(user_table), next_id(post_table), next_id(comment_table)
+    started = datetime.utcnow() - timedelta(days=days)
+    step = timedelta(days=days) / max(posts, 1)
+
+    # Сначала только связи (кто, к какому посту), чтобы посчитать счётчики до вставки
+    post_authors = [skewed(rng, users) - 1 for _ in range(posts)]
+    comment_posts = [skewed(rng, posts) - 1 for _ in range(comments)]
+    comment_authors = [None if rng.random() < 0.1 else rng.randrange(users) for _ in range(comments)]
+    like_pairs = set()
+    attempts = 0
+    while len(like_pairs) < min(likes, users * posts) and attempts < likes * 3:
+        like_pairs.add(rng.randrange(users) * posts + skewed(rng, posts) - 1)
+        attempts += 1
+
+    user_posts, user_comments = [0] * users, [0] * users
+    post_comments, post_likes = [0] * posts, [0] * posts
+    for author in post_authors:
+        user_posts[author] += 1
+    for post, author in zip(comment_posts, comment_authors):
+        post_comments[post] += 1
+        if author is not None:
+            user_comments[author] += 1
+    for pair in like_pairs:
+        post_likes[pair % posts] += 1
+
+    def user_rows():
+        for index in range(users):
+            user_id = first_user + index
+            yield {'id': user_id, 'username': f'user{user_id}', 'email': f'user{user_id}@example.com',
+                   'password': password_hash, 'is_admin': False, 'is_moderator': index % 500 == 0,
+                   'created_at': started, 'post_count': user_posts[index], 'comment_count': user_comments[index]}
+
+    def post_rows():
+        for index, author in enumerate(post_authors):
+            yield {'id': first_post + index, 'title': sentence(rng, rng.randint(3, 8)).capitalize(),
+                   'content': sentence(rng, rng.randint(20, 120)), 'user_id': first_user + author,
+                   'created_at': started + step * index, 'like_count': post_likes[index],
+                   'comment_count': post_comments[index], 'version': 1, 'changed_at': None}
+
+    def comment_rows():
+        for index, (post, author) in enumerate(zip(comment_posts, comment_authors)):
+            yield {'id': first_comment + index, 'content': sentence(rng, rng.randint(5, 40)),
+                   'user_id': None if author is None else first_user + author, 'post_id': first_post + post,
+                   'is_anonymous': author is None, 'updated_at': None, 'edited_by_admin': False,
+                   'created_at': started + step * post + timedelta(minutes=rng.randint(1, 60 * 24 * 7))}
+
+    def like_rows():
+        for pair in like_pairs:
+            yield {'user_id': first_user + pair // posts, 'post_id': first_post + pair % posts,
+                   'created_at': started + step * (pair % posts)}
+
+    inserted = {}
+    for table, rows in ((user_table, user_rows()), (post_table, post_rows()),
+                        (comment_table, comment_rows()), (like_table, like_rows())):
+        count = 0
+        for batch in batches(rows, batch_size):
+            connection.execute(table.insert(), batch)
+            count += len(batch)
+            progress(table.name, count)
+        inserted[table.name] = count
+    return inserted
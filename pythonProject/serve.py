@@ -0,0 +1,457 @@
+# Запуск в production без отладчика и перезагрузчика: python serve.py --workers 4 --port 5000 [--asgi]
+# Мастер открывает сокет, загружает приложение, компилирует шаблоны и прогревает БД, затем запускает fork'ом
+# воркеры (по умолчанию - по числу доступных ядер). Воркеры принимают соединения с общего сокета:
+# многопоточный WSGI-сервер Werkzeug или, с --asgi, uvicorn с asgi.application. Кэши страниц, ролей и ответов ИИ
+# и состояние заданий ИИ и фоновых удалений - в общем хранилище: отдельный процесс на Unix-сокете (cache.SharedBackend).
+# Сессии Flask хранятся в подписанной cookie и от воркера не зависят.
+# Сигналы мастеру: HUP - плавная перезагрузка (мастер перезапускает себя с новым кодом на том же сокете,
+# поднимает новые воркеры и только потом останавливает старые), TERM и INT - плавная остановка.
+# Упавший воркер заменяется новым, как и зависший - не отчитавшийся дольше --timeout секунд.
+# Состояние мастера и воркеров - на /admin/workers
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from werkzeug.wsgi import ClosingIterator
+
+from cache import SharedBackend, serve_shared_store
+
+# Состояние, которое мастер передаёт себе при перезагрузке через exec
+STATE_ENV = 'FORUM_SERVE_STATE'
+
+log = logging.getLogger('serve')
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Многопроцессный запуск форума')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=available_cores(), help='число воркеров (по умолчанию - ядер)')
+    parser.add_argument('--asgi', action='store_true', help='воркеры uvicorn с asgi.application вместо WSGI')
+    parser.add_argument('--cache-entries', type=int, default=20000, help='записей в общем хранилище')
+    parser.add_argument('--timeout', type=float, default=30, help='секунд без отчёта, после которых воркер заменяется')
+    parser.add_argument('--graceful-timeout', type=float, default=30, help='секунд на завершение текущих запросов')
+    parser.add_argument('--stats-interval', type=float, default=2, help='как часто воркер отчитывается мастеру')
+    parser.add_argument('--access-log', action='store_true')
+    return parser.parse_args()
+
+
+def listen(host, port):
+    family = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0][0]
+    return socket.create_server((host, port), family=family, backlog=2048)
+
+
+def start_store(address, secret, max_entries):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            # Ctrl+C приходит всей группе процессов; хранилище мастер останавливает последним, по SIGTERM
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            serve_shared_store(address, secret, max_entries)
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def wait_for_store(store, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return store.size()
+        except (OSError, EOFError):
+            if time.monotonic() > deadline:
+                raise SystemExit(f'Общее хранилище не запустилось на {store.address}')
+            time.sleep(0.05)
+
+
+def warm_up(forum):
+    """Шаблоны компилируются, а БД открывается в мастере, до fork: воркеры начинают с готового"""
+    env = forum.app.jinja_env
+    for name in env.list_templates():
+        env.get_template(name)
+    forum.static_fragment('_sidebar.html')
+    forum.static_fingerprint('forum.css')
+    with forum.app.app_context():
+        # Схема, PRAGMA профиля БД и страницы индексов ленты - в кэше ОС до первого запроса
+        forum.db.session.execute(forum.feed_stamp_statement(None)).all()
+        forum.db.session.scalars(forum.feed_statement(None)).all()
+        forum.db.session.remove()
+        # Соединения не переживают fork: каждый воркер откроет свои
+        forum.db.engine.dispose()
+
+
+class RequestCounter:
+    """Запросы воркера: всего и обрабатываемые сейчас (для плавной остановки)"""
+
+    def __init__(self):
+        self.total = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def started(self):
+        with self._lock:
+            self.total += 1
+            self.in_flight += 1
+
+    def finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def wsgi(self, app):
+        def counted(environ, start_response):
+            self.started()
+            try:
+                # Запрос завершён, когда сервер отправил тело ответа и закрыл итератор
+                return ClosingIterator(app(environ, start_response), self.finished)
+            except BaseException:
+                self.finished()
+                raise
+        return counted
+
+    def asgi(self, app, heartbeat):
+        async def counted(scope, receive, send):
+            if scope['type'] == 'lifespan':
+                # Отчёт из цикла событий: заблокированный цикл перестанет отчитываться
+                asyncio.get_running_loop().create_task(heartbeat.run_async())
+                return await app(scope, receive, send)
+            self.started()
+            try:
+                await app(scope, receive, send)
+            finally:
+                self.finished()
+        return counted
+
+
+class Heartbeat:
+    """Отчёт воркера мастеру: счётчик heartbeat:<pid> и состояние worker:<pid> в общем хранилище.
+    Счётчики хранилища не вытесняются LRU, поэтому живость мастер проверяет по счётчику"""
+
+    def __init__(self, store, stats, interval, ttl):
+        self.store = store
+        self.stats = stats
+        self.interval = interval
+        self.ttl = ttl
+        self.next_at = 0
+        self.master_pid = os.getppid()
+
+    def beat(self):
+        if time.monotonic() < self.next_at:
+            return
+        self.next_at = time.monotonic() + self.interval
+        if os.getppid() != self.master_pid:
+            # Мастер погиб: воркер без присмотра плавно останавливается, как по SIGTERM
+            log.error('Мастер %s завершился, воркер %s останавливается', self.master_pid, os.getpid())
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+        try:
+            self.store.incr(f'heartbeat:{os.getpid()}')
+            self.store.set(f'worker:{os.getpid()}', self.stats(), ttl=self.ttl)
+        except (OSError, EOFError) as error:
+            # Хранилище перезапускается мастером; следующий удар сердца переподключится
+            log.warning('Воркер %s не смог отчитаться: %r', os.getpid(), error)
+        except Exception:
+            log.exception('Воркер %s не смог отчитаться', os.getpid())
+
+    async def run_async(self):
+        while True:
+            self.beat()
+            await asyncio.sleep(self.interval)
+
+
+def worker_stats(forum, engine, counter, mode, started_at):
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        'pid': os.getpid(),
+        'mode': mode,
+        'started_at': started_at,
+        'last_seen': time.time(),
+        'requests': counter.total,
+        'in_flight': counter.in_flight,
+        'threads': threading.active_count(),
+        'max_rss_kb': usage.ru_maxrss,
+        'cpu_seconds': round(usage.ru_utime + usage.ru_stime, 2),
+        'db_pool': engine.pool.status(),
+        'page_cache': forum.page_cache.stats(),
+        'ai_jobs': forum.ai_jobs.stats(),
+    }
+
+
+def run_worker(forum, listener, args):
+    # Обработчики сигналов мастера не наследуются: перезагрузкой и Ctrl+C управляет мастер
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # После fork у воркеров одинаковое состояние random, а паузы повтора записи должны различаться
+    random.seed()
+    if not args.access_log:
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    with forum.app.app_context():
+        engine = forum.db.engine
+    # Соединения пула открываются до первого запроса
+    connections = [engine.connect() for _ in range(getattr(engine.pool, 'size', lambda: 1)())]
+    for connection in connections:
+        connection.close()
+    if forum.like_buffer is not None:
+        # Поток буфера лайков остался в мастере
+        forum.like_buffer.start()
+
+    mode = 'asgi' if args.asgi else 'wsgi'
+    counter = RequestCounter()
+    started_at = time.time()
+    heartbeat = Heartbeat(forum.page_cache.backend, lambda: worker_stats(forum, engine, counter, mode, started_at),
+                          args.stats_interval, ttl=args.timeout * 2)
+    heartbeat.beat()
+    if args.asgi:
+        run_asgi_worker(listener, args, counter, heartbeat)
+    else:
+        run_wsgi_worker(forum, listener, args, counter, heartbeat)
+    if forum.like_buffer is not None:
+        forum.like_buffer.close()
+
+
+def run_wsgi_worker(forum, listener, args, counter, heartbeat):
+    from werkzeug.serving import make_server
+
+    server = make_server(args.host, args.port, counter.wsgi(forum.app), threaded=True, fd=listener.fileno())
+    # Отчёт из цикла приёма соединений: зависший цикл перестанет отчитываться
+    server.service_actions = heartbeat.beat
+
+    def stop(signum, frame):
+        # shutdown() ждёт выхода из serve_forever, поэтому вызывается не из обработчика сигнала
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    server.serve_forever()
+    # Новые соединения уже принимают другие воркеры; дожидаемся текущих запросов
+    deadline = time.monotonic() + args.graceful_timeout
+    while counter.in_flight and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def run_asgi_worker(listener, args, counter, heartbeat):
+    import uvicorn
+    import asgi
+
+    config = uvicorn.Config(counter.asgi(asgi.application, heartbeat), lifespan='on', log_level='warning',
+                            access_log=args.access_log, timeout_graceful_shutdown=args.graceful_timeout)
+    # SIGTERM uvicorn обрабатывает сам: перестаёт принимать соединения и дожидается текущих запросов
+    uvicorn.Server(config).run(sockets=[listener])
+
+
+class Master:
+    def __init__(self, forum, listener, args, store_pid, store_address, old_workers, generation):
+        self.forum = forum
+        self.listener = listener
+        self.args = args
+        self.store_pid = store_pid
+        self.store_address = store_address
+        self.store = forum.page_cache.backend
+        self.old_workers = set(old_workers)
+        self.generation = generation
+        # pid -> (последнее значение счётчика heartbeat, когда оно менялось, время запуска)
+        self.workers = {}
+        self.signals = []
+
+    def handle_signal(self, signum, frame):
+        self.signals.append(signum)
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.forum, self.listener, self.args)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                # Воркер не должен вернуться в цикл мастера
+                os._exit(code)
+        self.workers[pid] = (0, time.time(), time.time())
+
+    def run(self):
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.handle_signal)
+        for _ in range(self.args.workers):
+            self.spawn()
+        log.info('Мастер %s: %s воркеров %s на %s:%s', os.getpid(), len(self.workers),
+                 'asgi' if self.args.asgi else 'wsgi', self.args.host, self.args.port)
+        if self.old_workers:
+            self.stop_old_workers()
+
+        while True:
+            while self.signals:
+                signum = self.signals.pop(0)
+                if signum == signal.SIGHUP:
+                    self.reload()
+                else:
+                    self.stop()
+                    return
+            self.reap()
+            self.check_health()
+            self.publish()
+            time.sleep(0.5)
+
+    def stop_old_workers(self):
+        # Старые воркеры останавливаются, когда все новые начали отчитываться
+        deadline = time.monotonic() + self.args.timeout
+        while time.monotonic() < deadline and not all(
+                self.store.get_counter(f'heartbeat:{pid}') for pid in self.workers):
+            time.sleep(0.1)
+        log.info('Новые воркеры готовы, останавливаем старые: %s', sorted(self.old_workers))
+        for pid in self.old_workers:
+            self.kill(pid, signal.SIGTERM)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.old_workers.discard(pid)
+            if pid == self.store_pid:
+                log.error('Общее хранилище завершилось (код %s), запускаем заново', os.waitstatus_to_exitcode(status))
+                time.sleep(1)
+                self.store_pid = start_store(self.store_address, self.forum.app.config['SECRET_KEY'],
+                                             self.args.cache_entries)
+            elif pid in self.workers:
+                started_at = self.workers.pop(pid)[2]
+                log.warning('Воркер %s завершился (код %s), запускаем новый', pid, os.waitstatus_to_exitcode(status))
+                if time.time() - started_at < 1:
+                    # Воркер падает сразу после запуска - не запускаем новые в цикле без паузы
+                    time.sleep(1)
+                self.spawn()
+
+    def check_health(self):
+        now = time.time()
+        for pid, (beats, changed_at, started_at) in list(self.workers.items()):
+            try:
+                current = self.store.get_counter(f'heartbeat:{pid}')
+            except (OSError, EOFError):
+                return
+            if current != beats:
+                self.workers[pid] = (current, now, started_at)
+            elif now - changed_at > self.args.timeout:
+                log.error('Воркер %s не отчитывается %.0f с, заменяем', pid, now - changed_at)
+                self.kill(pid, signal.SIGKILL)
+                # Заменит reap(); до тех пор не убиваем повторно
+                self.workers[pid] = (current, float('inf'), started_at)
+
+    def publish(self):
+        try:
+            self.store.set('server', {
+                'master_pid': os.getpid(),
+                'mode': 'asgi' if self.args.asgi else 'wsgi',
+                'generation': self.generation,
+                'workers': sorted(self.workers),
+                'stopping_workers': sorted(self.old_workers),
+            })
+        except (OSError, EOFError) as error:
+            log.warning('Мастер не смог опубликовать состояние: %r', error)
+
+    def reload(self):
+        log.info('Перезагрузка: мастер перезапускается с новым кодом')
+        os.set_inheritable(self.listener.fileno(), True)
+        os.environ[STATE_ENV] = json.dumps({
+            'fd': self.listener.fileno(),
+            'store_pid': self.store_pid,
+            'store_address': self.store_address,
+            'old_workers': sorted(set(self.workers) | self.old_workers),
+            'generation': self.generation + 1,
+        })
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # pid не меняется, поэтому и старые воркеры, и хранилище остаются дочерними процессами
+        os.execv(sys.executable, [sys.executable] + sys.orig_argv[1:])
+
+    def stop(self):
+        log.info('Остановка: ждём завершения текущих запросов')
+        running = set(self.workers) | self.old_workers
+        for pid in running:
+            self.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        while running and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                running.discard(pid)
+            else:
+                time.sleep(0.05)
+        for pid in running:
+            log.warning('Воркер %s не завершился вовремя', pid)
+            self.kill(pid, signal.SIGKILL)
+        self.kill(self.store_pid, signal.SIGTERM)
+        try:
+            os.waitpid(self.store_pid, 0)
+        except ChildProcessError:
+            pass
+        shutil.rmtree(os.path.dirname(self.store_address), ignore_errors=True)
+
+    @staticmethod
+    def kill(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(process)d] %(message)s')
+    state = json.loads(os.environ.pop(STATE_ENV, 'null'))
+    if state:
+        listener = socket.socket(fileno=state['fd'])
+        os.set_inheritable(listener.fileno(), False)
+        store_address = state['store_address']
+    else:
+        listener = listen(args.host, args.port)
+        store_address = os.path.join(tempfile.mkdtemp(prefix='forum-cache-'), 'store.sock')
+
+    # Настройки приложения читаются из окружения при импорте
+    os.environ['FLASK_PAGE_CACHE_BACKEND'] = 'shared'
+    os.environ['FLASK_PAGE_CACHE_SOCKET'] = store_address
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main as forum
+    if args.asgi:
+        import asgi  # noqa: F401 - загружается до fork вместе с приложением
+
+    store_pid = state['store_pid'] if state else start_store(store_address, forum.app.config['SECRET_KEY'],
+                                                             args.cache_entries)
+    wait_for_store(SharedBackend(store_address, forum.app.config['SECRET_KEY']))
+    warm_up(forum)
+    Master(forum, listener, args, store_pid, store_address, state['old_workers'] if state else [],
+           state['generation'] if state else 1).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# Профиль SQLite для конкурентной нагрузки: PRAGMA на каждом новом соединении (WAL, synchronous=NORMAL,
+# busy_timeout, mmap, кэш страниц) и повтор записи с экспоненциальной паузой, если БД заблокирована
+import random
+import sqlite3
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+
+def production_pragmas(busy_timeout=5000, mmap_size=256 * 1024 * 1024, cache_size=-64000):
+    # cache_size < 0 - размер в КиБ, а не в страницах; journal_mode=WAL сохраняется в файле БД,
+    # остальные настройки действуют только в рамках соединения
+    return {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': busy_timeout,
+        'mmap_size': mmap_size,
+        'cache_size': cache_size,
+        'temp_store': 'MEMORY',
+    }
+
+
+def install_pragmas(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def is_locked(error):
+    """True, если ошибка - занятая другим соединением БД, а не ошибка в запросе"""
+    orig = getattr(error, 'orig', error)
+    return isinstance(orig, sqlite3.OperationalError) and (
+        'database is locked' in str(orig) or 'database table is locked' in str(orig))
+
+
+def retry_on_lock(func, attempts=5, delay=0.05, on_retry=None):
+    """Вызывает func(); при блокировке БД вызывает on_retry() (откат транзакции) и повторяет
+    с паузой delay * 2^попытка со случайной добавкой, чтобы конкуренты не просыпались одновременно"""
+    for attempt in range(attempts):
+        try:
+            return func()
+        except OperationalError as error:
+            if attempt == attempts - 1 or not is_locked(error):
+                raise
+            if on_retry is not None:
+                on_retry()
+            time.sleep(delay * 2 ** attempt * (1 + random.random()))
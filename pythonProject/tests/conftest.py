@@ -0,0 +1,36 @@
+# Общие фикстуры тестов: python -m pytest tests (из каталога pythonProject).
+# Приложение настраивается переменными FLASK_* до импорта main, как при обычном запуске: временная база
+# с синтетическими данными (seed-data), без кэша страниц, с QUERY_DEBUG_RAISE - N+1 и превышение
+# бюджета SQL-запросов маршрута становятся исключениями
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def forum(tmp_path_factory):
+    path = tmp_path_factory.mktemp('forum') / 'forum.db'
+    os.environ.update({
+        'FLASK_SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'FLASK_TESTING': 'true',
+        'FLASK_QUERY_DEBUG': 'true',
+        'FLASK_QUERY_DEBUG_RAISE': 'true',
+        'FLASK_PAGE_CACHE_ENABLED': 'false',
+    })
+    main = importlib.import_module('main')
+    result = main.app.test_cli_runner().invoke(
+        args=['seed-data', '--users', '20', '--posts', '60', '--comments', '300', '--likes', '400'])
+    assert result.exit_code == 0, result.output
+    return main
+
+
+@pytest.fixture
+def admin(forum):
+    """Тестовый клиент, вошедший администратором admin (создаётся seed-data)"""
+    client = forum.app.test_client()
+    assert client.post('/login', data={'username': 'admin', 'password': 'password'}).status_code == 302
+    return client
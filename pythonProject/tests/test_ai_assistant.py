@@ -0,0 +1,129 @@
+# JobQueue с управляемым источником ответов: источник ждёт сигнала, чтобы задания оставались в работе
+import threading
+
+import pytest
+
+from ai_assistant import JobQueue, QueueFull, ResponseCache
+
+
+class Source:
+    name = 'test'
+
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+
+    def respond(self, comment_text, post_title):
+        self.calls.append([comment_text])
+        self.release.wait(5)
+        return f'ответ: {comment_text}'
+
+    def respond_many(self, items):
+        self.calls.append([comment_text for comment_text, _ in items])
+        self.release.wait(5)
+        return [f'ответ: {comment_text}' for comment_text, _ in items]
+
+
+@pytest.fixture
+def source():
+    source = Source()
+    yield source
+    source.release.set()
+
+
+def make_queue(source, **kwargs):
+    return JobQueue(ResponseCache(source), **kwargs)
+
+
+def wait_idle(queue):
+    # Задание снимается с учёта очереди сразу после finish, уже в потоке пула
+    for _ in range(500):
+        if queue.stats()['in_flight'] == 0:
+            return True
+        threading.Event().wait(0.01)
+    return False
+
+
+def item(comment_id, revision='r1'):
+    return comment_id, revision, f'комментарий {comment_id}', 'Пост'
+
+
+def test_same_comment_joins_running_job(source):
+    queue = make_queue(source)
+    first = queue.submit(*item(1))
+    second = queue.submit(*item(1))
+    assert second is first
+    assert queue.coalesced == 1
+    source.release.set()
+    assert first.wait(5)
+    assert first.response == 'ответ: комментарий 1'
+    assert source.calls == [['комментарий 1']]
+
+
+def test_new_revision_is_a_separate_job(source):
+    queue = make_queue(source)
+    first = queue.submit(*item(1, 'r1'))
+    second = queue.submit(*item(1, 'r2'))
+    assert second is not first
+    assert queue.coalesced == 0
+
+
+def test_finished_job_is_served_from_cache(source):
+    queue = make_queue(source)
+    source.release.set()
+    assert queue.submit(*item(1)).wait(5)
+    job = queue.submit(*item(1))
+    assert job.status == 'done'
+    assert len(source.calls) == 1
+
+
+def test_max_pending_rejects_new_work(source):
+    queue = make_queue(source, max_workers=1, max_pending=2)
+    queue.submit(*item(1))
+    queue.submit(*item(2))
+    # Присоединение к идущему заданию не занимает место в очереди
+    queue.submit(*item(1))
+    with pytest.raises(QueueFull):
+        queue.submit(*item(3))
+    source.release.set()
+    assert wait_idle(queue)
+    assert queue.submit(*item(3)).wait(5)
+
+
+def test_submit_many_runs_one_batch_and_coalesces(source):
+    queue = make_queue(source)
+    running = queue.submit(*item(1))
+    jobs, rejected = queue.submit_many([item(1), item(2), item(3)])
+    assert rejected == []
+    assert jobs[1] is running
+    assert queue.coalesced == 1
+    source.release.set()
+    for job in jobs.values():
+        assert job.wait(5)
+    assert sorted(source.calls) == [['комментарий 1'], ['комментарий 2', 'комментарий 3']]
+    assert jobs[3].response == 'ответ: комментарий 3'
+
+
+def test_submit_many_respects_limit_and_max_pending(source):
+    queue = make_queue(source, max_pending=3)
+    jobs, rejected = queue.submit_many([item(1), item(2), item(3)], limit=2)
+    assert sorted(jobs) == [1, 2]
+    assert rejected == [3]
+    queue.submit(*item(4))
+    jobs, rejected = queue.submit_many([item(5), item(6)])
+    assert jobs == {}
+    assert rejected == [5, 6]
+
+
+def test_failed_batch_fails_every_job(source):
+    def broken(items):
+        raise RuntimeError('модель упала')
+
+    source.respond_many = broken
+    queue = make_queue(source)
+    jobs, _ = queue.submit_many([item(1), item(2)])
+    for job in jobs.values():
+        assert job.wait(5)
+        assert job.status == 'failed'
+        assert job.error == 'модель упала'
+    assert wait_idle(queue)
@@ -0,0 +1,132 @@
+# Хранилища кэша: LRU и ttl в памяти процесса, общее хранилище воркеров в отдельном процессе
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from cache import InProcessBackend, PageCache, SharedBackend, serve_shared_store
+
+SECRET = 'test-secret'
+# Хранилище запускается через fork, как мастером serve.py: регистрации хранилищ - замыкания
+fork = multiprocessing.get_context('fork')
+
+
+def test_lru_evicts_least_recently_used():
+    backend = InProcessBackend(max_entries=2)
+    backend.set('a', 1)
+    backend.set('b', 2)
+    assert backend.get('a') == 1
+    backend.set('c', 3)
+    assert backend.get('b') is None
+    assert backend.get('a') == 1
+    assert backend.size() == 2
+
+
+def test_counters_survive_eviction_and_clear_resets_them():
+    backend = InProcessBackend(max_entries=1)
+    page_cache = PageCache(backend)
+    page_cache.bump('posts')
+    for number in range(5):
+        backend.set(f'page:{number}', 'html')
+    assert page_cache.versions(['posts', 'likes']) == [1, 0]
+    backend.clear()
+    assert page_cache.versions(['posts']) == [0]
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    backend = InProcessBackend(max_entries=None)
+    backend.sweep_every = 3
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    backend.set('job', 'running', ttl=10)
+    backend.set('old', 'done', ttl=10)
+    now[0] += 5
+    assert backend.get('job') == 'running'
+    now[0] += 10
+    assert backend.get('job') is None
+    # Непрочитанная истёкшая запись убирается периодической чисткой при записи
+    assert backend.size() == 1
+    backend.set('new', 'done', ttl=10)
+    assert backend.size() == 1
+
+
+def test_unbounded_store_never_evicts():
+    backend = InProcessBackend(max_entries=None)
+    for number in range(5000):
+        backend.set(number, number, ttl=60)
+    assert backend.size() == 5000
+    assert backend.get(0) == 0
+
+
+@pytest.fixture
+def shared_store(tmp_path):
+    address = str(tmp_path / 'store.sock')
+    process = start_store(address)
+    yield address, process
+    process.kill()
+    process.join()
+
+
+def start_store(address, max_entries=5):
+    process = fork.Process(target=serve_shared_store, args=(address, SECRET, max_entries), daemon=True)
+    process.start()
+    for _ in range(500):
+        if os.path.exists(address):
+            break
+        time.sleep(0.01)
+    return process
+
+
+def test_shared_backend_roundtrip(shared_store):
+    address, _ = shared_store
+    backend = SharedBackend(address, SECRET)
+    backend.set('page', {'html': '<p>Пост</p>'}, ttl=60)
+    assert SharedBackend(address, SECRET).get('page') == {'html': '<p>Пост</p>'}
+    assert backend.incr('version:posts') == 1
+    assert SharedBackend(address, SECRET).get_counter('version:posts') == 1
+    backend.delete('page')
+    assert backend.get('page') is None
+
+
+def test_job_store_is_not_evicted_by_page_traffic(shared_store):
+    address, _ = shared_store
+    pages = SharedBackend(address, SECRET)
+    jobs = SharedBackend(address, SECRET, store='jobs')
+    jobs.set('job:1', {'status': 'running'}, ttl=60)
+    for number in range(50):
+        pages.set(f'page:{number}', 'html', ttl=60)
+    assert pages.size() == 5
+    assert jobs.get('job:1') == {'status': 'running'}
+    assert pages.get('job:1') is None
+
+
+def test_shared_backend_reconnects_after_restart(tmp_path):
+    address = str(tmp_path / 'store.sock')
+    process = start_store(address)
+    backend = SharedBackend(address, SECRET)
+    try:
+        backend.set('page', 'old')
+        process.kill()
+        process.join()
+        # Сокет убитого хранилища остаётся на диске: без удаления не дождаться нового
+        os.unlink(address)
+        process = start_store(address)
+        # Перезапущенное хранилище пустое, но подключение восстанавливается без ошибки
+        assert backend.get('page') is None
+        backend.set('page', 'new')
+        assert backend.get('page') == 'new'
+    finally:
+        process.kill()
+        process.join()
+
+
+def test_shared_backend_connects_again_after_fork(shared_store):
+    address, _ = shared_store
+    backend = SharedBackend(address, SECRET)
+    backend.set('page', 'master')
+    child = fork.Process(target=lambda: backend.set('page', f'worker {os.getpid()}'))
+    child.start()
+    child.join()
+    assert child.exitcode == 0
+    assert backend.get('page') == f'worker {child.pid}'
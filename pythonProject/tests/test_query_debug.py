@@ -0,0 +1,103 @@
+# Маршруты под QUERY_DEBUG_RAISE: ни один не превышает свой бюджет SQL-запросов (@query_budget)
+# и не загружает отношения по одному (N+1). Маршруты, меняющие данные, работают каждый со своими строками
+import pytest
+
+from query_debug import QUERY_BUDGETS, NPlusOneDetected, QueryBudgetExceeded
+
+# (метод, адрес, данные формы или JSON) - все маршруты с бюджетом, в порядке выполнения.
+# GET /edit_post не запрашивается: шаблон edit_post.html ссылается на comment и падает независимо от запросов
+ROUTES = [
+    ('GET', '/', None),
+    ('GET', '/post/1', None),
+    ('POST', '/post/2', {'content': 'Комментарий из теста'}),
+    ('GET', '/post/1/comments', None),
+    ('GET', '/search?q=пожар', None),
+    ('GET', '/profile', None),
+    ('GET', '/create_post', None),
+    ('POST', '/create_post', {'title': 'Пост из теста', 'content': 'Текст поста из теста'}),
+    ('POST', '/edit_post/3', {'title': 'Новый заголовок', 'content': 'Новый текст'}),
+    ('GET', '/edit_comment/3', None),
+    ('POST', '/edit_comment/3', {'content': 'Новый текст комментария'}),
+    ('GET', '/like_post/4', None),
+    ('POST', '/api/posts/5/like', None),
+    ('GET', '/delete_comment/10', None),
+    ('GET', '/delete_post/10', None),
+    ('GET', '/ai_assistant/1', None),
+    ('POST', '/ai_assistant/batch', {'post_id': 1}),
+    ('POST', '/ai_assistant/batch', {'comment_ids': [1, 2, 3], 'cached_only': True}),
+    ('GET', '/ai_assistant/jobs/missing', None),
+    ('GET', '/api/v1/posts?include=author,counts,liked', None),
+    ('GET', '/api/v1/posts?ids=1,2,3&include=author', None),
+    ('GET', '/api/v1/posts/1?include=counts,liked', None),
+    ('GET', '/api/v1/posts/1/comments?include=author,post', None),
+    ('GET', '/api/v1/comments?ids=1,2,3', None),
+    ('GET', '/api/v1/comments/1?include=author', None),
+    ('GET', '/api/v1/users?ids=1,2&include=counts', None),
+    ('GET', '/api/v1/users/1', None),
+    ('GET', '/api/v1/users/1/likes?include=post', None),
+    ('GET', '/admin', None),
+    ('GET', '/admin/posts', None),
+    ('GET', '/admin/comments', None),
+    ('GET', '/admin/users', None),
+    ('GET', '/admin/purge_jobs', None),
+    ('GET', '/admin/cache_stats', None),
+    ('GET', '/admin/like_buffer_stats', None),
+    ('GET', '/admin/workers', None),
+    ('GET', '/metrics', None),
+    ('GET', '/admin/edit_post/6', None),
+    ('POST', '/admin/edit_post/6', {'title': 'Заголовок от администратора', 'content': 'Текст от администратора'}),
+    ('GET', '/admin/edit_comment/6', None),
+    ('POST', '/admin/edit_comment/6', {'content': 'Комментарий от администратора'}),
+    ('GET', '/admin/make_moderator/5', None),
+    ('GET', '/admin/remove_moderator/5', None),
+    ('GET', '/admin/make_admin/6', None),
+    ('GET', '/admin/remove_admin/6', None),
+    ('GET', '/admin/delete_comment/20', None),
+    ('GET', '/admin/delete_post/20', None),
+    ('GET', '/admin/delete_user/19', None),
+    ('GET', '/login', None),
+    ('GET', '/register', None),
+    ('POST', '/register', {'username': 'tester', 'email': 'tester@example.com', 'password': 'secret'}),
+    ('GET', '/logout', None),
+]
+
+
+def endpoint(forum, method, url):
+    return forum.app.url_map.bind('localhost').match(url.split('?')[0], method=method)[0]
+
+
+def test_every_budgeted_route_is_requested(forum):
+    assert set(QUERY_BUDGETS) - {endpoint(forum, method, url) for method, url, _ in ROUTES} == set()
+
+
+@pytest.mark.parametrize('method, url, data', ROUTES, ids=[f'{method} {url}' for method, url, _ in ROUTES])
+def test_route_within_query_budget(admin, method, url, data):
+    # Превышение бюджета или N+1 поднимает исключение из after_request, и запрос падает
+    if data is None:
+        response = admin.open(url, method=method)
+    elif url.startswith('/ai_assistant/'):
+        response = admin.open(url, method=method, json=data)
+    else:
+        response = admin.open(url, method=method, data=data)
+    assert response.status_code < 500
+
+
+def test_lazy_loads_in_a_loop_raise(forum):
+    # Комментарии разных постов: каждый comment.post - отдельный ленивый SELECT
+    with forum.app.test_request_context('/static/forum.css'):
+        forum.app.preprocess_request()
+        comments = forum.db.session.scalars(
+            forum.db.select(forum.Comment).group_by(forum.Comment.post_id).limit(3)).all()
+        for comment in comments:
+            comment.post.title
+        with pytest.raises(NPlusOneDetected):
+            forum.app.process_response(forum.app.response_class())
+
+
+def test_query_budget_exceeded_raises(forum):
+    with forum.app.test_request_context('/admin/cache_stats'):
+        forum.app.preprocess_request()
+        for _ in range(QUERY_BUDGETS['admin_cache_stats'] + 1):
+            forum.db.session.execute(forum.db.select(1))
+        with pytest.raises(QueryBudgetExceeded):
+            forum.app.process_response(forum.app.response_class())
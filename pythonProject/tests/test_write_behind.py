@@ -0,0 +1,138 @@
+# LikeBuffer без БД: flush пишет пачки в словарь, который играет роль таблицы like
+import threading
+
+import pytest
+
+from write_behind import LikeBuffer
+
+
+class Table:
+    def __init__(self, fail=False):
+        self.rows = set()
+        self.batches = []
+        self.fail = fail
+
+    def flush(self, changes, commit):
+        if self.fail:
+            raise RuntimeError('БД недоступна')
+        self.batches.append(dict(changes))
+        commit(lambda: self.apply(changes))
+
+    def apply(self, changes):
+        for key, liked in changes.items():
+            (self.rows.add if liked else self.rows.discard)(key)
+
+    def count(self, buffer, post_id):
+        stored = sum(1 for _, post in self.rows if post == post_id)
+        return stored + buffer.deltas({post_id}).get(post_id, 0)
+
+
+def test_toggles_back_to_stored_state_cancel_out():
+    table = Table()
+    buffer = LikeBuffer(table.flush)
+    assert buffer.toggle(1, 10, stored=False) is True
+    assert buffer.toggle(1, 10, stored=False) is False
+    assert buffer.flush() == 0
+    assert table.batches == []
+    assert buffer.stats()['cancelled'] == 1
+
+
+def test_reads_see_pending_likes_until_flush():
+    table = Table()
+    buffer = LikeBuffer(table.flush)
+    buffer.toggle(1, 10, stored=False)
+    buffer.toggle(2, 10, stored=False)
+    assert buffer.liked(1, [10, 11], stored=set()) == {10}
+    assert table.count(buffer, 10) == 2
+    assert buffer.flush() == 2
+    assert table.rows == {(1, 10), (2, 10)}
+    assert buffer.deltas() == {}
+    assert table.count(buffer, 10) == 2
+
+
+def test_toggle_during_flush_counts_from_written_state():
+    table = Table()
+    buffer = LikeBuffer(table.flush)
+    buffer.toggle(1, 10, stored=False)
+    entered, release = threading.Event(), threading.Event()
+
+    def slow_flush(changes, commit):
+        entered.set()
+        release.wait(5)
+        table.flush(changes, commit)
+
+    buffer.flush_changes = slow_flush
+    worker = threading.Thread(target=buffer.flush)
+    worker.start()
+    assert entered.wait(5)
+    # Лайк уже в пишущейся пачке: повторный toggle снимает его поверх неё
+    assert buffer.toggle(1, 10, stored=False) is False
+    assert table.count(buffer, 10) == 0
+    release.set()
+    worker.join()
+    assert table.rows == {(1, 10)}
+    assert table.count(buffer, 10) == 0
+    buffer.flush_changes = table.flush
+    buffer.flush()
+    assert table.rows == set()
+
+
+def test_count_is_exact_while_commit_runs():
+    # Между commit и очисткой пачки читатель не должен сложить записанные строки с той же пачкой
+    table = Table()
+    buffer = LikeBuffer(table.flush)
+    buffer.toggle(1, 10, stored=False)
+    counts = []
+
+    def commit_and_read(changes, commit):
+        def write():
+            table.apply(changes)
+            reader = threading.Thread(target=lambda: counts.append(table.count(buffer, 10)))
+            reader.start()
+            reader.join(0.1)
+            write.reader = reader
+        commit(write)
+        write.reader.join(5)
+
+    buffer.flush_changes = commit_and_read
+    buffer.flush()
+    assert counts == [1]
+
+
+def test_failed_flush_returns_batch_and_keeps_newer_toggles():
+    table = Table(fail=True)
+    buffer = LikeBuffer(table.flush)
+    buffer.toggle(1, 10, stored=False)
+    buffer.toggle(2, 10, stored=False)
+    with pytest.raises(RuntimeError):
+        buffer.flush()
+    assert buffer.stats()['failed_batches'] == 1
+    assert buffer.deltas() == {10: 2}
+    table.fail = False
+    assert buffer.flush() == 2
+    assert table.rows == {(1, 10), (2, 10)}
+
+
+def test_close_flushes_everything():
+    table = Table()
+    buffer = LikeBuffer(table.flush, interval=60)
+    buffer.start()
+    buffer.toggle(1, 10, stored=False)
+    buffer.close()
+    assert table.rows == {(1, 10)}
+
+
+def test_background_thread_flushes_on_max_events():
+    table = Table()
+    buffer = LikeBuffer(table.flush, interval=60, max_events=3)
+    buffer.start()
+    try:
+        for user_id in range(3):
+            buffer.toggle(user_id, 10, stored=False)
+        for _ in range(500):
+            if table.batches:
+                break
+            threading.Event().wait(0.01)
+        assert table.batches == [{(0, 10): True, (1, 10): True, (2, 10): True}]
+    finally:
+        buffer.close()
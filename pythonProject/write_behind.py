@@ -0,0 +1,158 @@
+# Отложенная запись лайков: намерения (поставить/снять) копятся в памяти и записываются одной транзакцией
+# раз в interval секунд или по накоплении max_events событий. Переключения, вернувшие лайк в сохранённое
+# в БД состояние, взаимно уничтожаются и в БД не попадают
+import threading
+import time
+from collections import deque
+
+
+class LikeBuffer:
+    def __init__(self, flush, interval=0.2, max_events=500, history=100):
+        # flush(changes, commit) записывает {(user_id, post_id): поставлен ли лайк} и фиксирует транзакцию
+        # через commit(функция commit сессии) - см. _commit
+        self.flush_changes = flush
+        self.interval = interval
+        self.max_events = max_events
+        # (user_id, post_id) -> (состояние в БД, желаемое состояние)
+        self._pending = {}
+        # Пачка, которая сейчас пишется: видна читателям до commit и убирается вместе с ним
+        self._flushing = {}
+        self._events = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self.batch_sizes = deque(maxlen=history)
+        self.stats_counters = {'events': 0, 'cancelled': 0, 'batches': 0, 'written': 0, 'failed_batches': 0}
+        self.last_flush_ms = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='like-buffer', daemon=True)
+        self._thread.start()
+
+    def _state(self, key):
+        entry = self._pending.get(key) or self._flushing.get(key)
+        return entry and entry[1]
+
+    def toggle(self, user_id, post_id, stored):
+        """Переключает лайк; stored - есть ли лайк в БД. Возвращает новое состояние с учётом буфера"""
+        key = (user_id, post_id)
+        with self._lock:
+            current = self._state(key)
+            if current is None:
+                current = stored
+            desired = not current
+            # Состояние, которое будет в БД после записи уже отправленных пачек
+            if key in self._pending:
+                base = self._pending[key][0]
+            elif key in self._flushing:
+                base = self._flushing[key][1]
+            else:
+                base = stored
+            if desired == base:
+                del self._pending[key]
+                self.stats_counters['cancelled'] += 1
+            else:
+                self._pending[key] = (base, desired)
+            self._events += 1
+            self.stats_counters['events'] += 1
+            if self._events >= self.max_events:
+                self._wakeup.notify()
+        return desired
+
+    def liked(self, user_id, post_ids, stored):
+        """Id постов из post_ids, лайкнутых пользователем, с учётом буфера; stored - множество из БД"""
+        with self._lock:
+            result = set()
+            for post_id in post_ids:
+                state = self._state((user_id, post_id))
+                if state if state is not None else post_id in stored:
+                    result.add(post_id)
+            return result
+
+    def deltas(self, post_ids=None):
+        """Изменение числа лайков постов, ещё не записанное в БД: {post_id: delta}"""
+        with self._lock:
+            result = {}
+            # Записи в _pending отсчитываются от состояния после пишущейся пачки, поэтому складываются с ней
+            for entries in (self._flushing, self._pending):
+                for (user_id, post_id), (base, desired) in entries.items():
+                    if post_ids is None or post_id in post_ids:
+                        result[post_id] = result.get(post_id, 0) + (1 if desired else -1)
+            return result
+
+    def flush(self):
+        # Одна пачка за раз: пока пачка пишется, новые события копятся в _pending
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+                self._events = 0
+                batch = self._flushing
+            started = time.perf_counter()
+            try:
+                self.flush_changes({key: desired for key, (base, desired) in batch.items()}, self._commit)
+            except Exception:
+                # Возвращаем пачку в буфер, кроме ключей, которые успели переключить снова.
+                # Если ошибка случилась уже после commit (_commit убрал пачку), возвращать нечего
+                with self._lock:
+                    if self._flushing is batch:
+                        for key, entry in batch.items():
+                            if key in self._pending:
+                                self._pending[key] = (entry[0], self._pending[key][1])
+                                if self._pending[key][0] == self._pending[key][1]:
+                                    del self._pending[key]
+                            else:
+                                self._pending[key] = entry
+                        self._flushing = {}
+                    self.stats_counters['failed_batches'] += 1
+                raise
+            with self._lock:
+                self.batch_sizes.append(len(batch))
+                self.stats_counters['batches'] += 1
+                self.stats_counters['written'] += len(batch)
+                self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+            return len(batch)
+
+    def _commit(self, commit):
+        # commit выполняется под блокировкой буфера, и пачка убирается в том же критическом участке: иначе
+        # между commit и очисткой читатель сложил бы уже записанные в БД счётчики с той же пачкой из deltas().
+        # В БД попадает только применимое (лайки удалённых постов отбрасываются), и после commit счётчики
+        # в БД точны - поэтому пачка убирается целиком
+        with self._lock:
+            commit()
+            self._flushing = {}
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._closed and self._events < self.max_events:
+                    self._wakeup.wait(self.interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                # Пачка вернулась в буфер; следующая попытка - через interval
+                time.sleep(self.interval)
+
+    def close(self):
+        """Останавливает фоновый поток и записывает всё накопленное"""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            sizes = list(self.batch_sizes)
+            return dict(self.stats_counters,
+                        pending=len(self._pending),
+                        last_flush_ms=self.last_flush_ms,
+                        batch_size_avg=round(sum(sizes) / len(sizes), 1) if sizes else None,
+                        batch_size_max=max(sizes, default=None),
+                        recent_batch_sizes=sizes[-10:])